@@ -0,0 +1,256 @@
+"""
+Times the dashboard's hot queries and the billing computation against a
+database (normally one built by generate_synthetic_db.py) and reports
+latency percentiles for each.
+
+    python benchmark.py --db synthetic.db --json results/v1.4.json
+    python benchmark.py --db synthetic.db --compare results/v1.4.json
+
+With --compare, each benchmark's p50 and p95 are shown next to the saved
+run, and the script exits non-zero if any p50 got slower by more than
+--threshold percent, so it can gate a release.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import billing_engine
+import billing_summary
+import cipher_key
+import search_index
+from pagination import CLIENT_SECTIONS
+
+try:
+    from sqlcipher3 import dbapi2 as sqlite3
+except ImportError:
+    print("Error: sqlcipher3-wheels is not installed. Please install it using: pip install sqlcipher3-wheels", file=sys.stderr)
+    sys.exit(1)
+
+# --- Configuration ---
+DEFAULT_DB = "synthetic.db"
+DEFAULT_PASSWORD = "benchmark"
+DEFAULT_ITERATIONS = 50
+DEFAULT_THRESHOLD = 10.0 # percent
+PERCENTILES = (50, 90, 95, 99)
+# Opening a connection with the password runs SQLCipher's key derivation, and
+# a full summary refresh rewrites every client; both are too slow to repeat as often.
+SLOW_BENCHMARK_ITERATIONS = 5
+
+
+def open_connection(path, password):
+    con = sqlite3.connect(path, check_same_thread=False)
+    con.execute(f"PRAGMA key = '{password}';")
+    con.execute("SELECT count(*) FROM sqlite_master;").fetchone()
+    con.row_factory = sqlite3.Row
+    return con
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    result = {'n': len(ordered), 'min': ordered[0], 'mean': sum(ordered) / len(ordered), 'max': ordered[-1]}
+    for pct in PERCENTILES:
+        result[f'p{pct}'] = percentile(ordered, pct)
+    return result
+
+
+def run(func, iterations, warmup=1):
+    """Calls `func(i)` `iterations` times after `warmup` untimed calls; returns milliseconds per call."""
+    for i in range(warmup):
+        func(i)
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def define_benchmarks(con, db_path, password, rng):
+    """Returns [(name, func(i), iterations or None for the default)]."""
+    accounts = [row[0] for row in con.execute("SELECT account_number FROM client_billing_summary")]
+    if not accounts:
+        sys.exit("Error: The database has no clients. Run generate_synthetic_db.py first.")
+    # The largest clients are the worst case for the detail page.
+    largest = [row[0] for row in con.execute("""
+        SELECT company_account_number FROM assets GROUP BY company_account_number ORDER BY COUNT(*) DESC LIMIT 10
+    """)] or accounts[:10]
+    search_terms = [row[0].split()[0] for row in con.execute("SELECT name FROM companies ORDER BY random() LIMIT 20")]
+    search_terms += [row[0][:8] for row in con.execute("SELECT hostname FROM assets ORDER BY random() LIMIT 20")]
+    page_count = max(1, len(accounts) // 100)
+
+    def pick(sequence):
+        return sequence[rng.randrange(len(sequence))]
+
+    def detail_page(section, account_pool):
+        def bench(i):
+            account = pick(account_pool)
+            CLIENT_SECTIONS[section].fetch_page(con, account)
+            CLIENT_SECTIONS[section].count(con, account)
+        return bench
+
+    def refresh_summary(account_numbers):
+        def bench(i):
+            billing_summary.refresh_client_billing_summary(con, account_numbers() if account_numbers else None)
+            con.rollback()
+        return bench
+
+    def billing_totals(i):
+        clients = billing_engine.load_client_columns(con)
+        prices = billing_engine.plan_columns(clients['plan_key'], billing_engine.load_plans(con))
+        billing_engine.compute_totals(
+            prices['billed_by'], prices['base_price'], prices['per_user_cost'],
+            prices['per_server_cost'], prices['per_workstation_cost'],
+            clients['user_count'], clients['server_count'], clients['workstation_count']
+        )
+
+    def simulate(i):
+        plans = billing_engine.load_plans(con)
+        candidate = {key: dict(plan, base_price=plan['base_price'] + 10) for key, plan in plans.items()}
+        billing_engine.simulate_plans(con, candidate)
+
+    raw_key = cipher_key.derive_raw_key(db_path, password)
+
+    def open_with_raw_key(i):
+        raw = sqlite3.connect(db_path, check_same_thread=False)
+        cipher_key.unlock(raw, raw_key)
+        raw.close()
+
+    return [
+        ('open_connection', lambda i: open_connection(db_path, password).close(), SLOW_BENCHMARK_ITERATIONS),
+        ('open_connection_raw_key', open_with_raw_key, None),
+        ('clients_query', lambda i: billing_summary.fetch_clients_page(con), None),
+        ('clients_query_sorted_deep_page', lambda i: billing_summary.fetch_clients_page(
+            con, sort='total_bill', order='desc', offset=pick(range(page_count)) * 100), None),
+        ('clients_search', lambda i: billing_summary.fetch_clients_page(
+            con, search_index.build_match_query(pick(search_terms))), None),
+        ('client_assets_page', detail_page('assets', accounts), None),
+        ('client_assets_page_largest', detail_page('assets', largest), None),
+        ('client_users_page', detail_page('users', accounts), None),
+        ('client_hours_page', detail_page('hours', accounts), None),
+        ('billing_totals', billing_totals, None),
+        ('simulate_plans', simulate, None),
+        ('summary_refresh_one_client', refresh_summary(lambda: [pick(accounts)]), None),
+        ('summary_refresh_all', refresh_summary(None), SLOW_BENCHMARK_ITERATIONS),
+    ]
+
+
+def print_results(results, baseline=None):
+    header = f"{'benchmark':<32} {'n':>4} {'min':>9} {'p50':>9} {'p90':>9} {'p95':>9} {'p99':>9} {'max':>9}"
+    if baseline:
+        header += f" {'p50 vs base':>12} {'p95 vs base':>12}"
+    print(header)
+    print("-" * len(header))
+    for name, stats in results.items():
+        line = f"{name:<32} {stats['n']:>4}" + "".join(
+            f" {stats[key]:>9.2f}" for key in ('min', 'p50', 'p90', 'p95', 'p99', 'max'))
+        base = (baseline or {}).get(name)
+        if base:
+            line += "".join(f" {_change(stats[key], base[key]):>12}" for key in ('p50', 'p95'))
+        print(line)
+    print("(all times in milliseconds)")
+
+
+def _change(value, base):
+    if not base:
+        return "n/a"
+    return f"{(value - base) / base * 100:+.1f}%"
+
+
+def regressions(results, baseline, threshold):
+    """Returns the names of benchmarks whose p50 is more than `threshold` percent slower than the baseline."""
+    return [
+        name for name, stats in results.items()
+        if name in baseline and baseline[name]['p50'] and (stats['p50'] - baseline[name]['p50']) / baseline[name]['p50'] * 100 > threshold
+    ]
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's queries and billing computation.")
+    parser.add_argument('--db', default=DEFAULT_DB, help=f"Database to benchmark (default: {DEFAULT_DB}).")
+    parser.add_argument('--password', default=os.environ.get('SYNTHETIC_DB_PASSWORD', DEFAULT_PASSWORD),
+                        help="Database master password (default: $SYNTHETIC_DB_PASSWORD or 'benchmark').")
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help=f"Timed runs per benchmark (default: {DEFAULT_ITERATIONS}).")
+    parser.add_argument('--only', action='append', help="Run only the named benchmark (repeatable).")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for picking clients and search terms.")
+    parser.add_argument('--json', dest='json_path', help="Write the results to this JSON file.")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against.")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"p50 slowdown in percent that counts as a regression (default: {DEFAULT_THRESHOLD}).")
+    args = parser.parse_args()
+
+    print(" Billing Dashboard Benchmark")
+    print("==========================================")
+    if not os.path.exists(args.db):
+        sys.exit(f"Error: Database file '{args.db}' not found. Run generate_synthetic_db.py first.")
+
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.compare, encoding='utf-8') as f:
+                baseline = json.load(f)['results']
+        except (OSError, ValueError, KeyError) as e:
+            sys.exit(f"Error: Could not read baseline '{args.compare}': {e}")
+
+    try:
+        con = open_connection(args.db, args.password)
+    except sqlite3.DatabaseError as e:
+        sys.exit(f"Error: Could not open '{args.db}': {e}. Is the password correct?")
+
+    benchmarks = define_benchmarks(con, args.db, args.password, random.Random(args.seed))
+    if args.only:
+        unknown = set(args.only) - {name for name, _, _ in benchmarks}
+        if unknown:
+            sys.exit(f"Error: Unknown benchmark(s): {', '.join(sorted(unknown))}.")
+        benchmarks = [b for b in benchmarks if b[0] in args.only]
+
+    counts = {
+        table: con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ('companies', 'assets', 'users', 'ticket_work_hours')
+    }
+    print("Dataset: " + ", ".join(f"{count} {table}" for table, count in counts.items()) + "\n")
+
+    results = {}
+    for name, func, iterations in benchmarks:
+        print(f"Running {name}...", end=" ", flush=True)
+        samples = run(func, min(iterations or args.iterations, args.iterations))
+        results[name] = summarize(samples)
+        print(f"p50 {results[name]['p50']:.2f} ms")
+    con.close()
+
+    print()
+    print_results(results, baseline)
+
+    if args.json_path:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json_path)), exist_ok=True)
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'database': os.path.basename(args.db),
+                'dataset': counts,
+                'iterations': args.iterations,
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'results': results,
+            }, f, indent=2)
+        print(f"\nResults written to '{args.json_path}'.")
+
+    if baseline:
+        slower = regressions(results, baseline, args.threshold)
+        if slower:
+            print(f"\n❌ p50 regressed by more than {args.threshold:.0f}%: {', '.join(slower)}")
+            sys.exit(1)
+        print(f"\n✅ No p50 regressions beyond {args.threshold:.0f}%.")
@@ -0,0 +1,129 @@
+"""
+Column-wise billing calculations.
+
+Totals for every client are computed at once from parallel arrays (one entry
+per client) instead of looping over rows, which makes it cheap to re-price the
+whole client base under a candidate set of billing plans ("what if" runs)
+without touching the database.
+"""
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    print("Error: numpy is not installed. Please install it using: pip install numpy", file=sys.stderr)
+    sys.exit(1)
+
+
+NOT_CONFIGURED = 'Not Configured'
+PLAN_FIELDS = ('billed_by', 'base_price', 'per_user_cost', 'per_server_cost', 'per_workstation_cost')
+
+CLIENT_COLUMNS_QUERY = """
+    SELECT account_number, name, contract_type, billing_plan,
+           user_count, server_count, workstation_count, total_bill
+    FROM client_billing_summary
+"""
+
+
+def compute_totals(billed_by, base_price, per_user_cost, per_server_cost, per_workstation_cost,
+                   user_count, server_count, workstation_count):
+    """
+    Returns the monthly total for every client. All arguments are equal-length
+    sequences. 'Per User' plans add users x per-user cost, 'Per Device' plans
+    add workstations and servers at their own rates, and every other plan
+    (Flat Rate, Not Billed, Not Configured) bills the base price only.
+    """
+    billed_by = np.asarray(billed_by, dtype=object)
+    user_count = np.asarray(user_count, dtype=float)
+    server_count = np.asarray(server_count, dtype=float)
+    workstation_count = np.asarray(workstation_count, dtype=float)
+
+    per_user = user_count * np.asarray(per_user_cost, dtype=float)
+    per_device = (workstation_count * np.asarray(per_workstation_cost, dtype=float)
+                  + server_count * np.asarray(per_server_cost, dtype=float))
+    return (np.asarray(base_price, dtype=float)
+            + np.where(billed_by == 'Per User', per_user, 0.0)
+            + np.where(billed_by == 'Per Device', per_device, 0.0))
+
+
+def load_plans(db_connection):
+    """Returns the saved billing plans as {(contract_type, billing_plan): {field: value}}."""
+    cur = db_connection.cursor()
+    cur.execute(f"SELECT contract_type, billing_plan, {', '.join(PLAN_FIELDS)} FROM billing_plans")
+    return {(row[0], row[1]): dict(zip(PLAN_FIELDS, row[2:])) for row in cur.fetchall()}
+
+
+def load_client_columns(db_connection):
+    """Reads the per-client counts from client_billing_summary as parallel columns."""
+    cur = db_connection.cursor()
+    cur.execute(CLIENT_COLUMNS_QUERY)
+    rows = cur.fetchall()
+    columns = list(zip(*rows)) if rows else [()] * 8
+    return {
+        'account_number': list(columns[0]),
+        'name': list(columns[1]),
+        'plan_key': list(zip(columns[2], columns[3])),
+        'user_count': np.asarray(columns[4], dtype=float),
+        'server_count': np.asarray(columns[5], dtype=float),
+        'workstation_count': np.asarray(columns[6], dtype=float),
+        'total_bill': np.asarray(columns[7], dtype=float),
+    }
+
+
+def plan_columns(plan_keys, plans):
+    """
+    Expands plans to one entry per client. Each distinct plan is looked up
+    once and broadcast with an index array. Clients on a plan with no saved
+    settings get 'Not Configured' and zero prices.
+    """
+    unique_keys = list(dict.fromkeys(plan_keys))
+    position = {key: i for i, key in enumerate(unique_keys)}
+    index = np.fromiter((position[key] for key in plan_keys), dtype=np.intp, count=len(plan_keys))
+
+    unconfigured = {'billed_by': NOT_CONFIGURED, 'base_price': 0.0, 'per_user_cost': 0.0,
+                    'per_server_cost': 0.0, 'per_workstation_cost': 0.0}
+    per_plan = [plans.get(key, unconfigured) for key in unique_keys]
+    expanded = {}
+    for field in PLAN_FIELDS:
+        values = np.asarray([plan[field] for plan in per_plan], dtype=object if field == 'billed_by' else float)
+        expanded[field] = values[index] if len(plan_keys) else values[:0]
+    return expanded
+
+
+def simulate_plans(db_connection, candidate_plans):
+    """
+    Re-prices every client with `candidate_plans` ({(contract_type, billing_plan): {field: value}})
+    layered over the saved plans, without writing anything. Returns the current
+    and candidate revenue and the clients whose bill would change.
+    """
+    clients = load_client_columns(db_connection)
+    plans = load_plans(db_connection)
+    plans.update(candidate_plans)
+
+    prices = plan_columns(clients['plan_key'], plans)
+    candidate = compute_totals(
+        prices['billed_by'], prices['base_price'], prices['per_user_cost'],
+        prices['per_server_cost'], prices['per_workstation_cost'],
+        clients['user_count'], clients['server_count'], clients['workstation_count']
+    )
+    current = clients['total_bill']
+    delta = candidate - current
+
+    changed = np.flatnonzero(np.abs(delta) >= 0.005)
+    changed = changed[np.argsort(-np.abs(delta[changed]), kind='stable')]
+    return {
+        'client_count': len(current),
+        'current_total': float(current.sum()),
+        'candidate_total': float(candidate.sum()),
+        'delta': float(delta.sum()),
+        'changed_clients': [
+            {
+                'account_number': clients['account_number'][i],
+                'name': clients['name'][i],
+                'current_bill': float(current[i]),
+                'candidate_bill': float(candidate[i]),
+                'delta': float(delta[i]),
+            }
+            for i in changed
+        ],
+    }
@@ -0,0 +1,185 @@
+"""
+Freezes each client's monthly bill into the 'billing_snapshots' table.
+
+At month close the current counts from client_billing_summary, the plan
+prices in effect and the month's logged hours are copied into one row per
+(company_account_number, month). Trend and comparison reports read those rows
+instead of re-aggregating history, and later plan or device changes never
+rewrite a month that has already been billed.
+
+Run directly to close the previous calendar month:
+    python billing_snapshots.py [--month YYYY-MM] [--force]
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import cipher_key
+import data_version
+import migrations
+
+try:
+    from sqlcipher3 import dbapi2 as sqlite3
+except ImportError:
+    print("Error: sqlcipher3-wheels is not installed. Please install it using: pip install sqlcipher3-wheels", file=sys.stderr)
+    sys.exit(1)
+
+# --- Configuration ---
+DB_FILE = "brainhair.db"
+
+# Created by migration 4 (see migrations.py).
+SNAPSHOTS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS billing_snapshots (
+        company_account_number TEXT NOT NULL,
+        month TEXT NOT NULL, -- e.g., '2025-06'
+        name TEXT NOT NULL,
+        contract_type TEXT NOT NULL,
+        billing_plan TEXT NOT NULL,
+        billed_by TEXT NOT NULL,
+        base_price REAL NOT NULL DEFAULT 0.0,
+        per_user_cost REAL NOT NULL DEFAULT 0.0,
+        per_server_cost REAL NOT NULL DEFAULT 0.0,
+        per_workstation_cost REAL NOT NULL DEFAULT 0.0,
+        server_count INTEGER NOT NULL DEFAULT 0,
+        workstation_count INTEGER NOT NULL DEFAULT 0,
+        user_count INTEGER NOT NULL DEFAULT 0,
+        hours REAL NOT NULL DEFAULT 0.0,
+        total_bill REAL NOT NULL DEFAULT 0.0,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (company_account_number, month),
+        FOREIGN KEY (company_account_number) REFERENCES companies (account_number)
+    )
+"""
+
+SNAPSHOTS_MONTH_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_billing_snapshots_month
+    ON billing_snapshots (month, company_account_number)
+"""
+
+
+def previous_month(today=None):
+    """Returns the 'YYYY-MM' of the calendar month before `today` (UTC now by default)."""
+    today = today or datetime.now(timezone.utc)
+    return (today.replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+
+
+def snapshot_month(db_connection, month, replace=False):
+    """
+    Copies every client's current bill into billing_snapshots for `month`.
+    Existing rows for the month are kept unless `replace` is set. The caller
+    is responsible for committing. Returns the number of rows written.
+    """
+    conflict = """
+        ON CONFLICT(company_account_number, month) DO UPDATE SET
+            name=excluded.name, contract_type=excluded.contract_type, billing_plan=excluded.billing_plan,
+            billed_by=excluded.billed_by, base_price=excluded.base_price, per_user_cost=excluded.per_user_cost,
+            per_server_cost=excluded.per_server_cost, per_workstation_cost=excluded.per_workstation_cost,
+            server_count=excluded.server_count, workstation_count=excluded.workstation_count,
+            user_count=excluded.user_count, hours=excluded.hours, total_bill=excluded.total_bill,
+            created_at=excluded.created_at
+    """ if replace else "ON CONFLICT(company_account_number, month) DO NOTHING"
+
+    cur = db_connection.cursor()
+    # 'WHERE true' lets SQLite parse the upsert clause after a SELECT with joins.
+    cur.execute(f"""
+        INSERT INTO billing_snapshots
+            (company_account_number, month, name, contract_type, billing_plan, billed_by,
+             base_price, per_user_cost, per_server_cost, per_workstation_cost,
+             server_count, workstation_count, user_count, hours, total_bill, created_at)
+        SELECT
+            s.account_number, ?, s.name, s.contract_type, s.billing_plan, s.billed_by,
+            COALESCE(bp.base_price, 0), COALESCE(bp.per_user_cost, 0),
+            COALESCE(bp.per_server_cost, 0), COALESCE(bp.per_workstation_cost, 0),
+            s.server_count, s.workstation_count, s.user_count, COALESCE(h.hours, 0), s.total_bill,
+            CURRENT_TIMESTAMP
+        FROM client_billing_summary s
+        LEFT JOIN billing_plans bp
+            ON s.contract_type = bp.contract_type AND s.billing_plan = bp.billing_plan
+        LEFT JOIN ticket_work_hours h
+            ON h.company_account_number = s.account_number AND h.month = ?
+        WHERE true
+        {conflict}
+    """, (month, month))
+    return cur.rowcount
+
+
+def month_totals(db_connection):
+    """Returns one row per snapshotted month with its client count, revenue and hours, newest first."""
+    cur = db_connection.execute("""
+        SELECT month, COUNT(*) AS client_count, SUM(total_bill) AS total_bill, SUM(hours) AS hours,
+               SUM(server_count) AS server_count, SUM(workstation_count) AS workstation_count,
+               SUM(user_count) AS user_count
+        FROM billing_snapshots
+        GROUP BY month
+        ORDER BY month DESC
+    """)
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def compare_months(db_connection, month, baseline):
+    """Returns each client's snapshot in `month` next to its snapshot in `baseline`, biggest change first."""
+    cur = db_connection.execute("""
+        SELECT
+            COALESCE(cur.company_account_number, base.company_account_number) AS account_number,
+            COALESCE(cur.name, base.name) AS name,
+            base.total_bill AS baseline_bill, cur.total_bill AS current_bill,
+            COALESCE(cur.total_bill, 0) - COALESCE(base.total_bill, 0) AS delta,
+            base.server_count + base.workstation_count AS baseline_devices,
+            cur.server_count + cur.workstation_count AS current_devices,
+            base.user_count AS baseline_users, cur.user_count AS current_users
+        FROM (SELECT * FROM billing_snapshots WHERE month = :month) cur
+        FULL OUTER JOIN (SELECT * FROM billing_snapshots WHERE month = :baseline) base
+            ON cur.company_account_number = base.company_account_number
+        ORDER BY ABS(delta) DESC, name ASC
+    """, {'month': month, 'baseline': baseline})
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Freeze each client's bill for a month into billing_snapshots.")
+    parser.add_argument('--month', default=previous_month(), help="Month to close as YYYY-MM (default: last month).")
+    parser.add_argument('--force', action='store_true', help="Overwrite an existing snapshot for the month.")
+    args = parser.parse_args()
+
+    print(" Monthly Billing Snapshot")
+    print("==========================================")
+    try:
+        datetime.strptime(args.month, '%Y-%m')
+    except ValueError:
+        sys.exit(f"Error: --month must look like YYYY-MM, got '{args.month}'.")
+
+    if not os.path.exists(DB_FILE):
+        sys.exit(f"Error: Database file '{DB_FILE}' not found. Please run init_db.py script first.")
+
+    # DB_RAW_KEY from the web app, or DB_MASTER_PASSWORD when run by hand (derived once, here).
+    try:
+        DB_KEY = cipher_key.key_from_environment(DB_FILE)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+
+    con = None
+    try:
+        con = sqlite3.connect(DB_FILE)
+        con.execute(cipher_key.key_pragma(DB_KEY))
+        migrations.apply_migrations(con)
+        written = snapshot_month(con, args.month, replace=args.force)
+        data_version.bump_generation(con)
+        con.commit()
+        if written:
+            print(f" Snapshotted {written} clients for {args.month}.")
+        else:
+            print(f" {args.month} was already closed. Use --force to overwrite it.")
+    except sqlite3.Error as e:
+        print(f"\n❌ Database error: {e}", file=sys.stderr)
+        if con: con.rollback()
+        sys.exit(1)
+    finally:
+        if con: con.close()
+
+    print("\nScript finished.")
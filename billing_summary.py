@@ -0,0 +1,184 @@
+"""
+Maintains the materialized 'client_billing_summary' table.
+
+The dashboard used to join assets and users onto companies at the same time,
+which fans every client out to assets x users rows before the counts are
+collapsed. Instead, the sync scripts and the settings page call
+refresh_client_billing_summary() for the accounts they touched, and the
+dashboard reads one pre-computed row per client.
+"""
+import billing_engine
+
+# SQLite's default limit on bound parameters is 999 on older builds.
+MAX_PARAMS_PER_QUERY = 500
+
+# Created by migration 1 (see migrations.py).
+SUMMARY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS client_billing_summary (
+        account_number TEXT PRIMARY KEY NOT NULL,
+        name TEXT NOT NULL,
+        contract_type TEXT NOT NULL,
+        billing_plan TEXT NOT NULL,
+        billed_by TEXT NOT NULL,
+        server_count INTEGER NOT NULL DEFAULT 0,
+        workstation_count INTEGER NOT NULL DEFAULT 0,
+        user_count INTEGER NOT NULL DEFAULT 0,
+        total_bill REAL NOT NULL DEFAULT 0.0,
+        updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (account_number) REFERENCES companies (account_number)
+    )
+"""
+
+SUMMARY_NAME_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_client_billing_summary_name
+    ON client_billing_summary (name)
+"""
+
+# Each count is a correlated subquery so a client never fans out to
+# assets x users rows. Totals are priced by billing_engine.compute_totals().
+REFRESH_SELECT = """
+    SELECT
+        c.account_number, c.name, c.contract_type, c.billing_plan,
+        COALESCE(bp.billed_by, 'Not Configured') AS billed_by,
+        (SELECT COUNT(*) FROM assets a
+            WHERE a.company_account_number = c.account_number
+            AND a.operating_system LIKE '%Server%') AS server_count,
+        (SELECT COUNT(*) FROM assets a
+            WHERE a.company_account_number = c.account_number
+            AND a.operating_system NOT LIKE '%Server%') AS workstation_count,
+        (SELECT COUNT(*) FROM users u
+            WHERE u.company_account_number = c.account_number) AS user_count,
+        COALESCE(bp.base_price, 0) AS base_price,
+        COALESCE(bp.per_user_cost, 0) AS per_user_cost,
+        COALESCE(bp.per_server_cost, 0) AS per_server_cost,
+        COALESCE(bp.per_workstation_cost, 0) AS per_workstation_cost
+    FROM companies c
+    LEFT JOIN billing_plans bp
+        ON c.contract_type = bp.contract_type AND c.billing_plan = bp.billing_plan
+"""
+
+# Public sort key -> ORDER BY expression for the dashboard table.
+DASHBOARD_SORTS = {
+    'name': 'name',
+    'billing_plan': 'billing_plan',
+    'workstations': 'workstation_count',
+    'servers': 'server_count',
+    'users': 'user_count',
+    'total_bill': 'total_bill',
+}
+
+INSERT_SQL = """
+    INSERT OR REPLACE INTO client_billing_summary
+        (account_number, name, contract_type, billing_plan, billed_by,
+         server_count, workstation_count, user_count, total_bill, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+"""
+
+
+def chunks(values, size=MAX_PARAMS_PER_QUERY):
+    """Yields lists of up to `size` items from any iterable, reading it lazily (generators are never materialized)."""
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_summary_rows(cur, rows):
+    """Prices the rows returned by REFRESH_SELECT with the billing engine and stores them."""
+    if not rows:
+        return 0
+    (account_number, name, contract_type, billing_plan, billed_by, server_count, workstation_count,
+     user_count, base_price, per_user_cost, per_server_cost, per_workstation_cost) = zip(*rows)
+    totals = billing_engine.compute_totals(
+        billed_by, base_price, per_user_cost, per_server_cost, per_workstation_cost,
+        user_count, server_count, workstation_count
+    )
+    cur.executemany(INSERT_SQL, zip(
+        account_number, name, contract_type, billing_plan, billed_by,
+        server_count, workstation_count, user_count, totals.tolist()
+    ))
+    return len(rows)
+
+
+def refresh_client_billing_summary(db_connection, account_numbers=None):
+    """
+    Recomputes the summary rows for the given account numbers, or for every
+    company when account_numbers is None. Rows for accounts that no longer
+    exist in 'companies' are removed. The caller is responsible for committing.
+    Returns the number of accounts refreshed.
+    """
+    cur = db_connection.cursor()
+
+    if account_numbers is None:
+        cur.execute("DELETE FROM client_billing_summary")
+        cur.execute(REFRESH_SELECT)
+        return _write_summary_rows(cur, cur.fetchall())
+
+    refreshed = 0
+    for chunk in chunks({str(a) for a in account_numbers if a is not None}):
+        placeholders = ", ".join("?" for _ in chunk)
+        cur.execute(f"DELETE FROM client_billing_summary WHERE account_number IN ({placeholders})", chunk)
+        cur.execute(f"{REFRESH_SELECT} WHERE c.account_number IN ({placeholders})", chunk)
+        refreshed += _write_summary_rows(cur, cur.fetchall())
+    return refreshed
+
+
+def fetch_clients_page(db_connection, match_query=None, sort='name', order='asc', limit=100, offset=0):
+    """
+    Returns (rows, total) for one page of the dashboard. `match_query` is an
+    FTS5 expression from search_index.build_match_query() or None for every
+    client; `sort` must be a DASHBOARD_SORTS key and `order` 'asc' or 'desc'.
+    """
+    where, args = "", []
+    if match_query:
+        where = "WHERE account_number IN (SELECT account_number FROM client_search WHERE client_search MATCH ?)"
+        args.append(match_query)
+
+    cur = db_connection.execute(f"SELECT COUNT(*) FROM client_billing_summary {where}", args)
+    total = cur.fetchone()[0]
+    cur = db_connection.execute(f"""
+        SELECT account_number, name, contract_type, billing_plan, billed_by,
+               server_count, workstation_count, user_count, total_bill
+        FROM client_billing_summary
+        {where}
+        ORDER BY {DASHBOARD_SORTS[sort]} {'DESC' if order == 'desc' else 'ASC'}, name ASC
+        LIMIT ? OFFSET ?
+    """, args + [limit, offset])
+    rows = cur.fetchall()
+    cur.close()
+    return rows, total
+
+
+def accounts_for_plans(db_connection, plan_keys):
+    """Returns the account numbers of companies on any of the given (contract_type, billing_plan) pairs."""
+    cur = db_connection.cursor()
+    accounts = set()
+    for contract_type, billing_plan in set(plan_keys):
+        cur.execute(
+            "SELECT account_number FROM companies WHERE contract_type = ? AND billing_plan = ?",
+            (contract_type, billing_plan)
+        )
+        accounts.update(row[0] for row in cur.fetchall())
+    return accounts
+
+
+def current_accounts_for(db_connection, table, key_column, keys):
+    """
+    Returns the company_account_number values currently stored in `table` for
+    the given external keys (e.g. assets.datto_uid). Used before an upsert so
+    accounts that lose a row are refreshed as well as those that gain one.
+    """
+    cur = db_connection.cursor()
+    accounts = set()
+    for chunk in chunks({k for k in keys if k is not None}):
+        placeholders = ", ".join("?" for _ in chunk)
+        cur.execute(
+            f"SELECT DISTINCT company_account_number FROM {table} WHERE {key_column} IN ({placeholders})",
+            chunk
+        )
+        accounts.update(row[0] for row in cur.fetchall())
+    return accounts
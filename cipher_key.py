@@ -0,0 +1,86 @@
+"""
+Derives SQLCipher's raw database key from the master password once, so that
+connections can be unlocked with `PRAGMA key = "x'...'"` instead of running
+the deliberately slow key derivation again for every connection.
+
+SQLCipher 4 derives its key with PBKDF2-HMAC-SHA512 over 256,000 iterations,
+salted with the first 16 bytes of the database file. derive_raw_key() repeats
+that derivation with hashlib and checks the result against the database.
+
+The web app hands the raw key to the sync scripts in DB_RAW_KEY. When a
+script is run by hand, it can still be given DB_MASTER_PASSWORD instead and
+derives the raw key itself, once.
+"""
+import hashlib
+import os
+import re
+import sys
+
+try:
+    from sqlcipher3 import dbapi2 as sqlite3
+except ImportError:
+    print("Error: sqlcipher3-wheels is not installed. Please install it using: pip install sqlcipher3-wheels", file=sys.stderr)
+    sys.exit(1)
+
+# SQLCipher 4 defaults (see PRAGMA cipher_default_settings).
+KDF_ALGORITHM = 'sha512'
+KDF_ITERATIONS = 256000
+KEY_BYTES = 32
+SALT_BYTES = 16
+
+RAW_KEY_ENV = 'DB_RAW_KEY'
+PASSWORD_ENV = 'DB_MASTER_PASSWORD'
+
+_RAW_KEY_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+def key_pragma(raw_key):
+    """Returns the PRAGMA statement that unlocks a connection with `raw_key` (64 hex digits)."""
+    if not _RAW_KEY_PATTERN.fullmatch(raw_key or ''):
+        raise ValueError("The raw database key must be 64 lowercase hex digits.")
+    return f"PRAGMA key = \"x'{raw_key}'\";"
+
+
+def unlock(connection, raw_key):
+    """Keys `connection` with the raw key and reads from it, raising sqlite3.DatabaseError if the key is wrong."""
+    connection.execute(key_pragma(raw_key))
+    connection.execute("SELECT name FROM sqlite_master WHERE type='table' LIMIT 1;").fetchone()
+
+
+def derive_raw_key(db_path, password):
+    """
+    Runs SQLCipher's key derivation for `password` against the database's salt
+    and returns the raw key as hex. Raises ValueError if the password is wrong.
+    """
+    if not password:
+        raise ValueError("A database password is required.")
+    with open(db_path, 'rb') as f:
+        salt = f.read(SALT_BYTES)
+    if len(salt) < SALT_BYTES:
+        raise ValueError(f"'{db_path}' is not an encrypted database.")
+
+    raw_key = hashlib.pbkdf2_hmac(KDF_ALGORITHM, password.encode('utf-8'), salt, KDF_ITERATIONS, KEY_BYTES).hex()
+    con = sqlite3.connect(db_path)
+    try:
+        unlock(con, raw_key)
+    except sqlite3.DatabaseError:
+        raise ValueError("Invalid master password.")
+    finally:
+        con.close()
+    return raw_key
+
+
+def key_from_environment(db_path):
+    """
+    Returns the raw key for a sync script: DB_RAW_KEY as given by the web app,
+    or derived from DB_MASTER_PASSWORD. Raises ValueError if neither is usable.
+    """
+    raw_key = os.environ.get(RAW_KEY_ENV)
+    if raw_key:
+        key_pragma(raw_key)
+        return raw_key
+    password = os.environ.get(PASSWORD_ENV)
+    if password:
+        return derive_raw_key(db_path, password)
+    raise ValueError(f"The {RAW_KEY_ENV} or {PASSWORD_ENV} environment variable must be set.")
+
@@ -0,0 +1,41 @@
+"""
+Streams query results to the browser as CSV.
+
+Rows are pulled from the cursor in batches of EXPORT_BATCH_SIZE and written
+out as they arrive, so an export holds at most one batch in memory no
+matter how many clients, assets or users it covers.
+"""
+import csv
+import io
+
+EXPORT_BATCH_SIZE = 500
+# Lets Excel detect UTF-8 so accented names survive the round trip.
+UTF8_BOM = '\ufeff'
+
+
+def iter_csv(cursor, header=None):
+    """
+    Yields the rows of an executed cursor as CSV text, one batch per chunk.
+    The header defaults to the cursor's column names. Closes the cursor when done.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    try:
+        writer.writerow(header or [column[0] for column in cursor.description])
+        yield UTF8_BOM + buffer.getvalue()
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                return
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+    finally:
+        cursor.close()
+
+
+def export_filename(*parts):
+    """Builds a download file name from `parts`, keeping only filename-safe characters."""
+    name = '-'.join(str(part) for part in parts if part)
+    return ''.join(ch if ch.isalnum() or ch in '-_.' else '_' for ch in name) + '.csv'
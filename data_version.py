@@ -0,0 +1,32 @@
+"""
+A database-wide change counter for cache validation.
+
+Every code path that commits data shown in the web UI (the sync scripts, the
+settings page and schema migrations) calls bump_generation() in the same
+transaction. Readers compare get_generation() with the value their cached
+copy was built from. SQLite's own PRAGMA data_version is not usable for this:
+it is per connection and ignores the connection's own commits.
+"""
+
+# Created by migration 3 (see migrations.py).
+DATA_GENERATION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS data_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def get_generation(db_connection):
+    """Returns the current change counter, or 0 on a database that has never been written to."""
+    row = db_connection.execute("SELECT generation FROM data_generation WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+def bump_generation(db_connection):
+    """Increments the change counter. The caller commits it together with the data change."""
+    db_connection.execute("""
+        INSERT INTO data_generation (id, generation, updated_at) VALUES (1, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT(id) DO UPDATE SET generation = generation + 1, updated_at = CURRENT_TIMESTAMP
+    """)
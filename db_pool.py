@@ -0,0 +1,135 @@
+"""
+A bounded pool of already-unlocked SQLCipher connections.
+
+Opening and keying a fresh SQLCipher connection per request adds latency
+to every page. The pool keeps unlocked connections around between requests,
+keyed by the login session that unlocked them, so a connection is only ever
+handed back to the session that supplied its database key.
+"""
+import threading
+import time
+
+
+class PoolExhausted(Exception):
+    """Raised when no connection became available within the acquire timeout. The web app answers it with a 503."""
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_connections=16, max_idle_per_key=4, idle_timeout=900, acquire_timeout=30):
+        """
+        `connect` is a callable taking the session's database key and returning
+        an unlocked connection (or raising if the key is wrong).
+        """
+        self._connect = connect
+        self.max_connections = max_connections
+        self.max_idle_per_key = max_idle_per_key
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self._idle = {}          # key -> list of (connection, returned_at), most recent last
+        self._in_use = {}        # id(connection) -> key
+        self._retired = set()    # keys evicted while they still had connections borrowed
+        self._lock = threading.Condition()
+
+    def _open_count(self):
+        return len(self._in_use) + sum(len(conns) for conns in self._idle.values())
+
+    def _close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _prune_idle(self, now):
+        """Closes idle connections older than idle_timeout. Caller holds the lock."""
+        for key in list(self._idle):
+            fresh = []
+            for connection, returned_at in self._idle[key]:
+                if now - returned_at > self.idle_timeout:
+                    self._close_quietly(connection)
+                else:
+                    fresh.append((connection, returned_at))
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+
+    def _evict_oldest_idle(self):
+        """Closes the least recently returned idle connection of any key. Caller holds the lock."""
+        oldest_key, oldest_at = None, None
+        for key, conns in self._idle.items():
+            if conns and (oldest_at is None or conns[0][1] < oldest_at):
+                oldest_key, oldest_at = key, conns[0][1]
+        if oldest_key is None:
+            return False
+        connection, _ = self._idle[oldest_key].pop(0)
+        if not self._idle[oldest_key]:
+            del self._idle[oldest_key]
+        self._close_quietly(connection)
+        return True
+
+    def acquire(self, key, db_key):
+        """Borrows an unlocked connection for `key`, opening one if none is idle."""
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._lock:
+            while True:
+                self._prune_idle(time.monotonic())
+                conns = self._idle.get(key)
+                if conns:
+                    connection, _ = conns.pop()
+                    if not conns:
+                        del self._idle[key]
+                    self._in_use[id(connection)] = key
+                    return connection
+                if self._open_count() < self.max_connections or self._evict_oldest_idle():
+                    # Reserve the slot, then open and unlock outside the lock.
+                    reservation = object()
+                    self._in_use[reservation] = key
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(f"No database connection available after {self.acquire_timeout}s.")
+                self._lock.wait(remaining)
+
+        try:
+            connection = self._connect(db_key)
+        except BaseException:
+            with self._lock:
+                del self._in_use[reservation]
+                self._lock.notify()
+            raise
+        with self._lock:
+            del self._in_use[reservation]
+            self._in_use[id(connection)] = key
+        return connection
+
+    def release(self, key, connection, discard=False):
+        """Returns a borrowed connection. Open transactions are rolled back first."""
+        if not discard:
+            try:
+                if connection.in_transaction:
+                    connection.rollback()
+            except Exception:
+                discard = True
+        with self._lock:
+            self._in_use.pop(id(connection), None)
+            if key in self._retired:
+                discard = True
+                if key not in self._in_use.values():
+                    self._retired.discard(key)
+            conns = self._idle.setdefault(key, [])
+            if discard or len(conns) >= self.max_idle_per_key:
+                self._close_quietly(connection)
+            else:
+                conns.append((connection, time.monotonic()))
+            if not conns:
+                del self._idle[key]
+            self._lock.notify()
+
+    def evict(self, key):
+        """Closes every connection for `key`, e.g. on logout. Borrowed ones are closed when returned."""
+        with self._lock:
+            for connection, _ in self._idle.pop(key, []):
+                self._close_quietly(connection)
+            if key in self._in_use.values():
+                self._retired.add(key)
+            self._lock.notify_all()
@@ -0,0 +1,210 @@
+"""
+Builds an encrypted database with the same schema as brainhair.db, filled
+with made-up clients, so performance changes can be measured without
+touching production data.
+
+    python generate_synthetic_db.py --companies 5000 --assets 500000 --users 200000
+
+Client sizes follow a long-tailed distribution (a few large clients, many
+small ones), and operating systems, contract types and billing plans are drawn
+from weighted mixes resembling a typical MSP book of business. The same
+--seed always produces the same database.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import billing_summary
+import init_db
+import migrations
+
+try:
+    from sqlcipher3 import dbapi2 as sqlite3
+except ImportError:
+    print("Error: sqlcipher3-wheels is not installed. Please install it using: pip install sqlcipher3-wheels", file=sys.stderr)
+    sys.exit(1)
+
+# --- Configuration ---
+DEFAULT_OUTPUT = "synthetic.db"
+DEFAULT_PASSWORD = "benchmark"
+INSERT_BATCH_SIZE = 10000
+
+# (value, weight) mixes
+OPERATING_SYSTEMS = [
+    ("Microsoft Windows 11 Pro", 40), ("Microsoft Windows 10 Pro", 28), ("Microsoft Windows 11 Enterprise", 6),
+    ("Microsoft Windows Server 2022 Standard", 7), ("Microsoft Windows Server 2019 Standard", 6),
+    ("Microsoft Windows Server 2016 Standard", 3), ("macOS Sonoma", 6), ("Ubuntu 22.04 LTS", 2), (None, 2),
+]
+CONTRACT_TYPES = [("Managed", 60), ("Co-Managed", 20), ("Break/Fix", 15), ("Project", 5)]
+BILLING_PLANS = [("Gold", 25), ("Silver", 35), ("Bronze", 30), ("Custom", 10)]
+BILLED_BY = {"Managed": "Per Device", "Co-Managed": "Per User", "Break/Fix": "Flat Rate", "Project": "Not Billed"}
+# Left out of billing_plans so the 'Not Configured' path is exercised too.
+UNCONFIGURED_PLANS = {("Project", "Custom"), ("Break/Fix", "Custom")}
+USER_STATUSES = [("Active", 92), ("Inactive", 8)]
+ASSET_STATUSES = [("Active", 95), ("Offline", 5)]
+
+NAME_PARTS = ["Acme", "Summit", "Harbor", "Pioneer", "Cedar", "Granite", "Lakeside", "Northwind", "Bluebird",
+              "Redwood", "Silverline", "Keystone", "Evergreen", "Riverside", "Ironclad", "Meadow", "Beacon"]
+NAME_SUFFIXES = ["Dental", "Law Group", "Logistics", "Medical", "Builders", "Accounting", "Realty",
+                 "Manufacturing", "Insurance", "Partners", "Foods", "Clinic", "Engineering", "Academy"]
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+               "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Maria", "José"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+              "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Nguyen"]
+
+
+def _weighted(rng, mix, k):
+    values, weights = zip(*mix)
+    return rng.choices(values, weights=weights, k=k)
+
+
+def _spread(rng, weights, total):
+    """Assigns `total` items to owners in proportion to `weights`; returns a count per owner."""
+    counts = [0] * len(weights)
+    for owner in rng.choices(range(len(weights)), weights=weights, k=total):
+        counts[owner] += 1
+    return counts
+
+
+def generate_companies(rng, count):
+    contract_types = _weighted(rng, CONTRACT_TYPES, count)
+    plans = _weighted(rng, BILLING_PLANS, count)
+    for i in range(count):
+        name = f"{rng.choice(NAME_PARTS)} {rng.choice(NAME_SUFFIXES)} {i:05d}"
+        status = 'Active' if rng.random() < 0.97 else 'Inactive'
+        yield (str(100000 + i), name, 1000000 + i, contract_types[i], plans[i], status)
+
+
+def generate_assets(rng, accounts, counts):
+    start = date(2018, 1, 1)
+    asset_id = 0
+    for account, count in zip(accounts, counts):
+        systems = _weighted(rng, OPERATING_SYSTEMS, count)
+        statuses = _weighted(rng, ASSET_STATUSES, count)
+        for j in range(count):
+            os_name = systems[j]
+            is_server = os_name is not None and 'Server' in os_name
+            prefix = 'SRV' if is_server else ('MAC' if os_name and 'mac' in os_name else 'WS')
+            device_type = 'Server' if is_server else rng.choice(['Desktop', 'Laptop'])
+            hostname = f"{prefix}-{account}-{j:04d}"
+            friendly_name = f"{device_type} {j}" if rng.random() < 0.3 else None
+            added = (start + timedelta(days=rng.randrange(2500))).isoformat()
+            yield (account, f"synthetic-{asset_id:08d}", hostname, friendly_name, device_type, statuses[j], added, os_name)
+            asset_id += 1
+
+
+def generate_users(rng, accounts, counts):
+    start = date(2018, 1, 1)
+    user_id = 0
+    for account, count in zip(accounts, counts):
+        statuses = _weighted(rng, USER_STATUSES, count)
+        for j in range(count):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            email = f"{first.lower()}.{last.lower()}.{user_id}@client{account}.example.com"
+            added = (start + timedelta(days=rng.randrange(2500))).isoformat()
+            yield (account, 5000000 + user_id, f"{first} {last}", email, statuses[j], added)
+            user_id += 1
+
+
+def generate_ticket_hours(rng, accounts, weights, months):
+    today = date.today().replace(day=1)
+    month_names = []
+    for _ in range(months):
+        today = (today - timedelta(days=1)).replace(day=1)
+        month_names.append(today.strftime('%Y-%m'))
+    average_weight = sum(weights) / len(weights)
+    for account, weight in zip(accounts, weights):
+        for month in month_names:
+            if rng.random() < 0.8:
+                yield (account, month, round(rng.expovariate(1.0) * 6 * weight / average_weight + 0.25, 2))
+
+
+def generate_billing_plans(rng):
+    for contract_type, _ in CONTRACT_TYPES:
+        for plan, _ in BILLING_PLANS:
+            if (contract_type, plan) in UNCONFIGURED_PLANS:
+                continue
+            yield (contract_type, plan, BILLED_BY[contract_type], float(rng.choice([0, 50, 100, 250])),
+                   float(rng.choice([15, 25, 35])), float(rng.choice([75, 100, 150])), float(rng.choice([30, 45, 60])))
+
+
+def build_database(path, password, companies, assets, users, months, seed):
+    rng = random.Random(seed)
+    con = sqlite3.connect(path)
+    try:
+        cur = con.cursor()
+        cur.execute(f"PRAGMA key = '{password}';")
+        init_db.create_schema(cur)
+        cur.execute("INSERT INTO api_keys (service, api_key) VALUES ('freshservice', 'synthetic')")
+        cur.execute("INSERT INTO api_keys (service, api_endpoint, api_key, api_secret) VALUES ('datto', 'https://127.0.0.1', 'synthetic', 'synthetic')")
+
+        def insert(label, sql, rows):
+            started = time.perf_counter()
+            written = 0
+            for batch in billing_summary.chunks(rows, INSERT_BATCH_SIZE):
+                cur.executemany(sql, batch)
+                written += len(batch)
+            print(f"-> Inserted {written} {label} in {time.perf_counter() - started:.1f}s.")
+
+        company_rows = list(generate_companies(rng, companies))
+        accounts = [row[0] for row in company_rows]
+        # Pareto weights give a long tail: most clients are small, a few are very large.
+        weights = [rng.paretovariate(1.3) for _ in accounts]
+
+        insert("companies", "INSERT INTO companies (account_number, name, freshservice_id, contract_type, billing_plan, status) VALUES (?, ?, ?, ?, ?, ?)", company_rows)
+        insert("billing plans", "INSERT INTO billing_plans (contract_type, billing_plan, billed_by, base_price, per_user_cost, per_server_cost, per_workstation_cost) VALUES (?, ?, ?, ?, ?, ?, ?)", generate_billing_plans(rng))
+        insert("assets", "INSERT INTO assets (company_account_number, datto_uid, hostname, friendly_name, device_type, status, date_added, operating_system) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+               generate_assets(rng, accounts, _spread(rng, weights, assets)))
+        insert("users", "INSERT INTO users (company_account_number, freshservice_id, full_name, email, status, date_added) VALUES (?, ?, ?, ?, ?, ?)",
+               generate_users(rng, accounts, _spread(rng, weights, users)))
+        insert("monthly hour totals", "INSERT INTO ticket_work_hours (company_account_number, month, hours) VALUES (?, ?, ?)",
+               generate_ticket_hours(rng, accounts, weights, months))
+        con.commit()
+
+        # Migrations build the summary table, indexes and search index from the rows above.
+        print("\nApplying schema migrations...")
+        started = time.perf_counter()
+        migrations.apply_migrations(con, verbose=True)
+        print(f"-> Migrations finished in {time.perf_counter() - started:.1f}s.")
+    finally:
+        con.close()
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate an encrypted synthetic database for benchmarking.")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help=f"Database file to create (default: {DEFAULT_OUTPUT}).")
+    parser.add_argument('--password', default=os.environ.get('SYNTHETIC_DB_PASSWORD', DEFAULT_PASSWORD),
+                        help="Master password for the new database (default: $SYNTHETIC_DB_PASSWORD or 'benchmark').")
+    parser.add_argument('--companies', type=int, default=5000)
+    parser.add_argument('--assets', type=int, default=500000)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--months', type=int, default=12, help="Months of ticket hours per client (default: 12).")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help="Overwrite the output file if it exists.")
+    args = parser.parse_args()
+
+    print(" Synthetic Database Generator")
+    print("==========================================")
+    if os.path.abspath(args.output) == os.path.abspath(init_db.DB_FILE):
+        sys.exit(f"Error: Refusing to overwrite the production database '{init_db.DB_FILE}'.")
+    if os.path.exists(args.output):
+        if not args.force:
+            sys.exit(f"Error: '{args.output}' already exists. Use --force to overwrite it.")
+        os.remove(args.output)
+    if args.companies < 1:
+        sys.exit("Error: --companies must be at least 1.")
+
+    started = time.perf_counter()
+    try:
+        build_database(args.output, args.password, args.companies, args.assets, args.users, args.months, args.seed)
+    except sqlite3.Error as e:
+        print(f"\n❌ Database error: {e}", file=sys.stderr)
+        if os.path.exists(args.output): os.remove(args.output)
+        sys.exit(1)
+
+    print(f"\n✅ Created '{args.output}' in {time.perf_counter() - started:.1f}s.")
+    print(f"Benchmark it with: python benchmark.py --db {args.output}")
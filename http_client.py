@@ -0,0 +1,96 @@
+"""
+The one HTTP client the sync scripts use for Freshservice and Datto.
+
+Each API gets a single requests.Session for the life of the script. Its
+connections stay open between calls (keep-alive), so a sync does one TCP
+and TLS handshake per pooled connection instead of one per request. The
+pool is sized for the scripts' worker threads, responses are requested
+gzip-compressed, and every call gets the same timeouts and goes through the
+API's rate limiter (see rate_limiter.py). Auth headers are built here too.
+"""
+import base64
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import rate_limiter
+
+# (connect, read) in seconds. A call can pass its own timeout, e.g. for slow filter queries.
+TIMEOUT = (10, 60)
+# Connections kept open per host; at least the number of threads a script
+# runs against that API at once, so no worker waits for a socket.
+POOL_SIZES = {'freshservice': 16, 'datto': 16}
+
+# Point the scripts at another server, e.g. the local stand-in in mock_api.py.
+FRESHSERVICE_BASE_URL_ENV = 'FRESHSERVICE_BASE_URL'
+DATTO_API_ENDPOINT_ENV = 'DATTO_API_ENDPOINT'
+
+# Datto's OAuth token endpoint expects this fixed public client ID ('public-client:public').
+DATTO_CLIENT_AUTH = 'Basic cHVibGljLWNsaWVudDpwdWJsaWM='
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def session_for(api):
+    """Returns the shared keep-alive session for 'freshservice' or 'datto'. Safe to share between threads."""
+    with _sessions_lock:
+        if api not in _sessions:
+            session = requests.Session()
+            # Retries are rate_limiter's job; urllib3 must not retry behind its back.
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZES[api], max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'})
+            _sessions[api] = session
+        return _sessions[api]
+
+
+def request(api, method, url, **kwargs):
+    """Sends a request on the API's session, through its rate limiter. Returns the response; raises requests' RequestException."""
+    kwargs.setdefault('timeout', TIMEOUT)
+    return rate_limiter.send(api, method, url, session=session_for(api), **kwargs)
+
+
+def get(api, url, **kwargs):
+    return request(api, 'GET', url, **kwargs)
+
+
+def put(api, url, **kwargs):
+    return request(api, 'PUT', url, **kwargs)
+
+
+def post(api, url, **kwargs):
+    return request(api, 'POST', url, **kwargs)
+
+
+def freshservice_base_url(domain):
+    """Returns the Freshservice base URL: $FRESHSERVICE_BASE_URL if set, otherwise the tenant's domain."""
+    return os.environ.get(FRESHSERVICE_BASE_URL_ENV) or f"https://{domain}"
+
+
+def datto_endpoint(stored_endpoint):
+    """Returns the Datto API endpoint: $DATTO_API_ENDPOINT if set, otherwise the one stored with the credentials."""
+    return os.environ.get(DATTO_API_ENDPOINT_ENV) or stored_endpoint
+
+
+def freshservice_headers(api_key):
+    """Freshservice takes the API key as the basic-auth user name, with any password."""
+    encoded_auth = base64.b64encode(f"{api_key}:X".encode()).decode()
+    return {"Content-Type": "application/json", "Authorization": f"Basic {encoded_auth}"}
+
+
+def datto_headers(access_token):
+    return {'Authorization': f'Bearer {access_token}'}
+
+
+def get_datto_access_token(api_endpoint, api_key, api_secret_key):
+    """Exchanges the Datto API key and secret for an access token. Raises requests' RequestException on failure."""
+    token_url = f"{api_endpoint}/auth/oauth/token"
+    payload = {'grant_type': 'password', 'username': api_key, 'password': api_secret_key}
+    headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Authorization': DATTO_CLIENT_AUTH}
+    response = post('datto', token_url, headers=headers, data=payload)
+    response.raise_for_status()
+    return response.json().get("access_token")
@@ -2,6 +2,8 @@ import sys
 import os
 import getpass
 
+import migrations
+
 # This is provided by the sqlcipher3-wheels package
 try:
     from sqlcipher3 import dbapi2 as sqlite3
@@ -12,6 +14,99 @@ except ImportError:
 
 DB_FILE = "brainhair.db"
 
+def create_schema(cur):
+    """Creates the base tables on a freshly keyed, empty database. Migrations add the rest."""
+    print("\nCreating database schema...")
+    print("Creating 'api_keys' table...")
+    cur.execute("""
+        CREATE TABLE api_keys (
+            service TEXT PRIMARY KEY NOT NULL,
+            api_key TEXT NOT NULL,
+            api_secret TEXT,
+            api_endpoint TEXT
+        )
+    """)
+
+    print("Creating 'companies' table...")
+    cur.execute("""
+        CREATE TABLE companies (
+            account_number TEXT PRIMARY KEY NOT NULL,
+            name TEXT NOT NULL UNIQUE,
+            freshservice_id INTEGER UNIQUE,
+            contract_type TEXT NOT NULL,
+            billing_plan TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'Active'
+        )
+    """)
+
+    print("Creating 'assets' table...")
+    cur.execute("""
+        CREATE TABLE assets (
+            id INTEGER PRIMARY KEY,
+            company_account_number TEXT NOT NULL,
+            datto_uid TEXT UNIQUE,
+            hostname TEXT NOT NULL,
+            friendly_name TEXT,
+            device_type TEXT,
+            status TEXT NOT NULL DEFAULT 'Active',
+            date_added TEXT NOT NULL,
+            operating_system TEXT,
+            FOREIGN KEY (company_account_number) REFERENCES companies (account_number)
+        )
+    """)
+
+    print("Creating 'users' table...")
+    cur.execute("""
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY,
+            company_account_number TEXT NOT NULL,
+            freshservice_id INTEGER UNIQUE,
+            full_name TEXT NOT NULL,
+            email TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'Active',
+            date_added TEXT NOT NULL,
+            FOREIGN KEY (company_account_number) REFERENCES companies (account_number)
+        )
+    """)
+
+    print("Creating 'billing_plans' table...")
+    cur.execute("""
+        CREATE TABLE billing_plans (
+            contract_type TEXT NOT NULL,
+            billing_plan TEXT NOT NULL,
+            billed_by TEXT NOT NULL,
+            base_price REAL NOT NULL DEFAULT 0.0,
+            per_user_cost REAL NOT NULL DEFAULT 0.0,
+            per_server_cost REAL NOT NULL DEFAULT 0.0,
+            per_workstation_cost REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (contract_type, billing_plan)
+        )
+    """)
+
+    print("Creating 'billing_events' table...")
+    cur.execute("""
+        CREATE TABLE billing_events (
+            id INTEGER PRIMARY KEY,
+            company_account_number TEXT NOT NULL,
+            event_date TEXT NOT NULL,
+            description TEXT NOT NULL,
+            notes TEXT,
+            FOREIGN KEY (company_account_number) REFERENCES companies (account_number)
+        )
+    """)
+
+    # --- NEW TABLE FOR TICKET HOURS ---
+    print("Creating 'ticket_work_hours' table...")
+    cur.execute("""
+        CREATE TABLE ticket_work_hours (
+            company_account_number TEXT NOT NULL,
+            month TEXT NOT NULL, -- e.g., '2025-06'
+            hours REAL NOT NULL,
+            PRIMARY KEY (company_account_number, month),
+            FOREIGN KEY (company_account_number) REFERENCES companies (account_number)
+        )
+    """)
+
 def create_database():
     """
     Initializes a new encrypted SQLite database, prompts for a master password
@@ -55,97 +150,11 @@ def create_database():
         cur.execute("PRAGMA foreign_keys = ON;")
 
         # --- Create Schema ---
-        print("\nCreating database schema...")
-        print("Creating 'api_keys' table...")
-        cur.execute("""
-            CREATE TABLE api_keys (
-                service TEXT PRIMARY KEY NOT NULL,
-                api_key TEXT NOT NULL,
-                api_secret TEXT,
-                api_endpoint TEXT
-            )
-        """)
-
-        print("Creating 'companies' table...")
-        cur.execute("""
-            CREATE TABLE companies (
-                account_number TEXT PRIMARY KEY NOT NULL,
-                name TEXT NOT NULL UNIQUE,
-                freshservice_id INTEGER UNIQUE,
-                contract_type TEXT NOT NULL,
-                billing_plan TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'Active'
-            )
-        """)
-
-        print("Creating 'assets' table...")
-        cur.execute("""
-            CREATE TABLE assets (
-                id INTEGER PRIMARY KEY,
-                company_account_number TEXT NOT NULL,
-                datto_uid TEXT UNIQUE,
-                hostname TEXT NOT NULL,
-                friendly_name TEXT,
-                device_type TEXT,
-                status TEXT NOT NULL DEFAULT 'Active',
-                date_added TEXT NOT NULL,
-                operating_system TEXT,
-                FOREIGN KEY (company_account_number) REFERENCES companies (account_number)
-            )
-        """)
-
-        print("Creating 'users' table...")
-        cur.execute("""
-            CREATE TABLE users (
-                id INTEGER PRIMARY KEY,
-                company_account_number TEXT NOT NULL,
-                freshservice_id INTEGER UNIQUE,
-                full_name TEXT NOT NULL,
-                email TEXT UNIQUE,
-                status TEXT NOT NULL DEFAULT 'Active',
-                date_added TEXT NOT NULL,
-                FOREIGN KEY (company_account_number) REFERENCES companies (account_number)
-            )
-        """)
-
-        print("Creating 'billing_plans' table...")
-        cur.execute("""
-            CREATE TABLE billing_plans (
-                contract_type TEXT NOT NULL,
-                billing_plan TEXT NOT NULL,
-                billed_by TEXT NOT NULL,
-                base_price REAL NOT NULL DEFAULT 0.0,
-                per_user_cost REAL NOT NULL DEFAULT 0.0,
-                per_server_cost REAL NOT NULL DEFAULT 0.0,
-                per_workstation_cost REAL NOT NULL DEFAULT 0.0,
-                PRIMARY KEY (contract_type, billing_plan)
-            )
-        """)
-
-        print("Creating 'billing_events' table...")
-        cur.execute("""
-            CREATE TABLE billing_events (
-                id INTEGER PRIMARY KEY,
-                company_account_number TEXT NOT NULL,
-                event_date TEXT NOT NULL,
-                description TEXT NOT NULL,
-                notes TEXT,
-                FOREIGN KEY (company_account_number) REFERENCES companies (account_number)
-            )
-        """)
-
-        # --- NEW TABLE FOR TICKET HOURS ---
-        print("Creating 'ticket_work_hours' table...")
-        cur.execute("""
-            CREATE TABLE ticket_work_hours (
-                company_account_number TEXT NOT NULL,
-                month TEXT NOT NULL, -- e.g., '2025-06'
-                hours REAL NOT NULL,
-                PRIMARY KEY (company_account_number, month),
-                FOREIGN KEY (company_account_number) REFERENCES companies (account_number)
-            )
-        """)
+        create_schema(cur)
 
+        # --- Apply Versioned Migrations ---
+        print("\nApplying schema migrations...")
+        migrations.apply_migrations(con, verbose=True)
 
         # --- Insert API Keys ---
         print("\nStoring API keys in the encrypted database...")
@@ -0,0 +1,265 @@
+"""
+Runs the sync scripts as tracked background jobs.
+
+Each job is a child Python process that writes its combined stdout/stderr
+straight to a log file under JOBS_DIR, next to a small JSON status file. The
+web worker that started it returns immediately, and because all job state
+lives on disk, any worker process can report a job's status or stream its
+output while it runs. An flock on a lock file per script guarantees that only
+one copy of each sync runs at a time, across all workers. The script's process
+inherits the locked file, so the lock lasts exactly as long as it runs and the
+kernel releases it even if the worker that started it dies.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from processes import process_alive
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+JOBS_DIR = 'job_logs'
+MAX_FINISHED_JOBS = 20 # finished jobs kept around so their output can still be viewed
+POLL_INTERVAL = 0.5 # seconds between checks for new output while following a job
+
+# Without flock (Windows, where only the single-process development server
+# runs), the scripts running from this process stand in for the locks.
+_local_locks = set()
+_local_locks_guard = threading.Lock()
+
+
+class JobAlreadyRunning(Exception):
+    """Raised when a script is started while a previous run of it is still going."""
+    def __init__(self, job):
+        super().__init__(f"'{job.script_file}' is already running (job {job.id}).")
+        self.job = job
+
+
+class Job:
+    def __init__(self, jobs_dir, job_id, script_name, script_file, status='running', returncode=None,
+                 started_at=None, finished_at=None, pid=None):
+        self.jobs_dir = jobs_dir
+        self.id = job_id
+        self.script_name = script_name
+        self.script_file = script_file
+        self.status = status
+        self.returncode = returncode
+        self.started_at = started_at or datetime.now(timezone.utc).isoformat()
+        self.finished_at = finished_at
+        self.pid = pid
+
+    @property
+    def status_path(self):
+        return os.path.join(self.jobs_dir, f"{self.id}.json")
+
+    @property
+    def log_path(self):
+        return os.path.join(self.jobs_dir, f"{self.id}.log")
+
+    @property
+    def finished(self):
+        return self.status != 'running'
+
+    @classmethod
+    def load(cls, jobs_dir, job_id):
+        """Reads a job's status file, or returns None if there is no such job."""
+        if not job_id or not all(ch in '0123456789abcdef' for ch in job_id):
+            return None
+        try:
+            with open(os.path.join(jobs_dir, f"{job_id}.json"), encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job = cls(jobs_dir, job_id, data['script_name'], data['script_file'], data['status'], data['returncode'],
+                  data['started_at'], data['finished_at'], data['pid'])
+        if not job.finished and not process_alive(job.pid):
+            # The worker that launched it died before it could record the exit code.
+            job.status = 'lost'
+        return job
+
+    def save(self):
+        data = {
+            'script_name': self.script_name, 'script_file': self.script_file, 'status': self.status,
+            'returncode': self.returncode, 'started_at': self.started_at,
+            'finished_at': self.finished_at, 'pid': self.pid,
+        }
+        temp_path = f"{self.status_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.status_path)
+
+    def to_dict(self):
+        try:
+            output_bytes = os.path.getsize(self.log_path)
+        except OSError:
+            output_bytes = 0
+        return {
+            'id': self.id,
+            'script_name': self.script_name,
+            'script_file': self.script_file,
+            'status': self.status,
+            'returncode': self.returncode,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'output_bytes': output_bytes,
+        }
+
+    def follow(self, start=0, heartbeat=15):
+        """
+        Yields (offset, line) for every complete output line after byte offset
+        `start`, waiting for new output until the job finishes. `offset` is the
+        position just past the line, so it can be passed back as `start` to
+        resume. Yields (None, None) every `heartbeat` seconds without output so
+        callers can keep idle connections alive. Yields nothing if the log has
+        been pruned.
+        """
+        offset = start
+        idle_since = time.monotonic()
+        try:
+            log = open(self.log_path, 'rb')
+        except FileNotFoundError:
+            return
+        with log:
+            log.seek(offset)
+            pending = b''
+            while True:
+                chunk = log.read(65536)
+                if chunk:
+                    pending += chunk
+                    *lines, pending = pending.split(b'\n')
+                    for line in lines:
+                        offset += len(line) + 1
+                        yield offset, line.decode('utf-8', errors='replace').rstrip('\r')
+                    idle_since = time.monotonic()
+                    continue
+
+                current = Job.load(self.jobs_dir, self.id)
+                if current is None or current.finished:
+                    if pending:
+                        yield offset + len(pending), pending.decode('utf-8', errors='replace').rstrip('\r')
+                    if current is not None:
+                        self.__dict__.update(current.__dict__)
+                    return
+                if time.monotonic() - idle_since >= heartbeat:
+                    idle_since = time.monotonic()
+                    yield None, None
+                time.sleep(POLL_INTERVAL)
+
+
+class JobManager:
+    def __init__(self, jobs_dir=JOBS_DIR, on_finish=None):
+        """`on_finish(job)` is called from a watcher thread in the starting worker once a job has exited."""
+        self.jobs_dir = jobs_dir
+        self._on_finish = on_finish
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def _lock_path(self, script_name):
+        return os.path.join(self.jobs_dir, f"{script_name}.lock")
+
+    def get(self, job_id):
+        return Job.load(self.jobs_dir, job_id)
+
+    def running(self):
+        jobs = []
+        for entry in sorted(os.listdir(self.jobs_dir)):
+            if entry.endswith('.lock'):
+                job = self._job_for_lock(entry[:-len('.lock')])
+                if job is not None and not job.finished:
+                    jobs.append(job)
+        return jobs
+
+    def _job_for_lock(self, script_name):
+        try:
+            with open(self._lock_path(script_name), encoding='utf-8') as f:
+                return Job.load(self.jobs_dir, f.read().strip())
+        except OSError:
+            return None
+
+    def _acquire_lock(self, script_name, job_id):
+        """
+        Locks the script's lock file and records job_id in it. Returns the open
+        file; the lock is held for as long as it (or an inherited copy) is open.
+        The file itself is never deleted, so there is no stale lock to clear.
+        """
+        lock_file = open(self._lock_path(script_name), 'a+', encoding='utf-8')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                with _local_locks_guard:
+                    if script_name in _local_locks:
+                        raise BlockingIOError
+                    _local_locks.add(script_name)
+        except BlockingIOError:
+            lock_file.close()
+            holder = self._job_for_lock(script_name)
+            if holder is None:
+                raise RuntimeError(f"'{script_name}' is being started by another request.")
+            raise JobAlreadyRunning(holder)
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(job_id)
+        lock_file.flush()
+        return lock_file
+
+    def _release_local_lock(self, script_name):
+        if fcntl is None:
+            with _local_locks_guard:
+                _local_locks.discard(script_name)
+
+    def start(self, script_name, script_file, env=None, args=()):
+        """Launches `script_file` with the command-line `args` in the background and returns its Job."""
+        job = Job(self.jobs_dir, uuid.uuid4().hex, script_name, script_file)
+        lock_file = self._acquire_lock(script_name, job.id)
+        try:
+            with open(job.log_path, 'wb') as log:
+                log.write(f"--- Running {script_file} ---\n".encode('utf-8'))
+                log.flush()
+                # '-u' so the child's prints reach the log as they happen, not when its buffer fills.
+                # The child keeps the locked file open until it exits, holding the lock for this worker.
+                process = subprocess.Popen(
+                    [sys.executable, '-u', script_file, *args],
+                    stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                    env=env, pass_fds=(lock_file.fileno(),) if fcntl is not None else ()
+                )
+            job.pid = process.pid
+            job.save()
+        except BaseException:
+            self._release_local_lock(script_name)
+            raise
+        finally:
+            lock_file.close()
+
+        threading.Thread(target=self._wait, args=(job, process), daemon=True, name=f"job-{job.id}").start()
+        self._prune_finished()
+        return job
+
+    def _wait(self, job, process):
+        returncode = process.wait()
+        job.status = 'succeeded' if returncode == 0 else 'failed'
+        job.returncode = returncode
+        job.finished_at = datetime.now(timezone.utc).isoformat()
+        job.save()
+        self._release_local_lock(job.script_name)
+        if self._on_finish:
+            self._on_finish(job)
+
+    def _prune_finished(self):
+        """Deletes the oldest finished jobs' files beyond MAX_FINISHED_JOBS."""
+        jobs = [Job.load(self.jobs_dir, entry[:-len('.json')])
+                for entry in os.listdir(self.jobs_dir) if entry.endswith('.json')]
+        finished = sorted((job for job in jobs if job is not None and job.finished), key=lambda j: j.started_at)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            for path in (job.status_path, job.log_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
@@ -1,7 +1,29 @@
 import os
 import sys
-import subprocess
-from flask import Flask, render_template, g, request, redirect, url_for, flash, session
+import json
+import secrets
+import time
+from functools import wraps
+from flask import (
+    Flask, render_template, g, request, redirect, url_for, flash, session, jsonify, Response, make_response,
+    before_render_template, template_rendered, stream_with_context
+)
+
+import billing_engine
+import billing_snapshots
+import billing_summary
+import cipher_key
+import csv_export
+import data_version
+import migrations
+import search_index
+from db_pool import ConnectionPool, PoolExhausted
+from jobs import JobManager, JobAlreadyRunning
+from metrics import Registry
+from pagination import CLIENT_SECTIONS, DEFAULT_PAGE_SIZE
+from response_cache import ResponseCache, make_etag
+from session_keys import SessionKeyStore
+from sql_profiler import SqlTrace, TracedConnection
 
 # Use the sqlcipher3 library provided by the wheels package
 try:
@@ -13,164 +35,493 @@ except ImportError:
 
 # --- Configuration ---
 DATABASE = 'brainhair.db'
+POOL_MAX_CONNECTIONS = 16
+POOL_IDLE_TIMEOUT = 900 # seconds an unused unlocked connection is kept open
+RESPONSE_CACHE_ENTRIES = 64
+DASHBOARD_PAGE_SIZE = 100
+# Set BILLING_DASH_PROFILE_SQL=1 to allow '?profile=1' (panel) or '?profile=json' on any page.
+SQL_PROFILING = os.environ.get('BILLING_DASH_PROFILE_SQL') == '1'
+SQL_EXPLAIN_THRESHOLD_MS = float(os.environ.get('BILLING_DASH_EXPLAIN_THRESHOLD_MS', 5))
+VALID_SCRIPTS = {
+    'sync_freshservice': 'pull_freshservice.py',
+    'sync_datto': 'pull_datto.py',
+    'set_freshservice_ids': 'set_account_numbers.py',
+    'push_ids_to_datto': 'push_account_nums_to_datto.py',
+    'close_billing_month': 'billing_snapshots.py'
+}
+# Syncs started from the settings page continue an earlier run that failed or was stopped, if there is one.
+SCRIPT_ARGS = {
+    'sync_freshservice': ['--resume'],
+    'sync_datto': ['--resume'],
+}
+SECRET_KEY_FILE = 'secret_key'
+# Endpoints fetched by page scripts, which show the 'error' field of a JSON reply.
+JSON_ENDPOINTS = {'client_section', 'simulate_billing_plans'}
+POOL_BUSY_RETRY_AFTER = 5 # seconds
 app = Flask(__name__)
-# A secret key is required for server-side sessions
-app.secret_key = os.urandom(24)
+
+def load_secret_key():
+    """
+    Returns the session signing key shared by every worker process. It comes
+    from the BILLING_DASH_SECRET_KEY environment variable if set, otherwise
+    from SECRET_KEY_FILE, which is created on first use.
+    """
+    env_key = os.environ.get('BILLING_DASH_SECRET_KEY')
+    if env_key:
+        return env_key.encode()
+    try:
+        fd = os.open(SECRET_KEY_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    except FileExistsError:
+        # Another worker (or an earlier run) created it first.
+        with open(SECRET_KEY_FILE, 'rb') as f:
+            key = f.read()
+        if len(key) < 32:
+            raise RuntimeError(f"'{SECRET_KEY_FILE}' is incomplete. Delete it to generate a new one.")
+        return key
+    key = os.urandom(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+# A secret key is required for sessions; it must be the same in every worker.
+app.secret_key = load_secret_key()
+
+def open_unlocked_connection(raw_key):
+    """Opens a connection to the encrypted database and unlocks it with the raw key derived at login."""
+    if not os.path.exists(DATABASE):
+        raise FileNotFoundError(f"Database file '{DATABASE}' not found. Please run init_db.py first.")
+
+    # Pooled connections are borrowed by whichever worker thread serves the next request.
+    with DB_OPEN_SECONDS.time():
+        db = sqlite3.connect(DATABASE, check_same_thread=False)
+    try:
+        # A raw key skips SQLCipher's KDF; the key is checked when the first page is read.
+        with DB_KEY_SECONDS.time():
+            cipher_key.unlock(db, raw_key)
+        db.row_factory = sqlite3.Row
+    except sqlite3.DatabaseError:
+        db.close()
+        raise ValueError("Invalid master password.")
+    return db
+
+metrics_registry = Registry()
+REQUEST_SECONDS = metrics_registry.histogram(
+    'billing_dash_request_duration_seconds', "Time spent handling a request, by Flask endpoint.", ('endpoint', 'method'))
+QUERY_SECONDS = metrics_registry.histogram(
+    'billing_dash_query_duration_seconds', "Time spent executing and fetching a named SQL query.", ('query',))
+TEMPLATE_SECONDS = metrics_registry.histogram(
+    'billing_dash_template_render_seconds', "Time spent rendering a Jinja template.", ('template',))
+DB_OPEN_SECONDS = metrics_registry.histogram(
+    'billing_dash_db_connection_open_seconds', "Time spent opening a database connection (before keying).")
+DB_KEY_SECONDS = metrics_registry.histogram(
+    'billing_dash_db_key_derivation_seconds', "Time spent keying and unlocking a new connection.")
+LOGIN_KDF_SECONDS = metrics_registry.histogram(
+    'billing_dash_login_key_derivation_seconds', "Time spent deriving the raw database key from the master password at login.")
+SCRIPT_RUNS = metrics_registry.counter(
+    'billing_dash_script_runs_total', "Finished run_script jobs, by script and exit code.", ('script', 'exit_code'))
+
+def record_script_run(job):
+    SCRIPT_RUNS.inc(script=job.script_name, exit_code=job.returncode)
+    metrics_registry.flush()
+
+job_manager = JobManager(on_finish=record_script_run)
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_ENTRIES)
+session_keys = SessionKeyStore()
+
+connection_pool = ConnectionPool(
+    open_unlocked_connection,
+    max_connections=POOL_MAX_CONNECTIONS,
+    idle_timeout=POOL_IDLE_TIMEOUT
+)
 
 def get_db():
-    """Connects to the encrypted database and unlocks it using the password from the session."""
+    """Borrows an unlocked connection for this session from the pool for the rest of the request."""
     db = getattr(g, '_database', None)
     if db is None:
-        if not os.path.exists(DATABASE):
-            raise FileNotFoundError(f"Database file '{DATABASE}' not found. Please run init_db.py first.")
+        pool_key = session.get('pool_key')
+        if not pool_key:
+            raise ValueError("Database key not found in session.")
 
-        master_password = session.get('db_password')
-        if not master_password:
-            raise ValueError("Database password not found in session.")
-
-        db = g._database = sqlite3.connect(DATABASE)
-        try:
-            db.execute(f"PRAGMA key = '{master_password}';")
-            db.execute("SELECT name FROM sqlite_master WHERE type='table' LIMIT 1;")
-            db.row_factory = sqlite3.Row
-        except sqlite3.DatabaseError:
-            db.close()
-            g._database = None
-            raise ValueError("Invalid master password.")
+        db = g._database = connection_pool.acquire(pool_key, session_keys.get(pool_key))
+        g._pool_key = pool_key
 
+    trace = getattr(g, 'sql_trace', None)
+    if trace is not None:
+        return TracedConnection(db, trace)
     return db
 
 @app.teardown_appcontext
 def close_connection(exception):
-    """Closes the database at the end of the request."""
-    db = getattr(g, '_database', None)
+    """Returns the database connection to the pool at the end of the request."""
+    # Popped so a streamed response, whose context is torn down twice, releases it only once.
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        connection_pool.release(g._pool_key, db)
+
+def end_db_session():
+    """Forgets the session's database key and closes its pooled connections."""
+    pool_key = session.pop('pool_key', None)
+    if pool_key:
+        session_keys.remove(pool_key)
+        connection_pool.evict(pool_key)
+
+@app.before_request
+def start_request_timer():
+    g._request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = getattr(g, '_request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unknown', method=request.method)
+        metrics_registry.flush(force=False)
+    return response
+
+@app.errorhandler(PoolExhausted)
+def database_busy(e):
+    """
+    Every pooled connection stayed borrowed past the acquire timeout. Answers
+    503 so the user retries, instead of a 500 or the views' "log in again"
+    handling, which would end a session that is still valid.
+    """
+    message = "Database busy, please retry in a few seconds."
+    if request.endpoint in JSON_ENDPOINTS:
+        response = jsonify({'error': message})
+    else:
+        response = make_response(message)
+        response.mimetype = 'text/plain'
+    response.status_code = 503
+    response.headers['Retry-After'] = str(POOL_BUSY_RETRY_AFTER)
+    return response
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g._template_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    started = g.pop('_template_started', None)
+    if started is not None:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - started, template=template.name)
 
 @app.before_request
 def require_login():
-    """Checks that a password is in the session before allowing access to any page."""
-    if 'db_password' not in session and request.endpoint not in ['login', 'static']:
+    """Checks that the session holds a database key token before allowing access to any page."""
+    if 'pool_key' not in session and request.endpoint not in ['login', 'static', 'metrics']:
         return redirect(url_for('login'))
 
+@app.before_request
+def start_sql_profile():
+    """Turns on SQL tracing for this request when profiling is enabled and '?profile' is given."""
+    if SQL_PROFILING and request.args.get('profile') and request.endpoint not in ['login', 'static', 'metrics']:
+        g.sql_trace = SqlTrace(explain_threshold_ms=SQL_EXPLAIN_THRESHOLD_MS)
+
+@app.after_request
+def attach_sql_profile(response):
+    """Adds the request's SQL trace as a collapsible panel, or replaces the response with it for '?profile=json'."""
+    trace = g.pop('sql_trace', None)
+    if trace is None:
+        return response
+    db = getattr(g, '_database', None)
+    if db is not None:
+        trace.explain_slow(db)
+    if request.args.get('profile') == 'json':
+        return jsonify(trace.to_dict())
+    if response.status_code == 200 and response.mimetype == 'text/html' and not response.is_streamed:
+        panel = render_template('sql_profile.html', trace=trace.to_dict())
+        body = response.get_data(as_text=True)
+        end = body.rfind('</body>')
+        end = len(body) if end == -1 else end
+        response.set_data(body[:end] + panel + body[end:])
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus scrape endpoint, summed over all worker processes. It does not
+    need a login; set METRICS_TOKEN to require 'Authorization: Bearer <token>'.
+    """
+    token = os.environ.get('METRICS_TOKEN')
+    if token and not secrets.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return Response("Unauthorized\n", status=401, mimetype='text/plain')
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """Displays the login page and handles password submission."""
     if request.method == 'POST':
         password_attempt = request.form.get('password')
+        end_db_session()
         try:
-            session['db_password'] = password_attempt
+            # The only KDF run for this session; every connection after this uses the raw key.
+            with LOGIN_KDF_SECONDS.time():
+                raw_key = cipher_key.derive_raw_key(DATABASE, password_attempt)
+            # The cookie gets only a revocable token; the key stays on the server.
+            session['pool_key'] = session_keys.add(raw_key)
             db = get_db()
+            applied = migrations.apply_migrations(db)
+            if applied:
+                flash(f"Database schema upgraded to version {applied[-1]}.", 'success')
             flash('Database unlocked successfully!', 'success')
             return redirect(url_for('billing_dashboard'))
-        except (ValueError, sqlite3.Error):
-            session.pop('db_password', None)
+        except (OSError, ValueError, sqlite3.Error):
+            end_db_session()
             flash(f"Login failed: Invalid master password.", 'error')
             return redirect(url_for('login'))
 
     return render_template('login.html')
 
-def query_db(query, args=(), one=False):
-    """Helper function to query the database."""
-    cur = get_db().execute(query, args)
-    rv = cur.fetchall()
+@app.route('/logout')
+def logout():
+    """Locks the database again for this session."""
+    end_db_session()
+    flash("Logged out.", 'success')
+    return redirect(url_for('login'))
+
+def cached_page(vary=None):
+    """
+    Serves a GET page from response_cache while the database change counter is
+    unchanged, answering If-None-Match with 304 without running the view.
+    `vary` returns anything else the page depends on (e.g. running jobs).
+    Pages carrying flashed messages are never cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes') or getattr(g, 'sql_trace', None):
+                return view(*args, **kwargs)
+            try:
+                generation = data_version.get_generation(get_db())
+            except (ValueError, sqlite3.Error):
+                # Let the view run and report the error the usual way.
+                return view(*args, **kwargs)
+
+            etag = make_etag(generation, request.full_path, vary() if vary else '')
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                cached = response_cache.get(etag)
+                if cached is not None:
+                    response = Response(cached[0], mimetype=cached[1])
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or session.get('_flashes'):
+                        return response
+                    response_cache.put(etag, response.get_data(), response.mimetype)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def query_db(query, args=(), one=False, name=None):
+    """Helper function to query the database. `name` labels the query's latency metric."""
+    db = get_db()
+    with QUERY_SECONDS.time(query=name or request.endpoint):
+        cur = db.execute(query, args)
+        rv = cur.fetchall()
     cur.close()
     return (rv[0] if rv else None) if one else rv
 
 @app.route('/')
+@cached_page()
 def billing_dashboard():
-    """Main route to display the client billing dashboard."""
+    """
+    Main route to display the client billing dashboard. Accepts 'q' (full-text
+    search over client names, hostnames and users), 'sort', 'order' and 'page'.
+    """
+    search = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc').lower()
+    if sort not in billing_summary.DASHBOARD_SORTS:
+        sort = 'name'
+    if order not in ('asc', 'desc'):
+        order = 'asc'
+    page = max(1, request.args.get('page', 1, type=int))
+
     try:
-        clients_query = """
-            SELECT
-                c.account_number, c.name, c.contract_type, c.billing_plan,
-                COUNT(DISTINCT CASE WHEN a.operating_system LIKE '%Server%' THEN a.id END) as server_count,
-                COUNT(DISTINCT CASE WHEN a.operating_system NOT LIKE '%Server%' AND a.operating_system IS NOT NULL THEN a.id END) as workstation_count,
-                COUNT(DISTINCT u.id) as user_count,
-                COALESCE(bp.base_price, 0) as base_price,
-                COALESCE(bp.per_user_cost, 0) as per_user_cost,
-                COALESCE(bp.per_server_cost, 0) as per_server_cost,
-                COALESCE(bp.per_workstation_cost, 0) as per_workstation_cost,
-                COALESCE(bp.billed_by, 'Not Configured') as billed_by
-            FROM companies c
-            LEFT JOIN assets a ON c.account_number = a.company_account_number
-            LEFT JOIN users u ON c.account_number = u.company_account_number
-            LEFT JOIN billing_plans bp ON c.contract_type = bp.contract_type AND c.billing_plan = bp.billing_plan
-            GROUP BY c.account_number ORDER BY c.name ASC;
-        """
-        clients_data = query_db(clients_query)
-
-        clients_with_totals = []
-        for client in clients_data:
-            client_dict = dict(client)
-            total = client_dict['base_price']
-            if client_dict['billed_by'] == 'Per User':
-                total += client_dict['user_count'] * client_dict['per_user_cost']
-            elif client_dict['billed_by'] == 'Per Device':
-                total += client_dict['workstation_count'] * client_dict['per_workstation_cost']
-                total += client_dict['server_count'] * client_dict['per_server_cost']
-            client_dict['total_bill'] = total
-            clients_with_totals.append(client_dict)
-
-        return render_template('billing.html', clients=clients_with_totals)
+        with QUERY_SECONDS.time(query='clients_query'):
+            clients, total = billing_summary.fetch_clients_page(
+                get_db(), search_index.build_match_query(search), sort, order,
+                limit=DASHBOARD_PAGE_SIZE, offset=(page - 1) * DASHBOARD_PAGE_SIZE
+            )
+        page_count = max(1, -(-total // DASHBOARD_PAGE_SIZE))
+        if page > page_count:
+            return redirect(url_for('billing_dashboard', q=search or None, sort=sort, order=order, page=page_count))
+        return render_template('billing.html', clients=clients, search=search, sort=sort, order=order,
+                               page=page, page_count=page_count, total=total)
     except (ValueError, sqlite3.Error) as e:
-        session.pop('db_password', None)
+        end_db_session()
+        flash(f"Database Error: {e}. Please log in again.", 'error')
+        return redirect(url_for('login'))
+
+def csv_response(cursor, filename):
+    """Streams an executed cursor as a CSV download; the pooled connection is held until the last row is sent."""
+    return Response(
+        stream_with_context(csv_export.iter_csv(cursor)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/export/clients.csv')
+def export_clients():
+    """Downloads the billing dashboard as CSV."""
+    try:
+        cur = get_db().execute("""
+            SELECT account_number, name, contract_type, billing_plan, billed_by,
+                   workstation_count, server_count, user_count, total_bill
+            FROM client_billing_summary
+            ORDER BY name ASC
+        """)
+        return csv_response(cur, csv_export.export_filename('clients', time.strftime('%Y-%m-%d')))
+    except (ValueError, sqlite3.Error) as e:
+        end_db_session()
+        flash(f"Database Error: {e}. Please log in again.", 'error')
+        return redirect(url_for('login'))
+
+@app.route('/export/assets.csv')
+def export_all_assets():
+    """Downloads every client with each of its assets, one row per asset, as CSV."""
+    try:
+        # Clients without assets still get one row so the dump lists every client.
+        cur = get_db().execute("""
+            SELECT s.account_number, s.name AS company_name, s.contract_type, s.billing_plan, s.total_bill,
+                   a.hostname, a.friendly_name, a.device_type, a.operating_system, a.status, a.date_added
+            FROM client_billing_summary s
+            LEFT JOIN assets a ON a.company_account_number = s.account_number
+            ORDER BY s.name ASC, a.hostname ASC
+        """)
+        return csv_response(cur, csv_export.export_filename('client-assets', time.strftime('%Y-%m-%d')))
+    except (ValueError, sqlite3.Error) as e:
+        end_db_session()
+        flash(f"Database Error: {e}. Please log in again.", 'error')
+        return redirect(url_for('login'))
+
+@app.route('/reports')
+@cached_page()
+def billing_reports():
+    """Month-over-month revenue trend and a per-client comparison, read from billing_snapshots."""
+    try:
+        db = get_db()
+        months = billing_snapshots.month_totals(db)
+        month_names = [row['month'] for row in months]
+        month = request.args.get('month') or (month_names[0] if month_names else None)
+        baseline = request.args.get('baseline')
+        if baseline is None and month in month_names:
+            older = month_names[month_names.index(month) + 1:]
+            baseline = older[0] if older else None
+        comparison = billing_snapshots.compare_months(db, month, baseline) if month and baseline else []
+        return render_template('reports.html', months=months, month_names=month_names,
+                               month=month, baseline=baseline, comparison=comparison)
+    except (ValueError, sqlite3.Error) as e:
+        end_db_session()
         flash(f"Database Error: {e}. Please log in again.", 'error')
         return redirect(url_for('login'))
 
-# --- NEW ROUTE ---
 @app.route('/client/<account_number>')
+@cached_page()
 def client_settings(account_number):
-    """Displays a detailed view for a single client."""
+    """Displays the page shell for a single client; its tables load from client_section."""
     try:
-        # Query for the main company info
-        client_info = query_db("SELECT * FROM companies WHERE account_number = ?", [account_number], one=True)
+        client_info = query_db("SELECT * FROM companies WHERE account_number = ?", [account_number], one=True, name='client_info')
         if not client_info:
             flash(f"Client with account number {account_number} not found.", 'error')
             return redirect(url_for('billing_dashboard'))
 
-        # Query for associated assets, users, and ticket hours
-        assets = query_db("SELECT * FROM assets WHERE company_account_number = ? ORDER BY hostname", [account_number])
-        users = query_db("SELECT * FROM users WHERE company_account_number = ? ORDER BY full_name", [account_number])
-        ticket_hours = query_db("SELECT * FROM ticket_work_hours WHERE company_account_number = ? ORDER BY month DESC", [account_number])
+        return render_template('client_settings.html', client=client_info, sections=CLIENT_SECTIONS)
 
-        return render_template('client_settings.html', client=client_info, assets=assets, users=users, ticket_hours=ticket_hours)
+    except (ValueError, sqlite3.Error) as e:
+        end_db_session()
+        flash(f"Database Error: {e}. Please log in again.", 'error')
+        return redirect(url_for('login'))
 
+@app.route('/client/<account_number>/<section>')
+def client_section(account_number, section):
+    """
+    Returns one page of a client's assets, users or hours as JSON. Accepts
+    'sort', 'order' (asc/desc), 'limit' and the 'cursor' from the previous page.
+    The first page also carries the section's total row count.
+    """
+    page_spec = CLIENT_SECTIONS.get(section)
+    if page_spec is None:
+        return jsonify({'error': f"Unknown section '{section}'."}), 404
+
+    cursor = request.args.get('cursor')
+    try:
+        db = get_db()
+        with QUERY_SECONDS.time(query=f'client_{section}_page'):
+            items, next_cursor = page_spec.fetch_page(
+                db, account_number,
+                sort=request.args.get('sort'),
+                order=request.args.get('order'),
+                cursor=cursor,
+                limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+            )
+        payload = {'items': items, 'next_cursor': next_cursor}
+        if not cursor:
+            with QUERY_SECONDS.time(query=f'client_{section}_count'):
+                payload['total'] = page_spec.count(db, account_number)
+        return jsonify(payload)
+    except ValueError as e:
+        # Bad sort/order/cursor parameters, including InvalidCursor.
+        return jsonify({'error': str(e)}), 400
+    except sqlite3.Error as e:
+        return jsonify({'error': f"Database Error: {e}"}), 500
+
+@app.route('/client/<account_number>/export/<section>.csv')
+def export_client_section(account_number, section):
+    """Downloads all of a client's assets, users or hours as CSV."""
+    page_spec = CLIENT_SECTIONS.get(section)
+    if page_spec is None:
+        flash(f"Unknown export '{section}'.", 'error')
+        return redirect(url_for('client_settings', account_number=account_number))
+    try:
+        cur = page_spec.export_cursor(get_db(), account_number)
+        return csv_response(cur, csv_export.export_filename(account_number, section))
     except (ValueError, sqlite3.Error) as e:
-        session.pop('db_password', None)
+        end_db_session()
         flash(f"Database Error: {e}. Please log in again.", 'error')
         return redirect(url_for('login'))
 
 
+def parse_billing_plan_form(form):
+    """Reads the numbered plan rows of the settings form into billing_plans tuples."""
+    plans = []
+    num_plans = len([key for key in form if key.startswith('billed_by_')])
+
+    for i in range(1, num_plans + 1):
+        plans.append((
+            form.get(f'contract_type_{i}'),
+            form.get(f'billing_plan_{i}'),
+            form.get(f'billed_by_{i}'),
+            float(form.get(f'base_price_{i}', 0)),
+            float(form.get(f'per_user_cost_{i}', 0)),
+            float(form.get(f'per_server_cost_{i}', 0)),
+            float(form.get(f'per_workstation_cost_{i}', 0))
+        ))
+    return plans
+
 @app.route('/settings', methods=['GET', 'POST'])
+@cached_page(vary=lambda: ','.join(sorted(job.id for job in job_manager.running())))
 def billing_settings():
-    # ... (this function remains unchanged)
+    """Displays and saves billing plan settings, and shows the sync actions and job output."""
     try:
         db = get_db()
         if request.method == 'POST':
-            plans_to_update = []
-            num_plans = len([key for key in request.form if key.startswith('billed_by_')])
-
-            for i in range(1, num_plans + 1):
-                plans_to_update.append((
-                    request.form.get(f'contract_type_{i}'),
-                    request.form.get(f'billing_plan_{i}'),
-                    request.form.get(f'billed_by_{i}'),
-                    float(request.form.get(f'base_price_{i}', 0)),
-                    float(request.form.get(f'per_user_cost_{i}', 0)),
-                    float(request.form.get(f'per_server_cost_{i}', 0)),
-                    float(request.form.get(f'per_workstation_cost_{i}', 0))
-                ))
-
+            plans_to_update = parse_billing_plan_form(request.form)
             db.executemany("""
                 INSERT OR REPLACE INTO billing_plans
                 (contract_type, billing_plan, billed_by, base_price, per_user_cost, per_server_cost, per_workstation_cost)
                 VALUES (?, ?, ?, ?, ?, ?, ?);
             """, plans_to_update)
+            touched_accounts = billing_summary.accounts_for_plans(db, [(p[0], p[1]) for p in plans_to_update])
+            billing_summary.refresh_client_billing_summary(db, touched_accounts)
+            data_version.bump_generation(db)
             db.commit()
             flash("Billing plan settings saved successfully!", 'success')
             return redirect(url_for('billing_settings'))
 
+        job = job_manager.get(request.args.get('job', ''))
         all_plans_query = """
             SELECT DISTINCT
                 c.contract_type, c.billing_plan,
@@ -184,62 +535,103 @@ def billing_settings():
                 ON c.contract_type = bp.contract_type AND c.billing_plan = bp.billing_plan
             ORDER BY c.contract_type, c.billing_plan;
         """
-        all_plans = query_db(all_plans_query)
-        return render_template('settings.html', all_plans=all_plans)
+        all_plans = query_db(all_plans_query, name='all_plans_query')
+        return render_template('settings.html', all_plans=all_plans, job=job, running_jobs=job_manager.running())
     except (ValueError, sqlite3.Error) as e:
-        session.pop('db_password', None)
+        end_db_session()
         flash(f"Database Error: {e}. Please log in again.", 'error')
         return redirect(url_for('login'))
 
 
+@app.route('/settings/simulate', methods=['POST'])
+def simulate_billing_plans():
+    """Re-prices every client with the submitted (unsaved) plan settings and returns the revenue impact as JSON."""
+    try:
+        candidate_plans = {
+            (plan[0], plan[1]): dict(zip(billing_engine.PLAN_FIELDS, plan[2:]))
+            for plan in parse_billing_plan_form(request.form)
+        }
+    except ValueError as e:
+        return jsonify({'error': f"Invalid plan settings: {e}"}), 400
+
+    try:
+        return jsonify(billing_engine.simulate_plans(get_db(), candidate_plans))
+    except (ValueError, sqlite3.Error) as e:
+        return jsonify({'error': f"Database Error: {e}"}), 500
+
 @app.route('/run_script/<script_name>', methods=['POST'])
 def run_script(script_name):
-    # ... (this function remains unchanged)
-    master_password = session.get('db_password')
-    if not master_password:
+    """Starts a sync script as a background job and sends the browser to follow its output."""
+    try:
+        raw_key = session_keys.get(session.get('pool_key', ''))
+    except ValueError:
+        end_db_session()
         flash("Error: Session expired. Please log in again.", 'error')
         return redirect(url_for('login'))
 
-    valid_scripts = {
-        'sync_freshservice': 'pull_freshservice.py',
-        'sync_datto': 'pull_datto.py',
-        'set_freshservice_ids': 'set_account_numbers.py',
-        'push_ids_to_datto': 'push_account_nums_to_datto.py'
-    }
-
-    script_to_run = valid_scripts.get(script_name)
+    script_to_run = VALID_SCRIPTS.get(script_name)
 
     if not script_to_run or not os.path.exists(script_to_run):
         flash(f"Error: Script '{script_name}' not found or is not valid.", 'error')
         return redirect(url_for('billing_settings'))
 
     try:
-        python_executable = sys.executable
         env = os.environ.copy()
-        env['DB_MASTER_PASSWORD'] = master_password
-
-        result = subprocess.run(
-            [python_executable, script_to_run],
-            capture_output=True, text=True, check=False, timeout=300,
-            encoding='utf-8', errors='replace',
-            env=env
-        )
-
-        output = f"--- Running {script_to_run} ---\n\n{result.stdout}\n{result.stderr}"
-
-        if result.returncode == 0:
-            flash(f"Script '{script_to_run}' executed successfully.", 'success')
-        else:
-            flash(f"❌ Script '{script_to_run}' finished with an error (exit code {result.returncode}).", 'error')
-
-        flash(output, 'output')
-
-    except subprocess.TimeoutExpired:
-        flash(f"❌ Script '{script_to_run}' timed out after 5 minutes.", 'error')
+        # The script unlocks with the raw key; the master password never leaves the login request.
+        env.pop(cipher_key.PASSWORD_ENV, None)
+        env[cipher_key.RAW_KEY_ENV] = raw_key
+        job = job_manager.start(script_name, script_to_run, env=env, args=SCRIPT_ARGS.get(script_name, ()))
+        flash(f"Started '{script_to_run}' in the background.", 'success')
+    except JobAlreadyRunning as e:
+        flash(f"❌ {e} Showing its progress instead.", 'error')
+        job = e.job
     except Exception as e:
         flash(f"An unexpected error occurred: {e}", 'error')
+        return redirect(url_for('billing_settings'))
 
-    return redirect(url_for('billing_settings'))
+    return redirect(url_for('billing_settings', job=job.id))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Returns a background job's status as JSON."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Job '{job_id}' not found."}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+    """Streams a background job's output as Server-Sent Events, one event per line."""
+    job = job_manager.get(job_id)
+    if job is None or not os.path.exists(job.log_path):
+        return jsonify({'error': f"Job '{job_id}' not found."}), 404
+
+    # Event ids are byte offsets into the job's log; EventSource resends the last one when it reconnects.
+    start = request.headers.get('Last-Event-ID', 0, type=int)
+
+    def events():
+        for offset, line in job.follow(start):
+            if offset is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"id: {offset}\ndata: {line}\n\n"
+        yield f"event: done\ndata: {json.dumps(job.to_dict())}\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def warm_worker():
+    """
+    Prepares a freshly started worker before it takes traffic. Connections
+    cannot be unlocked until a user logs in, so this compiles every template
+    and opens the database file once so the first real request does not
+    wait on a cold disk.
+    """
+    for template in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template)
+    if not os.path.exists(DATABASE):
+        raise FileNotFoundError(f"Database file '{DATABASE}' not found. Please run init_db.py first.")
+    with open(DATABASE, 'rb') as f:
+        f.read(4096)
 
 if __name__ == '__main__':
     if not (os.path.exists('cert.pem') and os.path.exists('key.pem')):
@@ -252,4 +644,6 @@ if __name__ == '__main__':
         print("Please run 'python init_db.py' to create and configure it first.", file=sys.stderr)
         sys.exit(1)
 
-    app.run(debug=True, host='0.0.0.0', port=5002, ssl_context=('cert.pem', 'key.pem'))
+    # Development server. Use 'python serve.py' to run several worker processes in production.
+    debug = os.environ.get('BILLING_DASH_DEBUG') == '1'
+    app.run(debug=debug, threaded=True, host='0.0.0.0', port=5002, ssl_context=('cert.pem', 'key.pem'))
@@ -0,0 +1,294 @@
+"""
+Minimal Prometheus-style counters and histograms.
+
+Each worker process keeps its own metrics in memory and periodically writes a
+snapshot to METRICS_DIR, from a background thread and once more when it
+exits, so idle and exiting workers do not leave stale totals behind. The
+/metrics endpoint sums the snapshots of every
+worker and renders them in the Prometheus text exposition format. The
+snapshots of workers that have exited are folded into one cumulative file,
+so counters never go backwards and the directory holds one file per live
+worker plus that one.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from processes import process_alive
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+METRICS_DIR = 'metrics'
+FLUSH_INTERVAL = 1.0 # seconds; snapshots may lag the live values by this much
+CUMULATIVE_FILE = 'cumulative.json' # totals of exited workers
+COMPACT_LOCK_FILE = 'compact.lock'
+
+# Request/query latencies are mostly milliseconds; key derivation is tenths of a second.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {'type': 'counter', 'help': self.documentation, 'labelnames': list(self.labelnames), 'samples': samples}
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {} # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            samples = [[list(key), list(state)] for key, state in self._values.items()]
+        return {'type': 'histogram', 'help': self.documentation, 'labelnames': list(self.labelnames),
+                'buckets': list(self.buckets), 'samples': samples}
+
+
+class Registry:
+    def __init__(self, metrics_dir=METRICS_DIR):
+        self.metrics_dir = metrics_dir
+        self._metrics = {}
+        self._last_flush = 0.0
+        self._flush_lock = threading.Lock()
+        self._snapshot_name = None # (pid, file name); re-derived after a fork
+        self._last_written = None
+        self._flusher_pid = None # pid the background flush thread runs in; threads do not survive a fork
+        atexit.register(self._flush_at_exit)
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = self._metrics[name] = Counter(name, documentation, labelnames)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = self._metrics[name] = Histogram(name, documentation, labelnames, buckets)
+        return metric
+
+    def flush(self, force=True):
+        """
+        Writes this process's snapshot to METRICS_DIR (at most once per
+        FLUSH_INTERVAL unless forced), and starts the thread that keeps
+        writing it every FLUSH_INTERVAL while the process lives.
+        """
+        self._start_flusher()
+        now = time.monotonic()
+        if not force and now - self._last_flush < FLUSH_INTERVAL:
+            return
+        with self._flush_lock:
+            self._last_flush = now
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            if self._snapshot_name is None or self._snapshot_name[0] != os.getpid():
+                # The start time keeps a recycled pid from overwriting an exited worker's totals.
+                self._snapshot_name = (os.getpid(), f"{os.getpid()}-{time.time_ns()}.json")
+                self._last_written = None
+            data = json.dumps({name: metric.snapshot() for name, metric in self._metrics.items()})
+            if data == self._last_written:
+                return
+            path = os.path.join(self.metrics_dir, self._snapshot_name[1])
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            self._last_written = data
+
+    def _start_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        with self._flush_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush(force=False)
+            except OSError:
+                pass
+
+    def _flush_at_exit(self):
+        # Only a process that has recorded metrics writes a last snapshot (not, e.g., gunicorn's master).
+        if self._flusher_pid == os.getpid():
+            self.flush()
+
+    def collect(self):
+        """Sums the snapshots of every worker into one {name: snapshot} dict."""
+        self.flush()
+        self.compact()
+        cumulative_path = os.path.join(self.metrics_dir, CUMULATIVE_FILE)
+        cumulative = _read_json(cumulative_path) or {'folded': [], 'metrics': {}}
+        while True:
+            merged = {}
+            _merge(merged, cumulative['metrics'])
+            for entry in self._worker_files():
+                # A file listed as folded is already in the cumulative totals; its deletion was interrupted.
+                if entry in cumulative['folded']:
+                    continue
+                snapshot = _read_json(os.path.join(self.metrics_dir, entry))
+                if snapshot is not None:
+                    _merge(merged, snapshot)
+            # Another worker compacting meanwhile may have deleted snapshots we had not read yet; sum again.
+            latest = _read_json(cumulative_path) or {'folded': [], 'metrics': {}}
+            if latest['folded'] == cumulative['folded']:
+                return merged
+            cumulative = latest
+
+    def compact(self):
+        """
+        Folds the snapshots of exited workers into CUMULATIVE_FILE and deletes
+        them. The new cumulative file names the snapshots it absorbed, so a
+        crash before they are deleted cannot count them twice. Skipped while
+        another process is compacting.
+        """
+        if fcntl is None:
+            # Exited workers cannot be told apart on Windows anyway (see processes.process_alive).
+            return
+        # flock is released by the kernel when its holder dies, so a crash cannot leave a stale lock.
+        with open(os.path.join(self.metrics_dir, COMPACT_LOCK_FILE), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            cumulative_path = os.path.join(self.metrics_dir, CUMULATIVE_FILE)
+            cumulative = _read_json(cumulative_path) or {'folded': [], 'metrics': {}}
+            for entry in cumulative['folded']:
+                _remove(os.path.join(self.metrics_dir, entry))
+
+            merged, folded = {}, []
+            _merge(merged, cumulative['metrics'])
+            for entry in self._worker_files():
+                pid = _snapshot_pid(entry)
+                if pid is None or pid == os.getpid() or process_alive(pid):
+                    continue
+                snapshot = _read_json(os.path.join(self.metrics_dir, entry))
+                if snapshot is not None:
+                    _merge(merged, snapshot)
+                folded.append(entry)
+            if not folded:
+                return
+
+            temp_path = f"{cumulative_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'folded': folded, 'metrics': _to_snapshot(merged)}, f)
+            os.replace(temp_path, cumulative_path)
+            for entry in folded:
+                _remove(os.path.join(self.metrics_dir, entry))
+
+    def _worker_files(self):
+        return [entry for entry in os.listdir(self.metrics_dir) if entry.endswith('.json') and entry != CUMULATIVE_FILE]
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labels, value in sorted(metric['samples'].items()):
+                pairs = [f'{label}="{_escape(v)}"' for label, v in zip(metric['labelnames'], labels)]
+                if metric['type'] == 'counter':
+                    lines.append(f"{name}{_labels(pairs)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric['buckets'] + ['+Inf'], value[:-1]):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{_labels(pairs + [le])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {value[-1]}")
+                lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(merged, snapshot):
+    """Adds a snapshot ({name: metric} with sample lists) into `merged` (samples keyed by label tuple)."""
+    for name, metric in snapshot.items():
+        target = merged.setdefault(name, dict(metric, samples={}))
+        for labels, value in metric['samples']:
+            key = tuple(labels)
+            if metric['type'] == 'counter':
+                target['samples'][key] = target['samples'].get(key, 0) + value
+            else:
+                current = target['samples'].get(key)
+                target['samples'][key] = value if current is None else [a + b for a, b in zip(current, value)]
+
+
+def _to_snapshot(merged):
+    """The inverse of _merge's keying: turns merged metrics back into the snapshot file format."""
+    return {name: dict(metric, samples=[[list(key), value] for key, value in metric['samples'].items()])
+            for name, metric in merged.items()}
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _snapshot_pid(entry):
+    try:
+        return int(entry.split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return "{" + ",".join(pairs) + "}" if pairs else ""
@@ -0,0 +1,190 @@
+"""
+Versioned schema migrations for brainhair.db.
+
+The schema version is stored in SQLite's `PRAGMA user_version`. Each entry in
+MIGRATIONS upgrades the database by exactly one version and runs in its own
+transaction, so existing databases can be upgraded in place. To change the
+schema, append a new migration; never edit one that has already shipped.
+
+Run directly to upgrade a database without starting the web app:
+    python migrations.py
+"""
+import os
+import sys
+import getpass
+
+import billing_snapshots
+import cipher_key
+import billing_summary
+import data_version
+import search_index
+import sync_checkpoints
+import sync_watermarks
+import time_entries
+
+try:
+    from sqlcipher3 import dbapi2 as sqlite3
+except ImportError:
+    print("Error: sqlcipher3-wheels is not installed. Please install it using: pip install sqlcipher3-wheels", file=sys.stderr)
+    sys.exit(1)
+
+
+DB_FILE = "brainhair.db"
+
+
+def _create_client_billing_summary(cur):
+    cur.execute(billing_summary.SUMMARY_SCHEMA)
+    cur.execute(billing_summary.SUMMARY_NAME_INDEX)
+    # Migration 2's per-account indexes are created first on purpose: without
+    # them every correlated count in the refresh scans all of assets/users,
+    # which is quadratic and takes minutes at login on a large database. They
+    # are IF NOT EXISTS, so the end schema is unchanged. (Edited before any
+    # release shipped migration 1.)
+    _add_hot_path_indexes(cur)
+    billing_summary.refresh_client_billing_summary(cur.connection)
+
+
+def _add_hot_path_indexes(cur):
+    # Dashboard counts and the client detail page filter by account and
+    # then read the OS / sort by hostname or name; these cover both.
+    # ticket_work_hours needs nothing extra: its (company_account_number, month)
+    # primary key index already serves "ORDER BY month DESC" for one account.
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_assets_company_os
+        ON assets (company_account_number, operating_system)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_assets_company_hostname
+        ON assets (company_account_number, hostname)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_company_full_name
+        ON users (company_account_number, full_name)
+    """)
+    cur.execute("ANALYZE")
+
+
+def _create_data_generation(cur):
+    cur.execute(data_version.DATA_GENERATION_SCHEMA)
+
+
+def _create_billing_snapshots(cur):
+    cur.execute(billing_snapshots.SNAPSHOTS_SCHEMA)
+    cur.execute(billing_snapshots.SNAPSHOTS_MONTH_INDEX)
+
+
+def _create_client_search(cur):
+    cur.execute(search_index.SEARCH_SCHEMA)
+    # The rowid table belongs to migration 9, but the refresh below needs it.
+    # IF NOT EXISTS, so the end schema is unchanged. (Edited before any release
+    # shipped migration 5.)
+    cur.execute(search_index.SEARCH_ROWIDS_SCHEMA)
+    search_index.refresh_search_index(cur.connection)
+
+
+def _create_sync_watermarks(cur):
+    cur.execute(sync_watermarks.WATERMARKS_SCHEMA)
+
+
+def _create_time_entries(cur):
+    cur.execute(time_entries.TIME_ENTRIES_SCHEMA)
+    cur.execute(time_entries.TIME_ENTRIES_CREATED_INDEX)
+    cur.execute(time_entries.TIME_ENTRIES_TICKET_INDEX)
+    cur.execute(time_entries.SYNCED_TICKETS_SCHEMA)
+
+
+def _create_sync_checkpoints(cur):
+    cur.execute(sync_checkpoints.CHECKPOINTS_SCHEMA)
+
+
+def _key_client_search_by_rowid(cur):
+    cur.execute(search_index.SEARCH_ROWIDS_SCHEMA)
+    # Documents written before this version have no recorded rowid; rebuild them all once.
+    if cur.execute("SELECT COUNT(*) FROM client_search_rowids").fetchone()[0] == 0:
+        search_index.refresh_search_index(cur.connection)
+
+
+# (version, description, function taking a cursor)
+MIGRATIONS = [
+    (1, "Create client_billing_summary", _create_client_billing_summary),
+    (2, "Add indexes for dashboard and client detail lookups", _add_hot_path_indexes),
+    (3, "Create data_generation change counter", _create_data_generation),
+    (4, "Create billing_snapshots for month-close reporting", _create_billing_snapshots),
+    (5, "Create client_search full-text index", _create_client_search),
+    (6, "Create sync_watermarks for incremental syncs", _create_sync_watermarks),
+    (7, "Create time_entries and synced_tickets stores", _create_time_entries),
+    (8, "Create sync_checkpoints for resumable syncs", _create_sync_checkpoints),
+    (9, "Key client_search documents by a recorded rowid per account", _key_client_search_by_rowid),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(db_connection):
+    return db_connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(db_connection, verbose=False):
+    """
+    Applies every migration newer than the database's current version.
+    Must be called with no transaction open. Returns the list of versions applied.
+    """
+    if db_connection.in_transaction:
+        raise RuntimeError("apply_migrations() must not be called inside an open transaction.")
+
+    current = get_schema_version(db_connection)
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        if verbose:
+            print(f"Applying migration {version}: {description}...")
+        cur = db_connection.cursor()
+        try:
+            cur.execute("BEGIN")
+            migrate(cur)
+            # PRAGMA does not accept bound parameters; version is an int from MIGRATIONS.
+            cur.execute(f"PRAGMA user_version = {int(version)}")
+            db_connection.commit()
+        except sqlite3.Error:
+            db_connection.rollback()
+            raise
+        finally:
+            cur.close()
+        applied.append(version)
+
+    if applied:
+        # Pages cached against the old schema must not be served again.
+        data_version.bump_generation(db_connection)
+        db_connection.commit()
+    return applied
+
+
+if __name__ == "__main__":
+    print(" Database Schema Migrator")
+    print("==========================================")
+    if not os.path.exists(DB_FILE):
+        sys.exit(f"Error: Database file '{DB_FILE}' not found. Please run init_db.py script first.")
+
+    try:
+        if os.environ.get(cipher_key.RAW_KEY_ENV) or os.environ.get(cipher_key.PASSWORD_ENV):
+            db_key = cipher_key.key_from_environment(DB_FILE)
+        else:
+            db_key = cipher_key.derive_raw_key(DB_FILE, getpass.getpass("Enter the database master password: "))
+    except ValueError as e:
+        sys.exit(f"\n❌ {e}")
+
+    con = None
+    try:
+        con = sqlite3.connect(DB_FILE)
+        con.execute(cipher_key.key_pragma(db_key))
+        print(f"Current schema version: {get_schema_version(con)} (latest: {SCHEMA_VERSION})")
+        applied = apply_migrations(con, verbose=True)
+        if applied:
+            print(f"\n✅ Upgraded '{DB_FILE}' to schema version {SCHEMA_VERSION}.")
+        else:
+            print("\nDatabase is already up to date.")
+    except sqlite3.Error as e:
+        sys.exit(f"\n❌ Migration failed: {e}. Is the password correct?")
+    finally:
+        if con: con.close()
@@ -0,0 +1,396 @@
+"""
+A local stand-in for the Freshservice and Datto RMM APIs, serving made-up
+data at a configurable scale, so the sync scripts can be run, timed and
+regression-tested without touching the production tenant or RMM account.
+
+    python mock_api.py --companies 500 --users 20000 --tickets 10000 --port 8899
+    FRESHSERVICE_BASE_URL=http://127.0.0.1:8899/freshservice \\
+    DATTO_API_ENDPOINT=http://127.0.0.1:8899/datto python pull_freshservice.py
+
+Freshservice is served under /freshservice and Datto under /datto, covering
+the endpoints the scripts call. Every call is counted per endpoint. Latency
+and throttled (429) responses can be injected to see how the scripts cope
+with a slow or busy API. The same --seed always produces the same data.
+sync_benchmark.py starts this server itself.
+"""
+import argparse
+import gzip
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# --- Configuration ---
+DEFAULT_PORT = 8899
+MOCK_TOKEN = "mock-access-token"
+FRESHSERVICE_MAX_PER_PAGE = 100
+FRESHSERVICE_MAX_FILTER_PAGES = 10
+DATTO_PAGE_SIZE = 250
+# Share of departments that already have an account number; the rest are left for set_account_numbers.py.
+LINKED_FRACTION = 0.9
+# Records created before this are old enough for any incremental sync to skip.
+CREATED_AT = "2020-01-01T00:00:00Z"
+DEVICE_CATEGORIES = ["Desktop", "Laptop", "Laptop", "Server", "ESXi Host", "Printer"]
+OPERATING_SYSTEMS = ["Microsoft Windows 11 Pro", "Microsoft Windows 10 Pro", "Microsoft Windows Server 2022 Standard", "macOS Sonoma", None]
+GZIP_MIN_BYTES = 1024
+
+
+def _utc_iso(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _reporting_months(months):
+    """Returns [(first_day, next_first_day)] for the `months` full months before the current one, oldest first."""
+    periods = []
+    end = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(months):
+        start = (end - timedelta(days=1)).replace(day=1)
+        periods.append((start, end))
+        end = start
+    return periods[::-1]
+
+
+class MockData:
+    """The generated tenant: departments, requesters, tickets and Datto sites. Changed by the scripts' PUT calls."""
+
+    def __init__(self, seed=42, companies=200, users=5000, tickets=3000, entries_per_ticket=2, devices=20000, months=1):
+        rng = random.Random(seed)
+        self.seed = seed
+        self.entries_per_ticket = entries_per_ticket
+        self.lock = threading.Lock()
+
+        self.departments = []
+        for i in range(companies):
+            account_number = str(100000 + i) if rng.random() < LINKED_FRACTION else None
+            self.departments.append({
+                'id': 1000 + i,
+                'name': f"Mock Client {i:05d}",
+                'custom_fields': {'account_number': account_number, 'type_of_client': rng.choice(["Managed", "Co-Managed", "Break/Fix"]),
+                                  'plan_selected': rng.choice(["Gold", "Silver", "Bronze"])},
+                'created_at': CREATED_AT,
+                'updated_at': CREATED_AT,
+            })
+        department_ids = [d['id'] for d in self.departments]
+
+        self.requesters = [{
+            'id': 5000000 + i,
+            'first_name': f"User{i}",
+            'last_name': "Mock",
+            'primary_email': f"user{i}@mock.example.com",
+            'active': rng.random() < 0.92,
+            'department_ids': [rng.choice(department_ids)] if department_ids else [],
+            'created_at': CREATED_AT,
+            'updated_at': CREATED_AT,
+        } for i in range(users)]
+
+        # Tickets are updated, and their time logged, in the months the sync covers.
+        periods = _reporting_months(max(1, months))
+        self.tickets = []
+        for i in range(tickets):
+            start, end = rng.choice(periods)
+            updated = start + timedelta(seconds=rng.randrange(int((end - start).total_seconds())))
+            department_id = rng.choice(department_ids) if department_ids and rng.random() < 0.95 else None
+            self.tickets.append({'id': 1 + i, 'department_id': department_id, 'updated_at': _utc_iso(updated), 'period_start': start})
+        self.tickets_by_id = {t['id']: t for t in self.tickets}
+
+        # One Datto site per department, named the same so push_account_nums_to_datto.py can match them.
+        self.sites = []
+        device_counts = Counter(rng.randrange(companies) for _ in range(devices)) if companies else Counter()
+        for i, department in enumerate(self.departments):
+            account_number = department['custom_fields']['account_number']
+            self.sites.append({
+                'id': 2000 + i,
+                'uid': f"mock-site-{i:05d}",
+                'name': department['name'],
+                'variables': [{'id': 1, 'name': 'AccountNumber', 'value': account_number, 'masked': False}] if account_number else [],
+                'devices': device_counts[i],
+            })
+        self.sites_by_uid = {s['uid']: s for s in self.sites}
+
+    def time_entries(self, ticket):
+        """The ticket's time entries, generated from its ID so every call returns the same ones."""
+        rng = random.Random(f"{self.seed}-{ticket['id']}")
+        updated = datetime.fromisoformat(ticket['updated_at'].replace('Z', '+00:00'))
+        span = max(1, int((updated - ticket['period_start']).total_seconds()))
+        return [{
+            'id': ticket['id'] * 100 + j,
+            'created_at': _utc_iso(ticket['period_start'] + timedelta(seconds=rng.randrange(span))),
+            'time_spent': f"{rng.randrange(4):02d}:{rng.choice([0, 15, 30, 45]):02d}",
+        } for j in range(rng.randint(0, 2 * self.entries_per_ticket))]
+
+    def devices(self, site, offset, limit):
+        """One page of the site's devices, generated from their position in the site."""
+        devices = []
+        for j in range(offset, min(offset + limit, site['devices'])):
+            category = DEVICE_CATEGORIES[j % len(DEVICE_CATEGORIES)]
+            devices.append({
+                'uid': f"{site['uid']}-device-{j:05d}",
+                'hostname': f"{category[:3].upper()}-{site['id']}-{j:05d}",
+                'description': f"{category} {j}",
+                'deviceType': {'category': category},
+                'operatingSystem': OPERATING_SYSTEMS[j % len(OPERATING_SYSTEMS)],
+                'creationDate': 1577836800000 + j * 86400000,
+            })
+        return devices
+
+
+class MockApi:
+    """Routes requests to the generated data, injects faults and counts calls per endpoint."""
+
+    def __init__(self, data, latency_ms=0, jitter_ms=0, throttle_rate=0.0, retry_after=1, seed=42):
+        self.data = data
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.base_url = ''
+        self._rng = random.Random(seed)
+        self._counts_lock = threading.Lock()
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.routes = [
+            ('GET', r'/freshservice/api/v2/departments', 'freshservice departments', self.get_departments),
+            ('PUT', r'/freshservice/api/v2/departments/(\d+)', 'freshservice update department', self.put_department),
+            ('GET', r'/freshservice/api/v2/requesters', 'freshservice requesters', self.get_requesters),
+            ('GET', r'/freshservice/api/v2/tickets/filter', 'freshservice tickets/filter', self.get_tickets),
+            ('GET', r'/freshservice/api/v2/tickets/(\d+)/time_entries', 'freshservice time_entries', self.get_time_entries),
+            ('POST', r'/datto/auth/oauth/token', 'datto oauth/token', self.post_token),
+            ('GET', r'/datto/api/v2/account/sites', 'datto account/sites', self.get_sites),
+            ('GET', r'/datto/api/v2/site/([\w-]+)/variables', 'datto site variables', self.get_site_variables),
+            ('PUT', r'/datto/api/v2/site/([\w-]+)/variable', 'datto update site variable', self.put_site_variable),
+            ('GET', r'/datto/api/v2/site/([\w-]+)/devices', 'datto site devices', self.get_site_devices),
+        ]
+
+    def counts(self):
+        """Returns ({endpoint: calls}, {endpoint: throttled responses}) since the last reset."""
+        with self._counts_lock:
+            return dict(self.calls), dict(self.throttled)
+
+    def reset_counts(self):
+        with self._counts_lock:
+            self.calls.clear()
+            self.throttled.clear()
+
+    def handle(self, method, path, query, headers, body):
+        """Returns (status, extra headers, JSON-serializable body) for one request."""
+        for route_method, pattern, name, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method != method or not match:
+                continue
+            with self._counts_lock:
+                self.calls[name] += 1
+                throttle = self._rng.random() < self.throttle_rate
+                delay = max(0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+                if throttle:
+                    self.throttled[name] += 1
+            if delay:
+                time.sleep(delay)
+            if throttle:
+                return 429, {'Retry-After': str(self.retry_after)}, {'message': "You have exceeded the limit of requests per minute"}
+            if not self._authorized(name, headers):
+                return 401, {}, {'message': "Unauthorized"}
+            return handler(query, body, *match.groups())
+        return 404, {}, {'message': f"No mock for {method} {path}"}
+
+    def _authorized(self, name, headers):
+        authorization = headers.get('Authorization') or ''
+        if name.startswith('freshservice'):
+            return authorization.startswith('Basic ')
+        if name == 'datto oauth/token':
+            return True
+        return authorization == f"Bearer {MOCK_TOKEN}"
+
+    # --- Freshservice ---
+    def _freshservice_page(self, key, records, query):
+        since = query.get('updated_since')
+        if since:
+            records = [r for r in records if r['updated_at'] >= since]
+        page = int(query.get('page', 1))
+        per_page = min(int(query.get('per_page', 30)), FRESHSERVICE_MAX_PER_PAGE)
+        return 200, {}, {key: records[(page - 1) * per_page:page * per_page]}
+
+    def get_departments(self, query, body):
+        with self.data.lock:
+            return self._freshservice_page('departments', list(self.data.departments), query)
+
+    def put_department(self, query, body, department_id):
+        with self.data.lock:
+            department = next((d for d in self.data.departments if d['id'] == int(department_id)), None)
+            if department is None:
+                return 404, {}, {'message': "Department not found"}
+            department['custom_fields'].update((body or {}).get('custom_fields') or {})
+            department['updated_at'] = _utc_iso(datetime.now(timezone.utc))
+            return 200, {}, {'department': department}
+
+    def get_requesters(self, query, body):
+        return self._freshservice_page('requesters', self.data.requesters, query)
+
+    def get_tickets(self, query, body):
+        # The filter's bounds are inclusive dates, as in the real API.
+        bounds = re.findall(r"updated_at:([<>])'(\d{4}-\d{2}-\d{2})'", query.get('query', ''))
+        low = next((day for op, day in bounds if op == '>'), '0000-00-00')
+        high = next((day for op, day in bounds if op == '<'), '9999-99-99')
+        matching = [
+            {'id': t['id'], 'department_id': t['department_id'], 'updated_at': t['updated_at']}
+            for t in self.data.tickets if low <= t['updated_at'][:10] <= high
+        ]
+        page = int(query.get('page', 1))
+        if page > FRESHSERVICE_MAX_FILTER_PAGES:
+            return 400, {}, {'message': f"page must be at most {FRESHSERVICE_MAX_FILTER_PAGES}"}
+        per_page = min(int(query.get('per_page', 30)), FRESHSERVICE_MAX_PER_PAGE)
+        return 200, {}, {'tickets': matching[(page - 1) * per_page:page * per_page], 'total': len(matching)}
+
+    def get_time_entries(self, query, body, ticket_id):
+        ticket = self.data.tickets_by_id.get(int(ticket_id))
+        if ticket is None:
+            return 404, {}, {'message': "Ticket not found"}
+        return 200, {}, {'time_entries': self.data.time_entries(ticket)}
+
+    # --- Datto RMM ---
+    def post_token(self, query, body):
+        return 200, {}, {'access_token': MOCK_TOKEN, 'token_type': 'bearer', 'expires_in': 360000}
+
+    def _datto_page(self, key, total, fetch, query, path):
+        page = int(query.get('page', 0))
+        offset = page * DATTO_PAGE_SIZE
+        next_url = f"{self.base_url}{path}?page={page + 1}&max={DATTO_PAGE_SIZE}" if offset + DATTO_PAGE_SIZE < total else None
+        return 200, {}, {'pageDetails': {'count': total, 'nextPageUrl': next_url}, key: fetch(offset, DATTO_PAGE_SIZE)}
+
+    def get_sites(self, query, body):
+        sites = [{'id': s['id'], 'uid': s['uid'], 'name': s['name']} for s in self.data.sites]
+        return self._datto_page('sites', len(sites), lambda offset, limit: sites[offset:offset + limit], query, '/datto/api/v2/account/sites')
+
+    def get_site_variables(self, query, body, site_uid):
+        site = self.data.sites_by_uid.get(site_uid)
+        if site is None:
+            return 404, {}, {'message': "Site not found"}
+        with self.data.lock:
+            return 200, {}, {'variables': list(site['variables'])}
+
+    def put_site_variable(self, query, body, site_uid):
+        site = self.data.sites_by_uid.get(site_uid)
+        if site is None:
+            return 404, {}, {'message': "Site not found"}
+        with self.data.lock:
+            site['variables'].append({'id': len(site['variables']) + 1, 'name': body.get('name'), 'value': body.get('value'), 'masked': False})
+        return 200, {}, {}
+
+    def get_site_devices(self, query, body, site_uid):
+        site = self.data.sites_by_uid.get(site_uid)
+        if site is None:
+            return 404, {}, {'message': "Site not found"}
+        return self._datto_page('devices', site['devices'], lambda offset, limit: self.data.devices(site, offset, limit),
+                                query, f"/datto/api/v2/site/{site_uid}/devices")
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1, so the scripts' keep-alive connections are reused as they would be against the real APIs.
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms to every response.
+        disable_nagle_algorithm = True
+
+        def _serve(self, method):
+            url = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            length = int(self.headers.get('Content-Length') or 0)
+            raw_body = self.rfile.read(length) if length else b''
+            body = None
+            if raw_body and 'json' in (self.headers.get('Content-Type') or ''):
+                body = json.loads(raw_body)
+            status, extra_headers, payload = api.handle(method, url.path, query, self.headers, body)
+
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            if len(data) >= GZIP_MIN_BYTES and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+                data = gzip.compress(data, compresslevel=1)
+                self.send_header('Content-Encoding', 'gzip')
+            for name, value in extra_headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._serve('GET')
+
+        def do_POST(self):
+            self._serve('POST')
+
+        def do_PUT(self):
+            self._serve('PUT')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(api, host='127.0.0.1', port=0):
+    """Serves `api` on a background thread. Returns the server; its base URL is in api.base_url."""
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.daemon_threads = True
+    api.base_url = f"http://{host}:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_data_arguments(parser):
+    """Adds the dataset and fault-injection options, shared with sync_benchmark.py."""
+    parser.add_argument('--companies', type=int, default=200, help="Freshservice departments, one Datto site each (default: 200).")
+    parser.add_argument('--users', type=int, default=5000, help="Freshservice requesters (default: 5000).")
+    parser.add_argument('--tickets', type=int, default=3000, help="Tickets updated in the synced months (default: 3000).")
+    parser.add_argument('--entries-per-ticket', type=int, default=2, help="Average time entries per ticket (default: 2).")
+    parser.add_argument('--devices', type=int, default=20000, help="Datto devices across all sites (default: 20000).")
+    parser.add_argument('--months', type=int, default=1, help="Months before the current one that tickets are spread over (default: 1).")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-ms', type=float, default=0, help="Delay added to every response (default: 0).")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Random +/- variation of that delay (default: 0).")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of requests answered with 429 (default: 0).")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with each 429 (default: 1).")
+
+
+def build_api(args):
+    data = MockData(args.seed, args.companies, args.users, args.tickets, args.entries_per_ticket, args.devices, args.months)
+    return MockApi(data, args.latency_ms, args.jitter_ms, args.throttle_rate, args.retry_after, args.seed)
+
+
+def print_counts(api):
+    calls, throttled = api.counts()
+    for name in sorted(calls):
+        print(f"  {name:<32} {calls[name]:>7} calls" + (f", {throttled[name]} throttled" if throttled.get(name) else ""))
+    print(f"  {'total':<32} {sum(calls.values()):>7} calls")
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve mock Freshservice and Datto RMM APIs for local sync runs.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"(default: {DEFAULT_PORT})")
+    add_data_arguments(parser)
+    args = parser.parse_args()
+
+    print(" Mock Freshservice / Datto RMM API")
+    print("==========================================")
+    api = build_api(args)
+    server = start_server(api, args.host, args.port)
+    print(f"Serving {len(api.data.departments)} departments, {len(api.data.requesters)} requesters, "
+          f"{len(api.data.tickets)} tickets and {sum(s['devices'] for s in api.data.sites)} devices.\n")
+    print(f"  FRESHSERVICE_BASE_URL={api.base_url}/freshservice")
+    print(f"  DATTO_API_ENDPOINT={api.base_url}/datto")
+    print("\nPress Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\nAPI calls served:")
+        print_counts(api)
+        server.shutdown()
+        sys.exit(0)
@@ -0,0 +1,136 @@
+"""
+Keyset (seek) pagination for the per-client tables.
+
+Instead of OFFSET, each page continues from the (sort value, rowid) of the
+last row on the previous page, so every page is an index seek no matter how
+deep the client reads. The position is handed to the browser as an opaque
+cursor string.
+"""
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor string cannot be decoded."""
+
+
+def encode_cursor(sort_value, rowid):
+    raw = json.dumps([sort_value, rowid], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, rowid = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+    # Anything else (a JSON list or object) cannot be bound as an SQL parameter.
+    if not isinstance(rowid, int) or not (sort_value is None or isinstance(sort_value, (str, int, float))):
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+    return sort_value, rowid
+
+
+class KeysetSection:
+    """
+    One paginated table filtered by company_account_number.
+
+    `sorts` maps the public sort key to the SQL expression it orders by.
+    Nullable columns should be wrapped in COALESCE so the row-value
+    comparison never meets a NULL.
+    """
+    def __init__(self, table, columns, sorts, default_sort, default_order='asc'):
+        self.table = table
+        self.columns = columns
+        self.sorts = sorts
+        self.default_sort = default_sort
+        self.default_order = default_order
+
+    def fetch_page(self, db, account_number, sort=None, order=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Returns (rows, next_cursor). rows are dicts of `columns`; next_cursor is
+        None on the last page. Raises ValueError for an unknown sort or order.
+        """
+        sort = sort or self.default_sort
+        order = (order or self.default_order).lower()
+        if sort not in self.sorts:
+            raise ValueError(f"Unknown sort key '{sort}'. Expected one of: {', '.join(self.sorts)}.")
+        if order not in ('asc', 'desc'):
+            raise ValueError("Order must be 'asc' or 'desc'.")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        sort_expr = self.sorts[sort]
+        comparison = '>' if order == 'asc' else '<'
+        where = "company_account_number = ?"
+        args = [account_number]
+        if cursor:
+            where += f" AND ({sort_expr}, rowid) {comparison} (?, ?)"
+            args.extend(decode_cursor(cursor))
+
+        query = f"""
+            SELECT {', '.join(self.columns)}, {sort_expr} AS _sort_value, rowid AS _rowid
+            FROM {self.table}
+            WHERE {where}
+            ORDER BY {sort_expr} {order.upper()}, rowid {order.upper()}
+            LIMIT ?
+        """
+        args.append(limit + 1)
+        cur = db.execute(query, args)
+        rows = cur.fetchall()
+        cur.close()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['_sort_value'], rows[-1]['_rowid'])
+        return [{column: row[column] for column in self.columns} for row in rows], next_cursor
+
+    def export_cursor(self, db, account_number):
+        """Returns an executed cursor over all of the client's rows in the default order, for streaming."""
+        order = self.default_order.upper()
+        return db.execute(f"""
+            SELECT {', '.join(self.columns)}
+            FROM {self.table}
+            WHERE company_account_number = ?
+            ORDER BY {self.sorts[self.default_sort]} {order}, rowid {order}
+        """, (account_number,))
+
+    def count(self, db, account_number):
+        cur = db.execute(f"SELECT COUNT(*) FROM {self.table} WHERE company_account_number = ?", (account_number,))
+        total = cur.fetchone()[0]
+        cur.close()
+        return total
+
+
+# The tables on the client detail page, by the section name used in its URLs.
+CLIENT_SECTIONS = {
+    'assets': KeysetSection(
+        'assets',
+        ['hostname', 'friendly_name', 'device_type', 'operating_system', 'status'],
+        {
+            'hostname': 'hostname',
+            'device_type': "COALESCE(device_type, '')",
+            'operating_system': "COALESCE(operating_system, '')",
+        },
+        default_sort='hostname'
+    ),
+    'users': KeysetSection(
+        'users',
+        ['full_name', 'email', 'status'],
+        {
+            'full_name': 'full_name',
+            'email': "COALESCE(email, '')",
+            'status': 'status',
+        },
+        default_sort='full_name'
+    ),
+    'hours': KeysetSection(
+        'ticket_work_hours',
+        ['month', 'hours'],
+        {'month': 'month', 'hours': 'hours'},
+        default_sort='month', default_order='desc'
+    ),
+}
@@ -0,0 +1,22 @@
+"""
+Checks on other processes, for the modules that keep per-process state on
+disk (background jobs, metrics snapshots) and must tell whether the process
+that wrote it is still running.
+"""
+import os
+
+
+def process_alive(pid):
+    """Returns whether a process with this pid is running. Always True on Windows, where it cannot be checked safely."""
+    if pid is None:
+        return False
+    if os.name != 'posix':
+        # os.kill(pid, 0) terminates the process on Windows; assume it is still running.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -1,11 +1,21 @@
+import argparse
 import requests
-import base64
-import json
 import os
 import sys
-import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime, timedelta, timezone
-from collections import defaultdict
+
+import billing_summary
+import cipher_key
+import data_version
+import http_client
+import migrations
+import rate_limiter
+import search_index
+import sync_checkpoints
+import sync_watermarks
+import time_entries
 
 try:
     from sqlcipher3 import dbapi2 as sqlite3
@@ -18,22 +28,26 @@ DB_FILE = "brainhair.db"
 FRESHSERVICE_DOMAIN = "integotecllc.freshservice.com"
 ACCOUNT_NUMBER_FIELD = "account_number"
 COMPANIES_PER_PAGE = 100
-MAX_RETRIES = 3 # Max number of retries for a single API call
+TIME_ENTRY_WORKERS = 8 # Concurrent time-entry requests, all sharing the Freshservice rate limit
+TICKETS_PER_PAGE = 100
+FILTER_MAX_PAGES = 10 # The ticket filter endpoint returns nothing past this page
+TICKET_WINDOW_DAYS = 7 # Ticket enumeration starts with windows this long, halving any that hit the cap
+TICKET_WINDOW_WORKERS = 4 # Date windows enumerated at once
+INSERT_BATCH_SIZE = 500 # Users and tickets are processed and committed in batches of this size
+CHECKPOINT_NAME = "freshservice" # Row in sync_checkpoints holding the progress of an unfinished run
 
 # --- Utility Functions ---
-def get_db_connection(db_path, password):
-    """Establishes a connection to the encrypted database."""
-    if not password:
-        raise ValueError("A database password is required.")
+def get_db_connection(db_path, db_key):
+    """Establishes a connection to the encrypted database, unlocked with the raw key (no KDF)."""
     con = sqlite3.connect(db_path)
     cur = con.cursor()
-    cur.execute(f"PRAGMA key = '{password}';")
+    cur.execute(cipher_key.key_pragma(db_key))
     return con
 
-def get_freshservice_api_key(db_password):
+def get_freshservice_api_key(db_key):
     """Reads the Freshservice API key from the encrypted database."""
     try:
-        con = get_db_connection(DB_FILE, db_password)
+        con = get_db_connection(DB_FILE, db_key)
         cur = con.cursor()
         cur.execute("SELECT api_key FROM api_keys WHERE service = 'freshservice'")
         creds = cur.fetchone()
@@ -42,18 +56,46 @@ def get_freshservice_api_key(db_password):
             raise ValueError("Freshservice credentials not found in the database.")
         return creds[0]
     except sqlite3.Error as e:
-        sys.exit(f"Database error while fetching credentials: {e}. Is the password correct?")
+        sys.exit(f"Database error while fetching credentials: {e}. Is the key correct?")
+
+def load_sync_state(db_connection, full_resync):
+    """
+    Returns (departments_since, requesters_since, company_map). The timestamps
+    are None for a full sync; company_map maps every known Freshservice
+    department ID to (account_number, name).
+    """
+    if full_resync:
+        departments_since = requesters_since = None
+    else:
+        departments_since = sync_watermarks.updated_since(db_connection, 'departments')
+        requesters_since = sync_watermarks.updated_since(db_connection, 'requesters')
+    company_map = {
+        row[0]: (row[1], row[2])
+        for row in db_connection.execute("SELECT freshservice_id, account_number, name FROM companies WHERE freshservice_id IS NOT NULL")
+    }
+    return departments_since, requesters_since, company_map
+
+def _updated_since(records, since):
+    """Drops records older than `since`, in case the endpoint ignored the updated_since filter."""
+    if since is None:
+        return records
+    return [r for r in records if (r.get('updated_at') or since) >= since]
 
 # --- API Functions (Unchanged from your version) ---
-def get_all_companies(base_url, headers):
-    """Fetches all companies (departments) from the Freshservice API."""
-    print("Fetching companies from Freshservice...")
+def get_all_companies(base_url, headers, updated_since=None):
+    """Fetches the companies (departments) from the Freshservice API, only those updated since `updated_since` if given."""
+    if updated_since:
+        print(f"Fetching companies updated since {updated_since} from Freshservice...")
+    else:
+        print("Fetching all companies from Freshservice...")
     all_companies, page = [], 1
     endpoint = f"{base_url}/api/v2/departments"
     while True:
         try:
             params = {'page': page, 'per_page': COMPANIES_PER_PAGE}
-            response = requests.get(endpoint, headers=headers, params=params, timeout=30)
+            if updated_since:
+                params['updated_since'] = updated_since
+            response = http_client.get('freshservice', endpoint, headers=headers, params=params)
             response.raise_for_status()
             data = response.json()
             companies_on_page = data.get('departments', [])
@@ -63,128 +105,209 @@ def get_all_companies(base_url, headers):
         except requests.exceptions.RequestException as e:
             print(f"Error fetching Freshservice companies: {e}", file=sys.stderr)
             return None
-    print(f" Found {len(all_companies)} companies in Freshservice.")
+    all_companies = _updated_since(all_companies, updated_since)
+    print(f" Found {len(all_companies)} {'changed ' if updated_since else ''}companies in Freshservice.")
     return all_companies
 
-def get_all_users(base_url, headers):
-    """Fetches ALL users (requesters) from the Freshservice API."""
-    print("\nFetching all users from Freshservice (this may take a moment)...")
-    all_users, page = [], 1
+def iter_user_pages(base_url, headers, updated_since=None, first_page=1):
+    """
+    Yields (page, users) for each page of users (requesters) from the
+    Freshservice API, starting at `first_page`, only those updated since
+    `updated_since` if given. Raises requests' RequestException if a page
+    cannot be fetched.
+    """
+    if updated_since:
+        print(f"\nFetching users updated since {updated_since} from Freshservice...")
+    else:
+        print("\nFetching all users from Freshservice (this may take a moment)...")
+    page = first_page
     endpoint = f"{base_url}/api/v2/requesters"
     while True:
         params = {'page': page, 'per_page': 100}
+        if updated_since:
+            params['updated_since'] = updated_since
         try:
             print(f"-> Fetching user page {page}...")
-            response = requests.get(endpoint, headers=headers, params=params, timeout=30)
-            if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 5))
-                print(f"   -> Rate limit exceeded, waiting {retry_after}s...")
-                time.sleep(retry_after)
-                continue
+            response = http_client.get('freshservice', endpoint, headers=headers, params=params)
             response.raise_for_status()
-            data = response.json()
-            users_on_page = data.get('requesters', [])
-            if not users_on_page: break
-            all_users.extend(users_on_page)
-            page += 1
+            users_on_page = response.json().get('requesters', [])
         except requests.exceptions.RequestException as e:
             print(f"   -> Error fetching users on page {page}: {e}", file=sys.stderr)
-            return None
-    print(f" Found {len(all_users)} total users in Freshservice.")
-    return all_users
+            raise
+        if not users_on_page: break
+        yield page, _updated_since(users_on_page, updated_since)
+        page += 1
 
-def get_all_tickets_for_last_month(base_url, headers, start_date_str, end_date_str):
-    """Fetches ALL tickets updated in the last month."""
-    all_tickets = []
-    endpoint = f"{base_url}/api/v2/tickets/filter"
-    query = f"updated_at:>'{start_date_str}' AND updated_at:<'{end_date_str}'"
-    page = 1
+def user_rows(users, company_map):
+    """Projects each user onto a users table row, skipping users not in a company with an account number."""
+    for user in users:
+        for dept_id in (user.get('department_ids') or []):
+            account_num = company_map.get(dept_id, (None,))[0]
+            if account_num:
+                yield (
+                    str(account_num), user.get('id'),
+                    f"{user.get('first_name', '')} {user.get('last_name', '')}".strip(),
+                    user.get('primary_email'), 'Active' if user.get('active', False) else 'Inactive',
+                    user.get('created_at', datetime.now(timezone.utc).isoformat())
+                )
+                break
 
-    print(f"Fetching all tickets updated between {start_date_str} and {end_date_str}...")
+def get_tickets_in_window(base_url, headers, start_day, end_day):
+    """
+    Fetches the tickets updated from start_day to end_day (inclusive dates),
+    keeping only their id, department_id and updated_at.
+    Returns (tickets, complete); complete is False when the window holds more
+    than the filter endpoint will return. Such a window is not paged through
+    if it spans several days, since the caller splits it, but a single day
+    cannot be split, so its first FILTER_MAX_PAGES pages are still returned.
+    Returns (None, False) on an API error. Safe to call from worker threads.
+    """
+    window_tickets = []
+    endpoint = f"{base_url}/api/v2/tickets/filter"
+    query = f"updated_at:>'{start_day:%Y-%m-%d}' AND updated_at:<'{end_day:%Y-%m-%d}'"
 
-    while True:
-        params = {'query': f'"{query}"', 'page': page, 'per_page': 100}
+    for page in range(1, FILTER_MAX_PAGES + 1):
+        params = {'query': f'"{query}"', 'page': page, 'per_page': TICKETS_PER_PAGE}
         try:
-            response = requests.get(endpoint, headers=headers, params=params, timeout=90)
-            if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 10))
-                print(f"   -> Rate limit hit, waiting {retry_after}s...")
-                time.sleep(retry_after)
-                continue
-
+            response = http_client.get('freshservice', endpoint, headers=headers, params=params, timeout=(10, 90))
             response.raise_for_status()
             data = response.json()
-
-            tickets_on_page = data.get('tickets', [])
-            if not tickets_on_page:
-                break
-
-            all_tickets.extend(tickets_on_page)
-            print(f"  -> Fetched page {page}, total tickets so far: {len(all_tickets)}")
-            page += 1
-            time.sleep(0.5)
-
         except requests.exceptions.RequestException as e:
             print(f"Fatal error fetching tickets: {e}", file=sys.stderr)
             if hasattr(e, 'response') and e.response is not None:
                  print(f"   -> Response: {e.response.text}", file=sys.stderr)
-            return None
-
-    return all_tickets
-
-def get_time_entries_for_ticket(base_url, headers, ticket_id, start_date, end_date):
-    """Fetches time entries for a single ticket, with retries for rate limiting."""
-    total_hours = 0
-    endpoint = f"{base_url}/api/v2/tickets/{ticket_id}/time_entries"
-    retries = 0
-
-    while retries < MAX_RETRIES:
+            return None, False
+
+        # The first page reports the window's total, so an oversized window is split before paging through it.
+        if page == 1 and end_day > start_day and data.get('total', 0) > FILTER_MAX_PAGES * TICKETS_PER_PAGE:
+            return [], False
+        tickets_on_page = data.get('tickets', [])
+        window_tickets.extend(
+            {'id': t['id'], 'department_id': t.get('department_id'), 'updated_at': t.get('updated_at')}
+            for t in tickets_on_page
+        )
+        if len(tickets_on_page) < TICKETS_PER_PAGE:
+            return window_tickets, True
+    return window_tickets, False
+
+def iter_tickets(base_url, headers, first_day, last_day):
+    """
+    Yields every ticket updated from first_day to last_day as its window
+    arrives. The period is cut into TICKET_WINDOW_DAYS windows that are
+    enumerated concurrently; a window with more tickets than the filter
+    endpoint returns is split in half and both halves are queued again.
+    No more than twice TICKET_WINDOW_WORKERS windows are in flight, and the
+    next one is only submitted once a result is taken, so fetched windows do
+    not pile up while the caller works through their tickets.
+    Raises requests' RequestException if any window fails.
+    """
+    print(f"Fetching all tickets updated between {first_day:%Y-%m-%d} and {last_day:%Y-%m-%d}...")
+    windows, start = deque(), first_day
+    while start <= last_day:
+        end = min(start + timedelta(days=TICKET_WINDOW_DAYS - 1), last_day)
+        windows.append((start, end))
+        start = end + timedelta(days=1)
+
+    # A ticket updated during the run can show up in two windows; only IDs are kept to skip the second copy.
+    seen = set()
+    with ThreadPoolExecutor(max_workers=TICKET_WINDOW_WORKERS) as executor:
+        pending = {}
+
+        def submit_windows():
+            while windows and len(pending) < 2 * TICKET_WINDOW_WORKERS:
+                s, e = windows.popleft()
+                pending[executor.submit(get_tickets_in_window, base_url, headers, s, e)] = (s, e)
+
+        submit_windows()
         try:
-            response = requests.get(endpoint, headers=headers, timeout=60)
-
-            if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 10))
-                print(f"  [!] Rate limit hit on ticket {ticket_id}. Waiting {retry_after} seconds to retry...")
-                time.sleep(retry_after)
-                retries += 1
-                continue
-
-            if response.status_code == 404:
-                return 0
-
-            response.raise_for_status()
-            data = response.json()
-            time_entries = data.get('time_entries', [])
-
-            for entry in time_entries:
-                entry_created_at = datetime.fromisoformat(entry['created_at'].replace('Z', '+00:00'))
-                if start_date <= entry_created_at <= end_date:
-                    time_str = entry.get('time_spent', '00:00')
-                    h, m = map(int, time_str.split(':'))
-                    total_hours += h + (m / 60.0)
-
-            return total_hours
-
-        except requests.exceptions.RequestException as e:
-            print(f"Warning: Could not fetch time for ticket {ticket_id}: {e}", file=sys.stderr)
-            retries += 1
-            time.sleep(5)
-
-    print(f"Warning: Failed to fetch time for ticket {ticket_id} after {MAX_RETRIES} retries.", file=sys.stderr)
-    return 0
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end = pending.pop(future)
+                    window_tickets, complete = future.result()
+                    if window_tickets is None:
+                        raise requests.exceptions.RequestException(f"Could not fetch the tickets updated between {start} and {end}.")
+                    if not complete and end > start:
+                        middle = start + (end - start) // 2
+                        print(f"  -> Too many tickets between {start} and {end}; splitting at {middle}.")
+                        # Queued first, so a split period is finished before later windows start.
+                        windows.extendleft([(middle + timedelta(days=1), end), (start, middle)])
+                        submit_windows()
+                        continue
+                    if not complete:
+                        print(f"Warning: More tickets were updated on {start} than the filter endpoint returns; only the first {len(window_tickets)} are synced.", file=sys.stderr)
+                    new_tickets = [t for t in window_tickets if t['id'] not in seen]
+                    seen.update(t['id'] for t in new_tickets)
+                    print(f"  -> Fetched {len(window_tickets)} tickets for {start} to {end}, total tickets so far: {len(seen)}")
+                    submit_windows()
+                    yield from new_tickets
+        finally:
+            for future in pending:
+                future.cancel()
+
+def get_time_entries_for_ticket(base_url, headers, ticket_id):
+    """Fetches all time entries of a single ticket, or None if they could not be fetched. Safe to call from worker threads."""
+    endpoint = f"{base_url}/api/v2/tickets/{ticket_id}/time_entries"
+    try:
+        response = http_client.get('freshservice', endpoint, headers=headers)
+        if response.status_code == 404:
+            return []
+        response.raise_for_status()
+        return response.json().get('time_entries', [])
+    except requests.exceptions.RequestException as e:
+        print(f"Warning: Could not fetch time for ticket {ticket_id}: {e}", file=sys.stderr)
+        return None
+
+def fetch_time_entries(base_url, headers, tickets):
+    """
+    Fetches the time entries of the given (ticket, account_number) pairs on a
+    bounded pool of worker threads sharing one rate limit. Returns
+    [(ticket, account_number, entries)] in completion order; tickets that
+    failed are left out, so they are fetched again on the next run.
+    """
+    fetched = []
+
+    with ThreadPoolExecutor(max_workers=TIME_ENTRY_WORKERS) as executor:
+        futures = {
+            executor.submit(get_time_entries_for_ticket, base_url, headers, ticket['id']): (ticket, account_number)
+            for ticket, account_number in tickets
+        }
+        for future in as_completed(futures):
+            ticket, account_number = futures[future]
+            entries = future.result()
+            if entries is not None:
+                fetched.append((ticket, account_number, entries))
+                hours_for_ticket = sum(time_entries.parse_hours(e.get('time_spent')) for e in entries)
+                if hours_for_ticket > 0:
+                    print(f"  - Found {len(entries)} time entries ({hours_for_ticket:.2f} hours) on ticket #{ticket['id']}")
+    return fetched
 
 
 # --- Database Functions ---
 def populate_companies_database(db_connection, companies_data):
-    """Populates the companies table."""
+    """
+    Populates the companies table. Returns the set of account numbers written
+    or unlinked.
+    """
     cur = db_connection.cursor()
+    # A department whose account number was cleared or changed loses the link to
+    # its old row, or load_sync_state would map its users and tickets there again.
+    links = [(c.get('id'), str((c.get('custom_fields') or {}).get(ACCOUNT_NUMBER_FIELD) or '')) for c in companies_data]
+    unlinked = set()
+    for department_id, account_number in links:
+        unlinked |= {row[0] for row in cur.execute(
+            "SELECT account_number FROM companies WHERE freshservice_id = ? AND account_number != ?", (department_id, account_number))}
+    if unlinked:
+        cur.executemany("UPDATE companies SET freshservice_id = NULL WHERE freshservice_id = ? AND account_number != ?", links)
+        print(f"-> Unlinked {len(unlinked)} companies whose Freshservice account number was cleared or changed.")
+
     companies_to_insert = [
         (str(c.get('custom_fields', {}).get(ACCOUNT_NUMBER_FIELD)), c.get('name'), c.get('id'), c.get('custom_fields', {}).get('type_of_client', 'Unknown'), c.get('custom_fields', {}).get('plan_selected', 'Unknown'))
         for c in companies_data if (c.get('custom_fields') or {}).get(ACCOUNT_NUMBER_FIELD)
     ]
     if not companies_to_insert:
         print("No companies with account numbers to process.")
-        return
+        return unlinked
     print(f"\nAttempting to insert/update {len(companies_to_insert)} companies...")
     cur.executemany("""
         INSERT INTO companies (account_number, name, freshservice_id, contract_type, billing_plan)
@@ -192,138 +315,227 @@ def populate_companies_database(db_connection, companies_data):
         name=excluded.name, freshservice_id=excluded.freshservice_id, contract_type=excluded.contract_type, billing_plan=excluded.billing_plan;
     """, companies_to_insert)
     print(f"-> Successfully inserted/updated {cur.rowcount} companies.")
+    return unlinked | {c[0] for c in companies_to_insert}
 
 def populate_users_database(db_connection, users_to_insert):
-    """Populates the users table."""
-    if not users_to_insert:
-        print("No users to insert into the database.")
-        return
+    """Upserts one batch of users rows. Returns the set of account numbers whose users changed."""
+    touched_accounts = {u[0] for u in users_to_insert}
+    touched_accounts |= billing_summary.current_accounts_for(db_connection, 'users', 'freshservice_id', [u[1] for u in users_to_insert])
     cur = db_connection.cursor()
-    print(f"\nAttempting to insert/update {len(users_to_insert)} users...")
     cur.executemany("""
         INSERT INTO users (company_account_number, freshservice_id, full_name, email, status, date_added)
         VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(freshservice_id) DO UPDATE SET
         company_account_number=excluded.company_account_number, full_name=excluded.full_name, email=excluded.email, status=excluded.status;
     """, users_to_insert)
-    print(f"-> Successfully inserted/updated {cur.rowcount} users.")
-
-def update_ticket_hours(db_connection, hours_data):
-    """Updates the ticket_work_hours table with the hours for the last month."""
-    if not hours_data:
-        print("\nNo billable time entries found to update in the database for the specified period.")
-        return
+    return touched_accounts
+
+def commit_batch(db_connection, touched_accounts):
+    """
+    Refreshes the touched clients' summary and search rows and commits, so
+    each batch is complete on its own and a failure later keeps it.
+    """
+    billing_summary.refresh_client_billing_summary(db_connection, touched_accounts)
+    search_index.refresh_search_index(db_connection, touched_accounts)
+    data_version.bump_generation(db_connection)
+    db_connection.commit()
+
+def store_time_entries(db_connection, fetched):
+    """Stores the fetched tickets' time entries. Returns the accounts their entries were previously stored under."""
+    previous_accounts = set()
+    for ticket, account_number, entries in fetched:
+        previous_accounts |= time_entries.store_ticket_entries(db_connection, ticket['id'], ticket.get('updated_at'), account_number, entries)
+    return previous_accounts
+
+def update_ticket_hours(db_connection, month_str, start_date, end_date, previous_accounts=()):
+    """
+    Recomputes the month's ticket_work_hours from the stored time entries and
+    returns {account_number: hours}. Accounts that held entries of a re-fetched
+    ticket but no longer have any hours in the month lose their row.
+    """
+    hours_by_account = time_entries.hours_by_account(db_connection, start_date, end_date)
     cur = db_connection.cursor()
-    print(f"\nAttempting to insert/update {len(hours_data)} company time entries...")
+    emptied = [(account, month_str) for account in previous_accounts if account not in hours_by_account]
+    cur.executemany("DELETE FROM ticket_work_hours WHERE company_account_number = ? AND month = ?", emptied)
+    if not hours_by_account:
+        print("\nNo billable time entries found to update in the database for the specified period.")
+        return hours_by_account
+    print(f"\nAttempting to insert/update {len(hours_by_account)} company time entries...")
     cur.executemany("""
         INSERT INTO ticket_work_hours (company_account_number, month, hours)
         VALUES (?, ?, ?) ON CONFLICT(company_account_number, month) DO UPDATE SET hours=excluded.hours;
-    """, hours_data)
+    """, [(account, month_str, hours) for account, hours in hours_by_account.items()])
     print(f"-> Successfully inserted/updated {cur.rowcount} time entries.")
+    return hours_by_account
+
+def parse_month(value):
+    try:
+        return datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a month in YYYY-MM format.")
+
+def next_month(month_start):
+    return (month_start + timedelta(days=32)).replace(day=1)
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync companies, users and last month's ticket hours from Freshservice.")
+    parser.add_argument('--full-resync', action='store_true',
+                        help="Re-download every company and user instead of only those changed since the last sync.")
+    parser.add_argument('--backfill', nargs=2, type=parse_month, metavar=('FIRST_MONTH', 'LAST_MONTH'),
+                        help="Sync ticket hours for every month from FIRST_MONTH to LAST_MONTH (YYYY-MM) instead of only last month. "
+                             "Tickets are found by their last update, so a ticket updated after LAST_MONTH is missed; end at the current month to include them.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue the last run that did not finish, skipping the stages it completed.")
+    args = parser.parse_args()
+    if args.backfill and args.backfill[0] > args.backfill[1]:
+        parser.error("--backfill: FIRST_MONTH must not be after LAST_MONTH.")
+
     print(" Freshservice Company, User, and Time Syncer")
     print("================================================")
 
     if not os.path.exists(DB_FILE):
         sys.exit(f"Error: Database file '{DB_FILE}' not found. Run init_db.py first.")
 
-    DB_MASTER_PASSWORD = os.environ.get('DB_MASTER_PASSWORD')
-    if not DB_MASTER_PASSWORD:
-        sys.exit("Error: The DB_MASTER_PASSWORD environment variable must be set.")
-
-    API_KEY = get_freshservice_api_key(DB_MASTER_PASSWORD)
-    auth_str = f"{API_KEY}:X"
-    encoded_auth = base64.b64encode(auth_str.encode()).decode()
-    headers = {"Content-Type": "application/json", "Authorization": f"Basic {encoded_auth}"}
-    base_url = f"https://{FRESHSERVICE_DOMAIN}"
-
-    companies = get_all_companies(base_url, headers)
-    users = get_all_users(base_url, headers)
-
-    if not companies or users is None:
-        sys.exit("Could not fetch company or user data from Freshservice. Aborting.")
-
-    today = datetime.now(timezone.utc)
-    first_day_of_current_month = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    last_day_of_last_month = first_day_of_current_month - timedelta(days=1)
-    first_day_of_last_month = last_day_of_last_month.replace(day=1)
-    end_of_last_month = last_day_of_last_month.replace(hour=23, minute=59, second=59)
-    month_str = first_day_of_last_month.strftime('%Y-%m')
-
-    all_tickets_last_month = get_all_tickets_for_last_month(
-        base_url, headers,
-        first_day_of_last_month.strftime('%Y-%m-%d'),
-        end_of_last_month.strftime('%Y-%m-%d')
-    )
-
-    if all_tickets_last_month is None:
-        sys.exit("Aborting due to failure in fetching tickets.")
-
-    print(f"Grouping {len(all_tickets_last_month)} tickets by company...")
-    tickets_by_company = defaultdict(list)
-    for ticket in all_tickets_last_month:
-        if ticket.get('department_id'):
-            tickets_by_company[ticket['department_id']].append(ticket)
-
-    print("\n--- Processing Time Entries per Company ---")
-    time_tracking_data = []
-    company_id_map = {c['id']: c for c in companies}
-    companies_with_hours = 0
-
-    for company_id, tickets in tickets_by_company.items():
-        company_info = company_id_map.get(company_id)
-        account_number = (company_info.get('custom_fields') or {}).get(ACCOUNT_NUMBER_FIELD) if company_info else None
-        if not account_number:
-            continue
-
-        company_name = company_info.get('name')
-        total_hours_for_company = 0
-        print(f"-> Processing '{company_name}' ({len(tickets)} tickets)...")
-        for i, ticket in enumerate(tickets):
-            hours_for_ticket = get_time_entries_for_ticket(
-                base_url, headers, ticket['id'], first_day_of_last_month, end_of_last_month
-            )
-            if hours_for_ticket > 0:
-                print(f"  - Found {hours_for_ticket:.2f} hours for ticket #{ticket['id']}")
-                total_hours_for_company += hours_for_ticket
-
-        if total_hours_for_company > 0:
-            print(f"  => Total for '{company_name}': {total_hours_for_company:.2f} hours")
-            time_tracking_data.append((str(account_number), month_str, total_hours_for_company))
-            companies_with_hours += 1
-        else:
-            print(f"  => No billable time entries found for '{company_name}' in the period.")
-
-    print(f"\nTime entry processing complete. Found logged hours for {companies_with_hours} companies.")
-
-    all_users_to_insert = []
-    company_id_to_account_map = {c.get('id'): (c.get('custom_fields') or {}).get(ACCOUNT_NUMBER_FIELD) for c in companies}
-    print("\n--- Mapping Users to Companies ---")
-    for user in users:
-        for dept_id in (user.get('department_ids') or []):
-            account_num = company_id_to_account_map.get(dept_id)
-            if account_num:
-                all_users_to_insert.append((
-                    str(account_num), user.get('id'),
-                    f"{user.get('first_name', '')} {user.get('last_name', '')}".strip(),
-                    user.get('primary_email'), 'Active' if user.get('active', False) else 'Inactive',
-                    user.get('created_at', datetime.now(timezone.utc).isoformat())
-                ))
-                break
-
-    print(f"Mapped {len(all_users_to_insert)} user-company links.")
-
-    con = get_db_connection(DB_FILE, DB_MASTER_PASSWORD)
+    # DB_RAW_KEY from the web app, or DB_MASTER_PASSWORD when run by hand (derived once, here).
     try:
-        populate_companies_database(con, companies)
-        populate_users_database(con, all_users_to_insert)
-        update_ticket_hours(con, time_tracking_data)
+        DB_KEY = cipher_key.key_from_environment(DB_FILE)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+
+    API_KEY = get_freshservice_api_key(DB_KEY)
+    headers = http_client.freshservice_headers(API_KEY)
+    base_url = http_client.freshservice_base_url(FRESHSERVICE_DOMAIN)
+
+    # Users and tickets stream from the API in pages and are written in
+    # INSERT_BATCH_SIZE batches, each committed on its own together with the
+    # run's checkpoint, so memory use does not grow with the tenant and a
+    # failed run can be continued with --resume from its last batch.
+    con = get_db_connection(DB_FILE, DB_KEY)
+    try:
+        migrations.apply_migrations(con)
+        checkpoint = sync_checkpoints.load_checkpoint(con, CHECKPOINT_NAME)
+        if args.resume and checkpoint:
+            sync_started_at, progress = checkpoint
+            print(f"Resuming the sync started at {sync_started_at:%Y-%m-%d %H:%M} UTC.")
+            if args.backfill or args.full_resync:
+                print("Note: --backfill and --full-resync are ignored; the resumed run keeps its own.")
+        else:
+            if args.resume:
+                print("No unfinished sync to resume; starting a new one.")
+            # Stored as the new watermark once this run finishes; anything changed after this is picked up next time.
+            sync_started_at = datetime.now(timezone.utc)
+            if args.backfill:
+                first_month, last_month = args.backfill
+            else:
+                last_month = first_month = (sync_started_at.date().replace(day=1) - timedelta(days=1)).replace(day=1)
+            progress = {'months': [f"{first_month:%Y-%m}", f"{last_month:%Y-%m}"], 'full_resync': args.full_resync}
+
+        def save_progress(**updates):
+            """Records the run's progress; committed with the batch it describes."""
+            progress.update(updates)
+            sync_checkpoints.save_checkpoint(con, CHECKPOINT_NAME, sync_started_at, progress)
+
+        first_month, last_month = (parse_month(m) for m in progress['months'])
+        months = []
+        while not months or months[-1] < last_month:
+            months.append(next_month(months[-1]) if months else first_month)
+
+        departments_since, requesters_since, company_map = load_sync_state(con, progress['full_resync'])
+        if progress.get('companies_done'):
+            print(f"\nCompanies were synced by the interrupted run; {len(company_map)} are linked.")
+            requesters_since = progress['requesters_since']
+        else:
+            companies = get_all_companies(base_url, headers, departments_since)
+            if companies is None:
+                sys.exit("Could not fetch company data from Freshservice. Aborting.")
+
+            # Merge the changed departments into the ones already in the database.
+            newly_linked = False
+            for c in companies:
+                account_number = (c.get('custom_fields') or {}).get(ACCOUNT_NUMBER_FIELD)
+                if account_number:
+                    newly_linked |= c.get('id') not in company_map
+                    company_map[c.get('id')] = (str(account_number), c.get('name'))
+                else:
+                    company_map.pop(c.get('id'), None)
+
+            if requesters_since and newly_linked:
+                # Existing requesters of a department that just got its account number have not changed themselves.
+                print("\nNew companies have account numbers; fetching all users to link their existing members.")
+                requesters_since = None
+            save_progress(companies_done=True, requesters_since=requesters_since)
+            commit_batch(con, populate_companies_database(con, companies))
+
+        if progress.get('users_done'):
+            print("\nUsers were synced by the interrupted run.")
+        else:
+            # A batch is only written at a page boundary, so the checkpoint can name the last page it holds.
+            users_page = progress.get('users_page', 0)
+            users_written, pending_rows = 0, []
+            if users_page:
+                print(f"\nContinuing the user sync after page {users_page}.")
+            try:
+                for users_page, users in iter_user_pages(base_url, headers, requesters_since, users_page + 1):
+                    pending_rows.extend(user_rows(users, company_map))
+                    if len(pending_rows) >= INSERT_BATCH_SIZE:
+                        save_progress(users_page=users_page)
+                        commit_batch(con, populate_users_database(con, pending_rows))
+                        users_written += len(pending_rows)
+                        pending_rows = []
+                        print(f"   -> Saved {users_written} users so far.")
+            except requests.exceptions.RequestException:
+                sys.exit("Could not fetch user data from Freshservice. Aborting; run again with --resume to continue from here.")
+            save_progress(users_page=users_page, users_done=True)
+            commit_batch(con, populate_users_database(con, pending_rows) if pending_rows else set())
+            users_written += len(pending_rows)
+            print(f"-> Successfully inserted/updated {users_written} users.")
+
+        if len(months) > 1:
+            print(f"\nBackfilling ticket hours for {len(months)} months ({months[0]:%Y-%m} to {months[-1]:%Y-%m}).")
+        print(f"\n--- Processing Time Entries ({TIME_ENTRY_WORKERS} workers, max {rate_limiter.limiter_for('freshservice').requests_per_minute} requests/min) ---")
+        if progress.get('tickets_processed'):
+            # Tickets are listed again, but those already stored are unchanged and not fetched a second time.
+            print(f"The interrupted run processed {progress['tickets_processed']} tickets; they will be skipped.")
+        mapped_tickets = (
+            (ticket, company_map[ticket['department_id']][0])
+            for ticket in iter_tickets(base_url, headers, first_month, next_month(last_month) - timedelta(days=1))
+            if ticket.get('department_id') in company_map
+        )
+        checked = fetched = 0
+        # Kept in the checkpoint too: a resumed run must still clear the hours of tickets moved away before it stopped.
+        previous_accounts = set(progress.get('previous_accounts', []))
+        try:
+            for ticket_batch in billing_summary.chunks(mapped_tickets, INSERT_BATCH_SIZE):
+                changed_ids = {t['id'] for t in time_entries.changed_tickets(con, [ticket for ticket, _ in ticket_batch])}
+                fetched_batch = fetch_time_entries(base_url, headers, [(t, a) for t, a in ticket_batch if t['id'] in changed_ids])
+                previous_accounts |= store_time_entries(con, fetched_batch)
+                checked += len(ticket_batch)
+                fetched += len(fetched_batch)
+                save_progress(tickets_processed=max(checked, progress.get('tickets_processed', 0)), previous_accounts=sorted(previous_accounts))
+                con.commit()
+                print(f"-> {checked} tickets checked, time entries fetched for {fetched} of them.")
+        except requests.exceptions.RequestException:
+            sys.exit("Aborting due to failure in fetching tickets; run again with --resume to continue from here.")
+        print(f"\nTime entry processing complete. {checked - fetched} of {checked} tickets were unchanged since the last sync (or failed); their stored time entries are reused.")
+
+        account_names = dict(company_map.values())
+        for month in months:
+            print(f"\n--- Hours for {month:%Y-%m} ---")
+            hours_by_account = update_ticket_hours(
+                con, month.strftime('%Y-%m'), month.isoformat(), next_month(month).isoformat(), previous_accounts
+            )
+            for account_number, total_hours_for_company in sorted(hours_by_account.items()):
+                print(f"  => Total for '{account_names.get(account_number, account_number)}': {total_hours_for_company:.2f} hours")
+        sync_watermarks.set_watermark(con, 'departments', sync_started_at)
+        sync_watermarks.set_watermark(con, 'requesters', sync_started_at)
+        sync_checkpoints.clear_checkpoint(con, CHECKPOINT_NAME)
+        data_version.bump_generation(con)
         con.commit()
         print("\n All database operations committed successfully.")
     except sqlite3.Error as e:
         print(f"\n❌ Database error occurred: {e}", file=sys.stderr)
         con.rollback()
+        print("The batches committed before the error are kept; run again with --resume to continue from there.", file=sys.stderr)
         sys.exit(1)
     finally:
         if con:
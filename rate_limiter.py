@@ -0,0 +1,177 @@
+"""
+Client-side rate limiting and retries for the Freshservice and Datto APIs.
+
+Every request a sync script makes goes through send(), which takes a token
+from the API's shared bucket first. The bucket is sized to the quota in
+QUOTAS and then follows what the API reports: X-RateLimit-Total resizes it,
+X-RateLimit-Remaining drains it when other clients have used part of the
+window, and a 429 pauses every thread until Retry-After has passed.
+Throttled and transiently failed requests are retried with capped,
+jittered exponential backoff, at most MAX_RETRIES times.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+# Requests per minute. Freshservice's quota depends on the plan (100/min on
+# the smallest); Datto RMM allows 600 reads per minute per account.
+QUOTAS = {
+    'freshservice': int(os.environ.get('FRESHSERVICE_REQUESTS_PER_MINUTE', 100)),
+    'datto': int(os.environ.get('DATTO_REQUESTS_PER_MINUTE', 600)),
+}
+BURST_SECONDS = 10 # a full bucket holds this many seconds' worth of requests
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0 # seconds
+BACKOFF_CAP = 60.0 # seconds
+DEFAULT_RETRY_AFTER = 10 # seconds, for a 429 without a usable Retry-After
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Only these are retried after a timeout or a 5xx; a PUT or POST may already have been applied.
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class RateLimiter:
+    """A thread-safe token bucket refilled at `requests_per_minute`."""
+    def __init__(self, name, requests_per_minute):
+        self.name = name
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._updated = time.monotonic()
+        self.set_quota(requests_per_minute)
+        self._tokens = self.capacity
+
+    def set_quota(self, requests_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Blocks until a request may be sent, then takes one token."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Holds back every thread for `seconds` and empties the bucket."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def observe(self, headers):
+        """Adjusts the bucket to the X-RateLimit-* headers of a response, if it has them."""
+        total = _int_header(headers, 'X-RateLimit-Total') or _int_header(headers, 'X-RateLimit-Limit')
+        remaining = _int_header(headers, 'X-RateLimit-Remaining')
+        with self._lock:
+            if total and total != self.requests_per_minute:
+                self.set_quota(total)
+            if remaining is not None:
+                self._refill(time.monotonic())
+                self._tokens = min(self._tokens, float(remaining))
+        if remaining == 0:
+            reset = _seconds_until_reset(headers.get('X-RateLimit-Reset'))
+            if reset:
+                self.pause(reset)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(api):
+    """Returns the process-wide limiter for 'freshservice' or 'datto'."""
+    with _limiters_lock:
+        if api not in _limiters:
+            _limiters[api] = RateLimiter(api, QUOTAS[api])
+        return _limiters[api]
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff: a random delay up to min(cap, base * 2^attempt)."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    """Returns Retry-After (delta-seconds or an HTTP date) in seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _int_header(headers, name):
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _seconds_until_reset(value):
+    """X-RateLimit-Reset is either seconds to wait or an epoch timestamp."""
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, reset - time.time()) if reset > 1e9 else reset
+
+
+def send(api, method, url, session=None, **kwargs):
+    """
+    Sends one request through the API's limiter, retrying throttled and
+    transiently failed attempts. Returns the final response (the caller still
+    checks its status) or raises the last requests exception.
+    """
+    limiter = limiter_for(api)
+    http = session or requests
+    retryable = method.upper() in IDEMPOTENT_METHODS
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            response = http.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if not retryable or attempt >= MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"   -> {e.__class__.__name__} from {api}, retrying in {delay:.1f}s...")
+        else:
+            limiter.observe(response.headers)
+            status = response.status_code
+            if status not in RETRY_STATUSES or attempt >= MAX_RETRIES or (status != 429 and not retryable):
+                return response
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if status == 429:
+                delay = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+                print(f"   -> {api} rate limit hit, pausing all requests for {delay:.0f}s...")
+                # The limiter makes every thread (this one included) wait out the pause.
+                limiter.pause(delay)
+                delay = 0
+            else:
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                print(f"   -> HTTP {status} from {api}, retrying in {delay:.1f}s...")
+        attempt += 1
+        time.sleep(delay)
@@ -0,0 +1,40 @@
+"""
+An in-process cache of rendered pages, validated by the database change counter.
+
+Entries are keyed by an ETag derived from the data generation and the request
+path, so a matching If-None-Match can be answered with 304 before any SQL
+aggregate or template rendering runs, and a stale entry is simply never
+looked up again once the generation moves on.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def make_etag(*parts):
+    return hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # etag -> (body, mimetype)
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is not None:
+                self._entries.move_to_end(etag)
+            return entry
+
+    def put(self, etag, body, mimetype):
+        with self._lock:
+            self._entries[etag] = (body, mimetype)
+            self._entries.move_to_end(etag)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
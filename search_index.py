@@ -0,0 +1,102 @@
+"""
+Maintains the 'client_search' FTS5 index behind the dashboard search box.
+
+Each client has one document holding its company name, the hostnames and
+friendly names of its assets, and the names and emails of its users, so one
+MATCH finds a client by any of them. Like client_billing_summary, the sync
+scripts call refresh_search_index() for the accounts they touched.
+
+account_number is UNINDEXED in the FTS table, so filtering on it scans every
+document. client_search_rowids records each account's document rowid, so a
+refresh deletes and rewrites documents by rowid instead.
+"""
+import re
+
+from billing_summary import chunks
+
+# Created by migration 5 (see migrations.py). Prefix indexes keep
+# search-as-you-type queries ("ser*", "acme*") as fast as whole-word ones.
+SEARCH_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS client_search USING fts5(
+        account_number UNINDEXED,
+        name,
+        hostnames,
+        people,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+"""
+
+# Created by migrations 5 and 9. An account keeps its rowid across refreshes.
+SEARCH_ROWIDS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS client_search_rowids (
+        account_number TEXT PRIMARY KEY NOT NULL,
+        doc_rowid INTEGER NOT NULL UNIQUE
+    )
+"""
+
+REFRESH_SELECT = """
+    SELECT
+        c.account_number, c.name,
+        (SELECT group_concat(a.hostname || COALESCE(' ' || a.friendly_name, ''), ' ')
+            FROM assets a WHERE a.company_account_number = c.account_number) AS hostnames,
+        (SELECT group_concat(u.full_name || COALESCE(' ' || u.email, ''), ' ')
+            FROM users u WHERE u.company_account_number = c.account_number) AS people
+    FROM companies c
+"""
+
+INSERT_SQL = "INSERT INTO client_search (rowid, account_number, name, hostnames, people) VALUES (?, ?, ?, ?, ?)"
+
+
+def refresh_search_index(db_connection, account_numbers=None):
+    """
+    Rebuilds the search documents for the given account numbers, or for every
+    company when account_numbers is None. The caller is responsible for
+    committing. Returns the number of documents written.
+    """
+    cur = db_connection.cursor()
+
+    if account_numbers is None:
+        cur.execute("DELETE FROM client_search")
+        cur.execute("DELETE FROM client_search_rowids")
+        cur.execute(REFRESH_SELECT)
+        return _write_documents(cur, cur.fetchall(), {})
+
+    refreshed = 0
+    for chunk in chunks({str(a) for a in account_numbers if a is not None}):
+        placeholders = ", ".join("?" for _ in chunk)
+        doc_rowids = dict(cur.execute(
+            f"SELECT account_number, doc_rowid FROM client_search_rowids WHERE account_number IN ({placeholders})", chunk).fetchall())
+        cur.executemany("DELETE FROM client_search WHERE rowid = ?", [(rowid,) for rowid in doc_rowids.values()])
+        cur.execute(f"{REFRESH_SELECT} WHERE c.account_number IN ({placeholders})", chunk)
+        refreshed += _write_documents(cur, cur.fetchall(), doc_rowids)
+    return refreshed
+
+
+def _write_documents(cur, rows, doc_rowids):
+    """Inserts the documents under their account's rowid from `doc_rowids`, assigning and recording new ones."""
+    next_rowid = cur.execute("SELECT COALESCE(MAX(doc_rowid), 0) + 1 FROM client_search_rowids").fetchone()[0]
+    new_rowids = []
+    for row in rows:
+        if row[0] not in doc_rowids:
+            doc_rowids[row[0]] = next_rowid
+            new_rowids.append((row[0], next_rowid))
+            next_rowid += 1
+    cur.executemany("INSERT INTO client_search_rowids (account_number, doc_rowid) VALUES (?, ?)", new_rowids)
+    cur.executemany(INSERT_SQL, [(doc_rowids[row[0]], *row) for row in rows])
+    return len(rows)
+
+
+def build_match_query(text):
+    """
+    Turns free text from the search box into an FTS5 MATCH expression, or
+    returns None if it has nothing searchable. Every whitespace-separated term
+    must match; punctuation inside a term ("srv-01", "bob@acme") keeps its
+    parts together as a phrase, and the last part matches as a prefix.
+    """
+    phrases = []
+    for term in (text or '').split():
+        tokens = re.findall(r'\w+', term)
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"*')
+    return ' AND '.join(phrases) or None
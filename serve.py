@@ -0,0 +1,87 @@
+"""
+Production entry point: serves the dashboard with several Gunicorn worker
+processes behind TLS, instead of Flask's single-process development server.
+
+    python serve.py --workers 4
+
+Every worker signs sessions with the same key (see main.load_secret_key), so
+a user stays logged in whichever worker handles a request. Gunicorn only
+runs on Linux and macOS; on Windows keep using 'python main.py'.
+"""
+import argparse
+import os
+import sys
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    print("Error: gunicorn is not installed. Please install it using: pip install gunicorn", file=sys.stderr)
+    sys.exit(1)
+
+# --- Configuration ---
+DEFAULT_BIND = '0.0.0.0:5002'
+DEFAULT_WORKERS = min(4, (os.cpu_count() or 1) * 2 + 1)
+# Each Server-Sent Events stream of a running sync holds a thread for as long as it is open.
+DEFAULT_THREADS = 8
+CERT_FILE = 'cert.pem'
+KEY_FILE = 'key.pem'
+
+
+def post_worker_init(worker):
+    """Runs once in each worker process after it has been forked."""
+    import main
+    main.warm_worker()
+    worker.log.info("Worker %s warmed up.", worker.pid)
+
+
+def worker_exit(server, worker):
+    """Runs in a worker process as it exits; writes its last metrics so none are lost."""
+    import main
+    main.metrics_registry.flush()
+
+
+class DashboardApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import main
+        return main.app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the billing dashboard with multiple worker processes.")
+    parser.add_argument('--bind', default=DEFAULT_BIND, help=f"Address to listen on (default: {DEFAULT_BIND}).")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f"Worker processes (default: {DEFAULT_WORKERS}).")
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help=f"Threads per worker (default: {DEFAULT_THREADS}).")
+    args = parser.parse_args()
+
+    if not (os.path.exists(CERT_FILE) and os.path.exists(KEY_FILE)):
+        print(f"Error: SSL certificate ({CERT_FILE}) and key ({KEY_FILE}) not found.", file=sys.stderr)
+        print("Please run 'python generate_cert.py' to create them.", file=sys.stderr)
+        sys.exit(1)
+
+    import main
+    if not os.path.exists(main.DATABASE):
+        print(f"Error: Database '{main.DATABASE}' not found.", file=sys.stderr)
+        print("Please run 'python init_db.py' to create and configure it first.", file=sys.stderr)
+        sys.exit(1)
+
+    DashboardApplication({
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        'certfile': CERT_FILE,
+        'keyfile': KEY_FILE,
+        # Import the app (and create the shared secret key) once in the master before forking.
+        'preload_app': True,
+        'post_worker_init': post_worker_init,
+        'worker_exit': worker_exit,
+        'accesslog': '-',
+    }).run()
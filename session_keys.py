@@ -0,0 +1,87 @@
+"""
+Keeps the raw database key of each logged-in session on the server.
+
+The session cookie carries only a random token. The key itself is stored
+under KEYS_DIR, so every worker process can read it, encrypted with AES-GCM
+under a key derived from that token. Neither the cookie nor the files alone
+unlock the database. Logging out deletes the session's file, so a copied
+cookie stops working at once, and a file older than MAX_AGE is refused and
+pruned even if nobody logged out.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import time
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    print("Error: cryptography is not installed. Please install it using: pip install cryptography", file=sys.stderr)
+    sys.exit(1)
+
+KEYS_DIR = 'session_keys'
+MAX_AGE = 12 * 3600 # seconds a login stays valid
+NONCE_BYTES = 12
+
+
+class SessionKeyStore:
+    def __init__(self, keys_dir=KEYS_DIR, max_age=MAX_AGE):
+        self.keys_dir = keys_dir
+        self.max_age = max_age
+
+    def _path(self, token):
+        # Named by a hash of the token, so a directory listing does not reveal any cookie.
+        name = hmac.new(token.encode(), b'billing-dash-session-id', hashlib.sha256).hexdigest()
+        return os.path.join(self.keys_dir, f"{name}.key")
+
+    def _cipher(self, token):
+        return AESGCM(hmac.new(token.encode(), b'billing-dash-session-key', hashlib.sha256).digest())
+
+    def add(self, raw_key):
+        """Stores the raw key for a new session and returns the token to put in its cookie."""
+        os.makedirs(self.keys_dir, exist_ok=True)
+        self.prune()
+        token = secrets.token_urlsafe(32)
+        nonce = os.urandom(NONCE_BYTES)
+        sealed = self._cipher(token).encrypt(nonce, bytes.fromhex(raw_key), None)
+        fd = os.open(self._path(token), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(nonce + sealed)
+        return token
+
+    def get(self, token):
+        """Returns the session's raw key. Raises ValueError if it was revoked, has expired or does not match."""
+        path = self._path(token)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                self.remove(token)
+                raise ValueError("Session expired. Please log in again.")
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            raise ValueError("Database key not found in session.")
+        try:
+            return self._cipher(token).decrypt(data[:NONCE_BYTES], data[NONCE_BYTES:], None).hex()
+        except (InvalidTag, ValueError):
+            raise ValueError("Database key not found in session.")
+
+    def remove(self, token):
+        """Revokes the session's key, e.g. on logout."""
+        try:
+            os.remove(self._path(token))
+        except FileNotFoundError:
+            pass
+
+    def prune(self):
+        """Deletes the keys of sessions older than max_age."""
+        now = time.time()
+        for entry in os.listdir(self.keys_dir):
+            path = os.path.join(self.keys_dir, entry)
+            try:
+                if entry.endswith('.key') and now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -1,11 +1,10 @@
 import requests
-import base64
-import json
-import os
 import sys
-import time
 import random
 
+import cipher_key
+import http_client
+
 try:
     from sqlcipher3 import dbapi2 as sqlite3
 except ImportError:
@@ -15,26 +14,22 @@ except ImportError:
 # --- Configuration ---
 DB_FILE = "brainhair.db"
 FRESHSERVICE_DOMAIN = "integotecllc.freshservice.com"
-BASE_URL = f"https://{FRESHSERVICE_DOMAIN}"
+BASE_URL = http_client.freshservice_base_url(FRESHSERVICE_DOMAIN)
 ACCOUNT_NUMBER_FIELD = "account_number"
 COMPANIES_PER_PAGE = 100
-MAX_RETRIES = 3
-RETRY_DELAY = 5 # seconds
 
 # --- Utility Functions ---
-def get_db_connection(db_path, password):
-    """Establishes a connection to the encrypted database."""
-    if not password:
-        raise ValueError("A database password is required.")
+def get_db_connection(db_path, db_key):
+    """Establishes a connection to the encrypted database, unlocked with the raw key (no KDF)."""
     con = sqlite3.connect(db_path)
     cur = con.cursor()
-    cur.execute(f"PRAGMA key = '{password}';")
+    cur.execute(cipher_key.key_pragma(db_key))
     return con
 
-def get_freshservice_api_key(db_password):
+def get_freshservice_api_key(db_key):
     """Reads the Freshservice API key from the encrypted database."""
     try:
-        con = get_db_connection(DB_FILE, db_password)
+        con = get_db_connection(DB_FILE, db_key)
         cur = con.cursor()
         cur.execute("SELECT api_key FROM api_keys WHERE service = 'freshservice'")
         creds = cur.fetchone()
@@ -43,7 +38,7 @@ def get_freshservice_api_key(db_password):
             raise ValueError("Freshservice credentials not found in the database.")
         return creds[0]
     except sqlite3.Error as e:
-        sys.exit(f"Database error while fetching credentials: {e}. Is the password correct?")
+        sys.exit(f"Database error while fetching credentials: {e}. Is the key correct?")
 
 
 # --- API Functions ---
@@ -57,12 +52,7 @@ def get_all_companies(base_url, headers):
     while True:
         params = {'page': page, 'per_page': COMPANIES_PER_PAGE}
         try:
-            response = requests.get(endpoint, headers=headers, params=params, timeout=30)
-            if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', RETRY_DELAY))
-                print(f"Rate limit exceeded. Waiting {retry_after} seconds...")
-                time.sleep(retry_after)
-                continue
+            response = http_client.get('freshservice', endpoint, headers=headers, params=params)
             response.raise_for_status()
             data = response.json()
             companies_on_page = data.get('departments', [])
@@ -88,7 +78,7 @@ def update_company_account_number(base_url, headers, company_id, account_number)
     }
 
     try:
-        response = requests.put(endpoint, headers=headers, json=payload, timeout=30)
+        response = http_client.put('freshservice', endpoint, headers=headers, json=payload)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
@@ -102,17 +92,14 @@ if __name__ == "__main__":
     print(" Freshservice Account Number Setter")
     print("==========================================")
 
-    DB_MASTER_PASSWORD = os.environ.get('DB_MASTER_PASSWORD')
-    if not DB_MASTER_PASSWORD:
-        sys.exit("Error: The DB_MASTER_PASSWORD environment variable must be set.")
+    # DB_RAW_KEY from the web app, or DB_MASTER_PASSWORD when run by hand (derived once, here).
+    try:
+        DB_KEY = cipher_key.key_from_environment(DB_FILE)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error: {e}")
 
-    API_KEY = get_freshservice_api_key(DB_MASTER_PASSWORD)
-    auth_str = f"{API_KEY}:X"
-    encoded_auth = base64.b64encode(auth_str.encode()).decode()
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Basic {encoded_auth}"
-    }
+    API_KEY = get_freshservice_api_key(DB_KEY)
+    headers = http_client.freshservice_headers(API_KEY)
 
     # 1. Fetch all companies
     companies = get_all_companies(BASE_URL, headers)
@@ -161,8 +148,6 @@ if __name__ == "__main__":
         if success:
             existing_numbers.add(new_number)
             updated_count += 1
-            # Be respectful of API rate limits
-            time.sleep(0.5)
         else:
             print(f"Skipping '{company_name}' due to update failure.")
 
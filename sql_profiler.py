@@ -0,0 +1,139 @@
+"""
+Per-request SQL tracing for the opt-in profiling mode.
+
+While a request is being profiled, get_db() hands out a TracedConnection that
+records every statement run through it: the SQL, how many parameters were
+bound, the wall time spent executing and fetching, and how many rows came
+back. Statements slower than the threshold also get their EXPLAIN QUERY PLAN
+captured, so full table scans stand out immediately.
+"""
+import time
+
+
+class SqlTrace:
+    def __init__(self, explain_threshold_ms=5.0):
+        self.explain_threshold_ms = explain_threshold_ms
+        self.statements = []
+        self.started = time.perf_counter()
+
+    def record(self, sql, params, many=False):
+        entry = {
+            'sql': " ".join(sql.split()),
+            'binds': (sum(len(p) for p in params) if many else len(params)) if params else 0,
+            'executemany': many,
+            'ms': 0.0,
+            'rows': 0,
+            'plan': None,
+            '_sql': sql,
+            '_params': None if many else params,
+        }
+        self.statements.append(entry)
+        return entry
+
+    def explain_slow(self, connection):
+        """Captures EXPLAIN QUERY PLAN for read statements slower than the threshold."""
+        for entry in self.statements:
+            if entry['ms'] < self.explain_threshold_ms or entry['executemany']:
+                continue
+            if not entry['sql'].lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            try:
+                rows = connection.execute(f"EXPLAIN QUERY PLAN {entry['_sql']}", entry['_params'] or ()).fetchall()
+            except Exception as e:
+                entry['plan'] = [f"(could not explain: {e})"]
+                continue
+            entry['plan'] = [row[3] for row in rows]
+
+    def to_dict(self):
+        statements = [{k: v for k, v in entry.items() if not k.startswith('_')} for entry in self.statements]
+        for entry in statements:
+            entry['full_scan'] = any(is_full_scan(line) for line in entry['plan'] or [])
+        return {
+            'request_ms': (time.perf_counter() - self.started) * 1000,
+            'sql_ms': sum(entry['ms'] for entry in statements),
+            'statement_count': len(statements),
+            'explain_threshold_ms': self.explain_threshold_ms,
+            'statements': statements,
+        }
+
+
+def is_full_scan(plan_line):
+    """
+    SQLite reports a table scan without an index as 'SCAN <table>'. Virtual
+    tables (the FTS5 search index) show up as 'SCAN ... VIRTUAL TABLE INDEX'
+    even when they use their own index, so they are not counted.
+    """
+    return plan_line.startswith('SCAN') and 'USING' not in plan_line and 'VIRTUAL TABLE' not in plan_line
+
+
+class TracedCursor:
+    def __init__(self, cursor, trace):
+        self._cursor = cursor
+        self._trace = trace
+        self._entry = None
+
+    def _timed(self, entry, call, *args):
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            entry['ms'] += (time.perf_counter() - start) * 1000
+
+    def execute(self, sql, params=()):
+        self._entry = self._trace.record(sql, params)
+        self._timed(self._entry, self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        self._entry = self._trace.record(sql, seq_of_params, many=True)
+        self._timed(self._entry, self._cursor.executemany, sql, seq_of_params)
+        return self
+
+    def fetchone(self):
+        row = self._timed(self._entry, self._cursor.fetchone) if self._entry else self._cursor.fetchone()
+        if row is not None and self._entry:
+            self._entry['rows'] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        args = () if size is None else (size,)
+        rows = self._timed(self._entry, self._cursor.fetchmany, *args) if self._entry else self._cursor.fetchmany(*args)
+        if self._entry:
+            self._entry['rows'] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._entry, self._cursor.fetchall) if self._entry else self._cursor.fetchall()
+        if self._entry:
+            self._entry['rows'] += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TracedConnection:
+    """Wraps a connection so statements run through it are recorded in `trace`."""
+    def __init__(self, connection, trace):
+        self._connection = connection
+        self._trace = trace
+
+    def cursor(self):
+        return TracedCursor(self._connection.cursor(), self._trace)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
@@ -0,0 +1,196 @@
+"""
+Times the sync scripts end to end against the local API stand-in in
+mock_api.py and counts the API calls each run makes.
+
+    python sync_benchmark.py --tickets 10000 --devices 50000 --json results/sync-v1.json
+    python sync_benchmark.py --latency-ms 80 --throttle-rate 0.02 --runs 1
+
+A fresh encrypted database is built in a scratch directory, the mock server
+is started in this process and each script is run as a subprocess, exactly
+as the web app runs it, --runs times in a row (the first run is a cold full
+sync, later ones show what the incremental paths save). Script output goes to
+a log file per run in the scratch directory.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import cipher_key
+import http_client
+import init_db
+import migrations
+import mock_api
+
+try:
+    from sqlcipher3 import dbapi2 as sqlite3
+except ImportError:
+    print("Error: sqlcipher3-wheels is not installed. Please install it using: pip install sqlcipher3-wheels", file=sys.stderr)
+    sys.exit(1)
+
+# --- Configuration ---
+DEFAULT_PASSWORD = "benchmark"
+DEFAULT_SCRIPTS = ["pull_freshservice.py", "pull_datto.py"]
+SYNC_SCRIPTS = ["set_account_numbers.py", "pull_freshservice.py", "push_account_nums_to_datto.py", "pull_datto.py"]
+# High enough that the client-side limiter does not set the pace; pass the real quotas to measure against them.
+DEFAULT_REQUESTS_PER_MINUTE = 60000
+SCRIPT_TIMEOUT = 3600 # seconds
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_database(path, password, datto_endpoint):
+    """Creates an empty encrypted database with the full schema and mock API credentials."""
+    con = sqlite3.connect(path)
+    try:
+        cur = con.cursor()
+        cur.execute(f"PRAGMA key = '{password}';")
+        init_db.create_schema(cur)
+        migrations.apply_migrations(con)
+        cur.execute("INSERT INTO api_keys (service, api_key) VALUES ('freshservice', 'mock-key')")
+        cur.execute("INSERT INTO api_keys (service, api_endpoint, api_key, api_secret) VALUES ('datto', ?, 'mock-key', 'mock-secret')", (datto_endpoint,))
+        con.commit()
+    finally:
+        con.close()
+
+
+def table_counts(path, raw_key):
+    con = sqlite3.connect(path)
+    try:
+        cipher_key.unlock(con, raw_key)
+        return {
+            table: con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ('companies', 'users', 'assets', 'time_entries', 'ticket_work_hours')
+        }
+    finally:
+        con.close()
+
+
+def run_script(script, script_args, workdir, env, log_path):
+    """Runs one sync script to completion. Returns (exit code, seconds)."""
+    started = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        try:
+            result = subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, script), *script_args],
+                                    cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, timeout=SCRIPT_TIMEOUT)
+            code = result.returncode
+        except subprocess.TimeoutExpired:
+            code = None
+    return code, time.perf_counter() - started
+
+
+def print_results(results):
+    header = f"{'script':<32} {'run':>3} {'exit':>5} {'seconds':>9} {'calls':>7} {'429s':>6} {'calls/s':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        calls, throttled = sum(r['calls'].values()), sum(r['throttled'].values())
+        exit_code = 't/o' if r['exit_code'] is None else r['exit_code']
+        print(f"{r['script']:<32} {r['run']:>3} {exit_code:>5} {r['seconds']:>9.2f} {calls:>7} {throttled:>6} {calls / r['seconds']:>8.1f}")
+
+    print("\nAPI calls per endpoint:")
+    for r in results:
+        print(f"  {r['script']} (run {r['run']}):")
+        for name in sorted(r['calls']):
+            throttled = r['throttled'].get(name)
+            print(f"    {name:<32} {r['calls'][name]:>7}" + (f"  ({throttled} throttled)" if throttled else ""))
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the sync scripts end to end against a local mock API.")
+    parser.add_argument('--script', action='append', choices=SYNC_SCRIPTS,
+                        help=f"Script to run, in the order given (repeatable; default: {' and '.join(DEFAULT_SCRIPTS)}).")
+    parser.add_argument('--runs', type=int, default=2, help="Consecutive runs of each script (default: 2).")
+    parser.add_argument('--freshservice-rpm', type=int, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help=f"Freshservice quota the scripts pace themselves to (default: {DEFAULT_REQUESTS_PER_MINUTE}).")
+    parser.add_argument('--datto-rpm', type=int, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help=f"Datto RMM quota the scripts pace themselves to (default: {DEFAULT_REQUESTS_PER_MINUTE}).")
+    parser.add_argument('--workdir', help="Directory for the database and logs (default: a new temporary directory).")
+    parser.add_argument('--keep', action='store_true', help="Keep the temporary directory afterwards.")
+    parser.add_argument('--json', dest='json_path', help="Write the results to this JSON file.")
+    mock_api.add_data_arguments(parser)
+    args = parser.parse_args()
+    scripts = args.script or DEFAULT_SCRIPTS
+
+    print(" Sync Benchmark")
+    print("==========================================")
+    if args.workdir:
+        workdir = os.path.abspath(args.workdir)
+        os.makedirs(workdir, exist_ok=True)
+        if os.path.exists(os.path.join(workdir, init_db.DB_FILE)):
+            sys.exit(f"Error: '{workdir}' already holds a {init_db.DB_FILE}. Use an empty directory.")
+    else:
+        workdir = tempfile.mkdtemp(prefix="sync-benchmark-")
+    db_path = os.path.join(workdir, init_db.DB_FILE)
+
+    api = mock_api.build_api(args)
+    server = mock_api.start_server(api)
+    print(f"Mock API at {api.base_url}: {len(api.data.departments)} departments, {len(api.data.requesters)} requesters, "
+          f"{len(api.data.tickets)} tickets, {sum(s['devices'] for s in api.data.sites)} devices.")
+    if args.latency_ms or args.throttle_rate:
+        print(f"Injecting {args.latency_ms:.0f} ms (+/- {args.jitter_ms:.0f} ms) latency and 429s on {args.throttle_rate:.1%} of requests.")
+
+    results = []
+    try:
+        build_database(db_path, DEFAULT_PASSWORD, f"{api.base_url}/datto")
+        # Derived once and handed over like the web app does, so no run pays for the key derivation.
+        raw_key = cipher_key.derive_raw_key(db_path, DEFAULT_PASSWORD)
+        env = dict(os.environ)
+        env.pop(cipher_key.PASSWORD_ENV, None)
+        env.update({
+            cipher_key.RAW_KEY_ENV: raw_key,
+            http_client.FRESHSERVICE_BASE_URL_ENV: f"{api.base_url}/freshservice",
+            http_client.DATTO_API_ENDPOINT_ENV: f"{api.base_url}/datto",
+            'FRESHSERVICE_REQUESTS_PER_MINUTE': str(args.freshservice_rpm),
+            'DATTO_REQUESTS_PER_MINUTE': str(args.datto_rpm),
+            'PYTHONUNBUFFERED': '1',
+        })
+        print(f"Working in '{workdir}'.\n")
+
+        for script in scripts:
+            for run in range(1, args.runs + 1):
+                print(f"Running {script} (run {run})...", end=" ", flush=True)
+                api.reset_counts()
+                log_path = os.path.join(workdir, f"{os.path.splitext(script)[0]}-{run}.log")
+                exit_code, seconds = run_script(script, [], workdir, env, log_path)
+                calls, throttled = api.counts()
+                results.append({'script': script, 'run': run, 'exit_code': exit_code, 'seconds': seconds,
+                                'calls': calls, 'throttled': throttled, 'log': log_path})
+                status = "✅" if exit_code == 0 else f"❌ (see {log_path})"
+                print(f"{seconds:.2f}s, {sum(calls.values())} API calls {status}")
+
+        counts = table_counts(db_path, raw_key)
+        print("\nDatabase after the runs: " + ", ".join(f"{count} {table}" for table, count in counts.items()) + "\n")
+        print_results(results)
+    finally:
+        server.shutdown()
+
+    if args.json_path:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json_path)), exist_ok=True)
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'dataset': {key: getattr(args, key) for key in ('companies', 'users', 'tickets', 'entries_per_ticket', 'devices', 'months', 'seed')},
+                'faults': {key: getattr(args, key) for key in ('latency_ms', 'jitter_ms', 'throttle_rate', 'retry_after')},
+                'quotas': {'freshservice': args.freshservice_rpm, 'datto': args.datto_rpm},
+                'python': platform.python_version(),
+                'database': counts,
+                'results': results,
+            }, f, indent=2)
+        print(f"\nResults written to '{args.json_path}'.")
+
+    failed = any(r['exit_code'] != 0 for r in results)
+    # The logs of a failed run are kept for reading.
+    if not args.workdir and not args.keep and not failed:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failed:
+        print(f"\n❌ At least one sync run failed. Logs are in '{workdir}'.")
+        sys.exit(1)
+    print("\n✅ All sync runs finished.")
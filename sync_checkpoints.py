@@ -0,0 +1,51 @@
+"""
+Progress checkpoints for resumable sync runs.
+
+A sync script records how far it has got (the stages finished, the last
+page written, the sites done, ...) as a small JSON document. It saves it in
+the same transaction as each batch of rows it commits, so the checkpoint
+never claims more than the database holds. A run started with --resume
+loads it and skips the work already done. A run that finishes deletes it.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+# Created by migration 8 (see migrations.py).
+CHECKPOINTS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sync_checkpoints (
+        sync TEXT PRIMARY KEY NOT NULL,
+        started_at TEXT NOT NULL,
+        progress TEXT NOT NULL,
+        updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# An older checkpoint is not resumed; the data it was based on has moved on too far.
+MAX_AGE = timedelta(days=1)
+
+
+def load_checkpoint(db_connection, sync):
+    """
+    Returns (started_at, progress) of the sync's unfinished run, started_at as
+    an aware UTC datetime, or None if there is none or it is older than MAX_AGE.
+    """
+    row = db_connection.execute("SELECT started_at, progress FROM sync_checkpoints WHERE sync = ?", (sync,)).fetchone()
+    if row is None:
+        return None
+    started_at = datetime.fromisoformat(row[0])
+    if datetime.now(timezone.utc) - started_at > MAX_AGE:
+        return None
+    return started_at, json.loads(row[1])
+
+
+def save_checkpoint(db_connection, sync, started_at, progress):
+    """Records the run's progress (a JSON-serializable dict). The caller commits it with the rows it covers."""
+    db_connection.execute("""
+        INSERT INTO sync_checkpoints (sync, started_at, progress, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(sync) DO UPDATE SET started_at = excluded.started_at, progress = excluded.progress, updated_at = CURRENT_TIMESTAMP
+    """, (sync, started_at.astimezone(timezone.utc).isoformat(), json.dumps(progress)))
+
+
+def clear_checkpoint(db_connection, sync):
+    """Deletes the sync's checkpoint once its run has finished. The caller commits."""
+    db_connection.execute("DELETE FROM sync_checkpoints WHERE sync = ?", (sync,))
@@ -0,0 +1,45 @@
+"""
+Per-entity high-water marks for incremental syncs.
+
+A sync script records, for each entity it pulls ('departments',
+'requesters', ...), the time its last successful run started. The next run
+asks the API only for records updated since then. The mark is written in
+the same transaction as the records it covers, so a failed run leaves the
+previous mark in place and its delta is fetched again.
+"""
+from datetime import datetime, timedelta, timezone
+
+# Created by migration 6 (see migrations.py).
+WATERMARKS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sync_watermarks (
+        entity TEXT PRIMARY KEY NOT NULL,
+        last_synced_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Records changed while the previous run was fetching, or stamped by a
+# server clock running slightly behind ours, must not fall between two runs.
+OVERLAP = timedelta(minutes=5)
+
+
+def get_watermark(db_connection, entity):
+    """Returns the entity's last_synced_at as an aware UTC datetime, or None if it was never synced."""
+    row = db_connection.execute("SELECT last_synced_at FROM sync_watermarks WHERE entity = ?", (entity,)).fetchone()
+    return datetime.fromisoformat(row[0]) if row else None
+
+
+def updated_since(db_connection, entity):
+    """Returns the 'updated since' timestamp to request for the entity (ISO 8601, UTC), or None for a full sync."""
+    watermark = get_watermark(db_connection, entity)
+    if watermark is None:
+        return None
+    return (watermark - OVERLAP).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def set_watermark(db_connection, entity, synced_at):
+    """Records `synced_at` (the start of the run) for the entity. The caller commits it with the synced rows."""
+    db_connection.execute("""
+        INSERT INTO sync_watermarks (entity, last_synced_at, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(entity) DO UPDATE SET last_synced_at = excluded.last_synced_at, updated_at = CURRENT_TIMESTAMP
+    """, (entity, synced_at.astimezone(timezone.utc).isoformat()))
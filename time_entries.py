@@ -0,0 +1,99 @@
+"""
+Local copy of Freshservice ticket time entries.
+
+pull_freshservice.py stores every time entry of the tickets it syncs, along
+with each ticket's updated_at. On the next run a ticket whose updated_at has
+not changed is skipped without calling the API (logging time updates the
+ticket), and monthly hours, or the hours for any other period, are summed
+here with SQL instead of being re-fetched.
+"""
+from datetime import datetime, timezone
+
+from billing_summary import chunks
+
+# Created by migration 7 (see migrations.py).
+TIME_ENTRIES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS time_entries (
+        id INTEGER PRIMARY KEY,
+        ticket_id INTEGER NOT NULL,
+        company_account_number TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        hours REAL NOT NULL
+    )
+"""
+# Covers the period aggregate without touching the table.
+TIME_ENTRIES_CREATED_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_time_entries_created
+    ON time_entries (created_at, company_account_number, hours)
+"""
+TIME_ENTRIES_TICKET_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_time_entries_ticket
+    ON time_entries (ticket_id)
+"""
+SYNCED_TICKETS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS synced_tickets (
+        ticket_id INTEGER PRIMARY KEY,
+        updated_at TEXT NOT NULL,
+        synced_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def parse_hours(time_spent):
+    """Converts Freshservice's 'hh:mm' time_spent to hours."""
+    h, m = map(int, (time_spent or '00:00').split(':'))
+    return h + (m / 60.0)
+
+
+def _utc_iso(timestamp):
+    # Stored in one fixed format so period bounds can be compared as strings.
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).astimezone(timezone.utc).isoformat()
+
+
+def changed_tickets(db_connection, tickets):
+    """Returns the tickets whose updated_at differs from the one stored when they were last synced."""
+    stored = {}
+    for chunk in chunks({t['id'] for t in tickets}):
+        placeholders = ", ".join("?" for _ in chunk)
+        stored.update(db_connection.execute(
+            f"SELECT ticket_id, updated_at FROM synced_tickets WHERE ticket_id IN ({placeholders})", chunk
+        ).fetchall())
+    return [t for t in tickets if stored.get(t['id']) != t.get('updated_at')]
+
+
+def store_ticket_entries(db_connection, ticket_id, updated_at, account_number, entries):
+    """
+    Replaces the stored time entries of one ticket and records its updated_at.
+    Returns the account numbers the ticket's entries were stored under before,
+    so a caller can tell when a ticket moved to another company. The caller commits.
+    """
+    cur = db_connection.cursor()
+    previous = {row[0] for row in cur.execute(
+        "SELECT DISTINCT company_account_number FROM time_entries WHERE ticket_id = ?", (ticket_id,))}
+    cur.execute("DELETE FROM time_entries WHERE ticket_id = ?", (ticket_id,))
+    cur.executemany("""
+        INSERT INTO time_entries (id, ticket_id, company_account_number, created_at, hours) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET ticket_id = excluded.ticket_id, company_account_number = excluded.company_account_number,
+            created_at = excluded.created_at, hours = excluded.hours
+    """, [
+        (e['id'], ticket_id, account_number, _utc_iso(e['created_at']), parse_hours(e.get('time_spent')))
+        for e in entries
+    ])
+    cur.execute("""
+        INSERT INTO synced_tickets (ticket_id, updated_at, synced_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(ticket_id) DO UPDATE SET updated_at = excluded.updated_at, synced_at = CURRENT_TIMESTAMP
+    """, (ticket_id, updated_at or ''))
+    return previous
+
+
+def hours_by_account(db_connection, start, end):
+    """
+    Sums the stored hours per account for entries created in [start, end).
+    start and end are 'YYYY-MM-DD' dates (or full UTC ISO timestamps).
+    """
+    return dict(db_connection.execute("""
+        SELECT company_account_number, SUM(hours)
+        FROM time_entries
+        WHERE created_at >= ? AND created_at < ?
+        GROUP BY company_account_number
+    """, (start, end)).fetchall())